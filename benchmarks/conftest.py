@@ -0,0 +1,63 @@
+"""Fixtures for the benchmarks
+
+The benchmarks use pytest-benchmark and run against trim-f34 and
+synthetic trim-like files of increasing size. Next to the timings the
+throughput (bytes per second) and the peak memory (tracemalloc) of every
+operation are stored in the extra info of the benchmark.
+"""
+import os
+import tracemalloc
+
+import pytest
+
+import nefis.testing
+
+TESTDIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tests')
+
+# (n, m, k, ntimes) of the synthetic files
+SIZES = {
+    'small': (20, 30, 3, 10),
+    'medium': (100, 200, 5, 50)
+}
+
+
+@pytest.fixture(scope='session')
+def synthetic(tmpdir_factory):
+    """return the (cached) synthetic file of a size in SIZES"""
+    cache = {}
+
+    def get(size):
+        if size not in cache:
+            path = str(tmpdir_factory.mktemp('synthetic').join('%s.def' % (size, )))
+            n, m, k, ntimes = SIZES[size]
+            cache[size] = nefis.testing.make_synthetic(path, n=n, m=m, k=k, ntimes=ntimes)
+        return cache[size]
+    return get
+
+
+@pytest.fixture(params=['f34'] + sorted(SIZES))
+def def_file(request, synthetic):
+    """trim-f34 and the synthetic files"""
+    if request.param == 'f34':
+        return os.path.join(TESTDIR, 'data', 'trim-f34.def')
+    return synthetic(request.param)
+
+
+@pytest.fixture()
+def measure(benchmark):
+    """benchmark func and record bytes per second (for nbytes) and peak memory"""
+    def run(func, nbytes=None):
+        result = benchmark(func)
+        tracemalloc.start()
+        try:
+            func()
+            benchmark.extra_info['peak_memory'] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        if nbytes is not None:
+            benchmark.extra_info['bytes'] = nbytes
+            # no stats with --benchmark-disable
+            if benchmark.stats is not None:
+                benchmark.extra_info['bytes_per_second'] = nbytes / benchmark.stats.stats.mean
+        return result
+    return run
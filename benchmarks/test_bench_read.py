@@ -0,0 +1,59 @@
+import pytest
+
+import nefis.cnefis
+import nefis.dataset
+import nefis.defparse
+
+pytest.importorskip('pytest_benchmark')
+
+
+@pytest.fixture()
+def ds(def_file):
+    ds = nefis.dataset.Nefis(def_file)
+    yield ds
+    ds.close()
+
+
+def test_open(measure, def_file):
+    dat_file = def_file.replace('.def', '.dat')
+
+    def open_close():
+        error, fd = nefis.cnefis.crenef(dat_file, def_file, ' ', 'r')
+        nefis.cnefis.clsnef(fd)
+    measure(open_close)
+
+
+def test_catalog(measure, ds):
+    def catalog():
+        ds.refresh()
+        return ds.groups, ds.cells, ds.variables
+    measure(catalog)
+
+
+def test_catalog_defparse(measure, def_file):
+    def catalog():
+        definitions = nefis.defparse.parse(def_file)
+        return definitions.groups, definitions.cells, definitions.variables
+    measure(catalog)
+
+
+def test_read_timestep(measure, ds):
+    nbytes = ds.element_info('S1')['nbytes']
+    measure(lambda: ds.read('map-series', 'S1', t=0), nbytes=nbytes)
+
+
+def test_read_range(measure, ds):
+    ntimes = ds.time_range('map-series', slice(None))[3]
+    nbytes = ds.element_info('U1')['nbytes'] * ntimes
+    measure(lambda: ds.read('map-series', 'U1', t=slice(None)), nbytes=nbytes)
+
+
+def test_read_strings(measure, ds):
+    name = 'NAMCON' if 'NAMCON' in ds.elements else 'NAMST'
+    nbytes = ds.element_info(name)['nbytes']
+    group = ds.raw_variables[name].group
+    measure(lambda: ds.get_data(group, name), nbytes=nbytes)
+
+
+def test_dump_json(measure, ds):
+    measure(ds.dump_json)
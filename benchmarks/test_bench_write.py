@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+import nefis.cnefis
+import nefis.dataset
+import nefis.subset
+
+pytest.importorskip('pytest_benchmark')
+
+
+@pytest.fixture(params=[(100, 200), (500, 1000)])
+def new_file(request, tmpdir):
+    """an empty series group with one field element"""
+    m, n = request.param
+    ds = nefis.subset.create(str(tmpdir.join('write.def')))
+    ds.define_element('S1', 'REAL', 4, (n, m))
+    ds.define_element('NAMES', 'CHARACTE', 20, (m, ))
+    ds.define_cell('map-series', ['S1', 'NAMES'])
+    ds.define_group('map-series', 'map-series')
+    ds.create_group('map-series')
+    yield ds
+    ds.close()
+
+
+def test_putelt(measure, new_file):
+    ds = new_file
+    block = np.ones((10, ) + ds.element_info('S1')['shape'], dtype='float32')
+    measure(lambda: ds.write_range('map-series', 'S1', 0, block), nbytes=block.nbytes)
+
+
+def test_putels(measure, new_file):
+    ds = new_file
+    m = ds.element_info('NAMES')['shape'][0]
+    names = ['name %d' % i for i in range(m)]
+    usr_index = np.zeros((5, 3), dtype=np.int32)
+    usr_index[0] = [1, 1, 1]
+    usr_order = np.arange(1, 6, dtype=np.int32)
+
+    def put():
+        nefis.dataset.wrap_error(nefis.cnefis.putels)(
+            ds.filehandle, 'map-series', 'NAMES', usr_index, usr_order, names
+        )
+    measure(put, nbytes=20 * m)
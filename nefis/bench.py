@@ -0,0 +1,200 @@
+"""A standard read/write workload to measure nefis performance
+
+run times every operation of the workload a number of times and returns
+a JSON serializable result with the durations, latency percentiles and
+throughput. compare checks a result against a saved baseline with a one
+sided Mann-Whitney U test per operation, so that a slowdown is only
+flagged when it is statistically significant and larger than a
+threshold.
+"""
+from __future__ import print_function, unicode_literals, division, absolute_import
+
+import datetime
+import logging
+import math
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import timeit
+
+import numpy as np
+
+import nefis.cnefis
+import nefis.dataset
+import nefis.subset
+import nefis.testing
+
+logger = logging.getLogger(__name__)
+
+PERCENTILES = (50, 90, 99)
+# a slowdown is flagged if it is significant at ALPHA and the median is THRESHOLD slower
+ALPHA = 0.01
+THRESHOLD = 0.05
+
+
+def series_element(ds):
+    """the largest numerical element of a group with more than one timestep, as (group, element)"""
+    candidates = []
+    for name, variable in ds.raw_variables.items():
+        info = ds.element_info(name)
+        if info['dtype'] is bytes:
+            continue
+        if ds.time_range(variable.group, slice(None))[3] > 1:
+            candidates.append((info['nbytes'], variable.group, name))
+    if not candidates:
+        raise ValueError("%s has no series to benchmark" % (ds.def_file, ))
+    _, group, name = max(candidates)
+    return group, name
+
+
+def workload(def_file, tmpdir, write=True):
+    """return the opened files and an ordered list of (operation, function, nbytes) for a file"""
+    dat_file = def_file.replace('.def', '.dat')
+    ds = nefis.dataset.Nefis(def_file)
+    group, element = series_element(ds)
+    info = ds.element_info(element)
+    ntimes = ds.time_range(group, slice(None))[3]
+    state = dict(t=0)
+
+    def open_close():
+        error, fd = nefis.cnefis.crenef(dat_file, def_file, ' ', 'r')
+        nefis.cnefis.clsnef(fd)
+
+    def catalog():
+        ds.refresh()
+        return ds.variables
+
+    def read_timestep():
+        # walk through the timesteps, so not always the same cell is read
+        state['t'] = (state['t'] + 1) % ntimes
+        return ds.read(group, element, t=state['t'])
+
+    handles = [ds]
+    operations = [
+        ('open', open_close, None),
+        ('catalog', catalog, None),
+        ('read_timestep', read_timestep, info['nbytes']),
+        ('read_range', lambda: ds.read(group, element, t=slice(None)), info['nbytes'] * ntimes),
+        ('read_cell', lambda: ds.read_cell(group, t=0), ds.group_cell(group)['size']),
+        ('timeseries', lambda: ds.timeseries(group, element, (0, ) * len(info['shape'])), info['nbytes'] * ntimes)
+    ]
+    if write:
+        out = nefis.subset.create(os.path.join(tmpdir, 'bench.def'), overwrite=True)
+        out.define_element(element, info['type'], info['single_bytes'], info['dimensions'])
+        out.define_cell(group, [element])
+        out.define_group(group, group)
+        out.create_group(group)
+        handles.append(out)
+        block = ds.read(group, element, t=slice(0, min(ntimes, 10)))
+        operations.append((
+            'write_range',
+            lambda: out.write_range(group, element, 0, block),
+            block.nbytes
+        ))
+    return handles, operations
+
+
+def summarize(durations, nbytes=None):
+    """latency percentiles (seconds) and throughput (bytes/s at the median) of durations"""
+    durations = np.asarray(durations, dtype='float64')
+    summary = dict(
+        n=int(durations.size),
+        mean=float(durations.mean()),
+        min=float(durations.min()),
+        max=float(durations.max())
+    )
+    for percentile in PERCENTILES:
+        summary['p%d' % (percentile, )] = float(np.percentile(durations, percentile))
+    if nbytes:
+        summary['nbytes'] = int(nbytes)
+        summary['bytes_per_second'] = nbytes / summary['p50'] if summary['p50'] > 0 else None
+    return summary
+
+
+def run(def_file=None, repeat=20, write=True, synthetic=None):
+    """run the workload on def_file (or a synthetic file, see nefis.testing) and return the result
+
+    synthetic is a dict of make_synthetic arguments.
+    """
+    tmpdir = tempfile.mkdtemp(prefix='nefis-bench-')
+    try:
+        if def_file is None:
+            def_file = nefis.testing.make_synthetic(os.path.join(tmpdir, 'synthetic.def'), **(synthetic or {}))
+        handles, operations = workload(def_file, tmpdir, write=write)
+        try:
+            results = {}
+            for name, func, nbytes in operations:
+                # one untimed call to warm up caches
+                func()
+                durations = timeit.repeat(func, number=1, repeat=repeat)
+                result = summarize(durations, nbytes)
+                result['durations'] = durations
+                results[name] = result
+                logger.info("%s: p50 %.6fs", name, result['p50'])
+        finally:
+            for handle in handles:
+                handle.close()
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+    error, version = nefis.cnefis.getnfv()
+    return dict(
+        file=os.path.abspath(def_file) if synthetic is None else None,
+        synthetic=synthetic,
+        library=version,
+        python=sys.version.split()[0],
+        platform=platform.platform(),
+        created=datetime.datetime.now().isoformat(),
+        repeat=repeat,
+        operations=results
+    )
+
+
+def rank(values):
+    """ranks of values, ties get the average rank"""
+    _, inverse, counts = np.unique(values, return_inverse=True, return_counts=True)
+    ends = np.cumsum(counts)
+    average = ends - (counts - 1) / 2.0
+    return average[inverse.ravel()], counts
+
+
+def mann_whitney(baseline, current):
+    """one sided p value of the Mann-Whitney U test that current tends to be larger than baseline
+
+    Uses the normal approximation with tie and continuity correction,
+    fine for the 10+ repeats of a benchmark.
+    """
+    nx, ny = len(baseline), len(current)
+    values = np.concatenate([np.asarray(baseline, 'float64'), np.asarray(current, 'float64')])
+    ranks, counts = rank(values)
+    u = ranks[nx:].sum() - ny * (ny + 1) / 2.0
+    n = nx + ny
+    ties = (counts ** 3 - counts).sum() / float(n * (n - 1))
+    sigma = math.sqrt(nx * ny / 12.0 * ((n + 1) - ties))
+    if sigma == 0:
+        return 1.0
+    z = (u - nx * ny / 2.0 - 0.5) / sigma
+    return 0.5 * math.erfc(z / math.sqrt(2))
+
+
+def compare(baseline, current, alpha=ALPHA, threshold=THRESHOLD):
+    """compare two results, return a dict of operation -> comparison
+
+    A comparison has the median ratio (current / baseline), the p value
+    and slower, True if the slowdown is significant and larger than
+    threshold.
+    """
+    comparisons = {}
+    for name, result in sorted(current['operations'].items()):
+        if name not in baseline['operations']:
+            continue
+        reference = baseline['operations'][name]
+        ratio = result['p50'] / reference['p50'] if reference['p50'] > 0 else float('inf')
+        p = mann_whitney(reference['durations'], result['durations'])
+        comparisons[name] = dict(
+            ratio=ratio,
+            p=p,
+            slower=bool(p < alpha and ratio > 1 + threshold)
+        )
+    return comparisons
@@ -0,0 +1,344 @@
+"""A SQLite catalog of the metadata of all nefis files below a directory
+
+build walks a directory tree, reads the groups, elements, attributes and
+time extents of every nefis file in a process pool and stores them in
+indexed tables. Files are only read again if the size or modification
+time of their def or dat file changed, files that disappeared are
+removed. query answers questions like "which files have element S1 in a
+group covering 2000-01-02" from the database only::
+
+    nefis.catalog.build('/archive', 'catalog.sqlite')
+    nefis.catalog.query('catalog.sqlite', element='S1', date='2000-01-02')
+"""
+from __future__ import print_function, unicode_literals, division, absolute_import
+
+import collections
+import concurrent.futures
+import datetime
+import fnmatch
+import json
+import logging
+import os
+import sqlite3
+
+import nefis.dataset
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS files (
+        id INTEGER PRIMARY KEY,
+        path TEXT UNIQUE NOT NULL,
+        def_size INTEGER,
+        def_mtime REAL,
+        dat_size INTEGER,
+        dat_mtime REAL,
+        scanned TEXT,
+        error TEXT
+    )""",
+    """CREATE TABLE IF NOT EXISTS groups (
+        file_id INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+        name TEXT NOT NULL,
+        definition TEXT,
+        cell TEXT,
+        size INTEGER,
+        series INTEGER
+    )""",
+    """CREATE TABLE IF NOT EXISTS elements (
+        file_id INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+        grp TEXT NOT NULL,
+        name TEXT NOT NULL,
+        type TEXT,
+        single_bytes INTEGER,
+        shape TEXT,
+        quantity TEXT,
+        unit TEXT,
+        description TEXT
+    )""",
+    """CREATE TABLE IF NOT EXISTS attributes (
+        file_id INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+        grp TEXT NOT NULL,
+        name TEXT NOT NULL,
+        value TEXT
+    )""",
+    """CREATE TABLE IF NOT EXISTS times (
+        file_id INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+        grp TEXT NOT NULL,
+        n INTEGER,
+        first INTEGER,
+        last INTEGER,
+        start TEXT,
+        stop TEXT
+    )""",
+    "CREATE INDEX IF NOT EXISTS groups_file ON groups (file_id)",
+    "CREATE INDEX IF NOT EXISTS groups_name ON groups (name)",
+    "CREATE INDEX IF NOT EXISTS elements_file ON elements (file_id)",
+    "CREATE INDEX IF NOT EXISTS elements_name ON elements (name, grp)",
+    "CREATE INDEX IF NOT EXISTS attributes_file ON attributes (file_id)",
+    "CREATE INDEX IF NOT EXISTS times_file ON times (file_id, grp)",
+    "CREATE INDEX IF NOT EXISTS times_extent ON times (start, stop)"
+]
+# the results written per transaction
+BATCH = 100
+DATE_FORMATS = ('%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d')
+
+
+def connect(db):
+    """open (and create) a catalog database"""
+    connection = sqlite3.connect(db)
+    connection.execute("PRAGMA foreign_keys = ON")
+    for statement in SCHEMA:
+        connection.execute(statement)
+    connection.commit()
+    return connection
+
+
+def find(root, pattern='*.def'):
+    """the def files matching pattern below root that have a dat file, sorted"""
+    found = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(fnmatch.filter(filenames, pattern)):
+            def_file = os.path.abspath(os.path.join(dirpath, filename))
+            if os.path.exists(def_file.replace('.def', '.dat')):
+                found.append(def_file)
+    return found
+
+
+def file_stats(def_file):
+    """(def size, def mtime, dat size, dat mtime) of a nefis file"""
+    stats = []
+    for path in (def_file, def_file.replace('.def', '.dat')):
+        stat = os.stat(path)
+        stats.extend([stat.st_size, stat.st_mtime])
+    return tuple(stats)
+
+
+def parse_date(value):
+    """parse an ISO date (and time) into a datetime"""
+    if isinstance(value, datetime.datetime):
+        return value
+    for format in DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, format)
+        except ValueError:
+            continue
+    raise ValueError("date %s should be formatted like 2000-01-02T12:00:00" % (value, ))
+
+
+def reference(ds, group):
+    """(reference date, seconds per time unit) of the time element of group, or None
+
+    Delft3D stores the reference date ITDATE (yyyymmdd, hhmmss), the time
+    unit TUNIT (seconds) and the timestep DT in the -const group (of the
+    same kind as group if there are several), the time in seconds since
+    ITDATE is IT... * DT * TUNIT.
+    """
+    prefix = group.split('-')[0] + '-const'
+    groups = sorted(
+        (name != prefix, name) for name in (value['name_dat'] for value in ds.groups.values())
+        if name.endswith('-const')
+    )
+    for _, const in groups:
+        if set(['ITDATE', 'TUNIT', 'DT']).issubset(ds.group_cell(const)['variables']):
+            break
+    else:
+        return None
+    itdate = ds.read(const, 'ITDATE').ravel()
+    date = datetime.datetime.strptime('%08d' % (int(itdate[0]), ), '%Y%m%d')
+    if itdate.size > 1:
+        hhmmss = int(itdate[1])
+        date += datetime.timedelta(hours=hhmmss // 10000, minutes=hhmmss // 100 % 100, seconds=hhmmss % 100)
+    tunit = float(ds.read(const, 'TUNIT').ravel()[0])
+    dt = float(ds.read(const, 'DT').ravel()[0])
+    return date, tunit * dt
+
+
+def time_extent(ds, group):
+    """(n, first, last, start, stop) of a series group, None without a time element
+
+    first and last are the values of the time element, start and stop
+    the ISO dates if the reference date is known.
+    """
+    found = nefis.dataset.time_element(ds, group)
+    if found is None:
+        return None
+    n = ds.time_range(found[0], slice(None))[3]
+    if n == 0:
+        return n, None, None, None, None
+    first = int(ds.read(found[0], found[1], t=0).ravel()[0])
+    last = int(ds.read(found[0], found[1], t=n - 1).ravel()[0])
+    start = stop = None
+    found = reference(ds, group)
+    if found is not None:
+        date, seconds = found
+        start = (date + datetime.timedelta(seconds=first * seconds)).isoformat()
+        stop = (date + datetime.timedelta(seconds=last * seconds)).isoformat()
+    return n, first, last, start, stop
+
+
+def scan(def_file):
+    """read the metadata of a nefis file as a dict of table -> rows"""
+    ds = nefis.dataset.Nefis(def_file)
+    try:
+        rows = dict(groups=[], elements=[], attributes=[], times=[])
+        for definition, group in sorted(ds.groups.items()):
+            name = group['name_dat']
+            series = nefis.dataset.is_series(ds, name)
+            rows['groups'].append((name, definition, group['cell'], int(group['group_size']), int(series)))
+            for element in ds.cells[group['cell']]['variables']:
+                info = ds.element_info(element)
+                attributes = ds.elements[element]['attributes']
+                rows['elements'].append((
+                    name,
+                    element,
+                    info['type'],
+                    info['single_bytes'],
+                    json.dumps(list(info['shape'])),
+                    attributes['quantity'].strip(),
+                    attributes['units'].strip(),
+                    attributes['description'].strip()
+                ))
+            for attribute, value in ds.attributes(name).items():
+                rows['attributes'].append((name, attribute, str(value)))
+            if series:
+                extent = time_extent(ds, name)
+                if extent is not None:
+                    rows['times'].append((name, ) + extent)
+        return rows
+    finally:
+        ds.close()
+
+
+def scan_file(def_file):
+    """(def_file, rows, error) of scan, for the process pool"""
+    try:
+        return def_file, scan(def_file), None
+    except Exception as e:
+        logger.debug("could not scan %s", def_file, exc_info=True)
+        return def_file, None, '%s: %s' % (type(e).__name__, e)
+
+
+def store(connection, def_file, stats, rows, error):
+    """replace the rows of a file"""
+    connection.execute("DELETE FROM files WHERE path = ?", (def_file, ))
+    cursor = connection.execute(
+        "INSERT INTO files (path, def_size, def_mtime, dat_size, dat_mtime, scanned, error) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (def_file, ) + stats + (datetime.datetime.now().isoformat(), error)
+    )
+    file_id = cursor.lastrowid
+    if rows is None:
+        return
+    connection.executemany(
+        "INSERT INTO groups VALUES (?, ?, ?, ?, ?, ?)",
+        [(file_id, ) + row for row in rows['groups']]
+    )
+    connection.executemany(
+        "INSERT INTO elements VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        [(file_id, ) + row for row in rows['elements']]
+    )
+    connection.executemany(
+        "INSERT INTO attributes VALUES (?, ?, ?, ?)",
+        [(file_id, ) + row for row in rows['attributes']]
+    )
+    connection.executemany(
+        "INSERT INTO times VALUES (?, ?, ?, ?, ?, ?, ?)",
+        [(file_id, ) + row for row in rows['times']]
+    )
+
+
+def build(root, db, workers=None, pattern='*.def', rebuild=False):
+    """add the nefis files below root to the catalog db, return counts of the work done
+
+    Files with unchanged size and modification times are skipped (unless
+    rebuild), removed files are deleted from the catalog. The files are
+    read by workers processes (default the number of cpus, 1 reads in
+    this process). The counts are scanned, skipped, removed and failed.
+    """
+    root = os.path.abspath(root)
+    connection = connect(db)
+    counts = dict(scanned=0, skipped=0, removed=0, failed=0)
+    try:
+        known = dict(
+            (row[0], tuple(row[1:]))
+            for row in connection.execute("SELECT path, def_size, def_mtime, dat_size, dat_mtime FROM files")
+        )
+        stats = collections.OrderedDict()
+        for def_file in find(root, pattern):
+            stats[def_file] = file_stats(def_file)
+        todo = [
+            def_file for def_file, stat in stats.items()
+            if rebuild or known.get(def_file) != stat
+        ]
+        counts['skipped'] = len(stats) - len(todo)
+        for path in known:
+            if path.startswith(root + os.sep) and path not in stats:
+                connection.execute("DELETE FROM files WHERE path = ?", (path, ))
+                counts['removed'] += 1
+        connection.commit()
+
+        if workers == 1:
+            results = (scan_file(def_file) for def_file in todo)
+            executor = None
+        else:
+            executor = concurrent.futures.ProcessPoolExecutor(workers)
+            results = executor.map(scan_file, todo)
+        try:
+            for i, (def_file, rows, error) in enumerate(results):
+                store(connection, def_file, stats[def_file], rows, error)
+                counts['scanned'] += 1
+                if error is not None:
+                    counts['failed'] += 1
+                    logger.warning("could not read %s: %s", def_file, error)
+                if (i + 1) % BATCH == 0:
+                    connection.commit()
+                    logger.info("scanned %s of %s files", i + 1, len(todo))
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        connection.commit()
+    finally:
+        connection.close()
+    return counts
+
+
+def query(db, element=None, group=None, date=None, path=None):
+    """the (file, group) pairs of the catalog matching all the given criteria
+
+    element and group are names, date (ISO) must lie in the time extent of
+    the group and path is a glob pattern for the def file. Returns a list
+    of dicts with path, group, n (timesteps), start and stop.
+    """
+    conditions = ["files.error IS NULL"]
+    parameters = []
+    if element is not None:
+        conditions.append(
+            "EXISTS (SELECT 1 FROM elements WHERE elements.file_id = files.id "
+            "AND elements.grp = groups.name AND elements.name = ?)"
+        )
+        parameters.append(element)
+    if group is not None:
+        conditions.append("groups.name = ?")
+        parameters.append(group)
+    if date is not None:
+        conditions.append("times.start <= ? AND times.stop >= ?")
+        date = parse_date(date).isoformat()
+        parameters.extend([date, date])
+    if path is not None:
+        conditions.append("files.path GLOB ?")
+        parameters.append(path)
+    sql = (
+        "SELECT files.path, groups.name, groups.size, times.start, times.stop FROM files "
+        "JOIN groups ON groups.file_id = files.id "
+        "LEFT JOIN times ON times.file_id = files.id AND times.grp = groups.name "
+        "WHERE " + " AND ".join(conditions) + " ORDER BY files.path, groups.name"
+    )
+    connection = connect(db)
+    try:
+        return [
+            dict(path=row[0], group=row[1], n=row[2], start=row[3], stop=row[4])
+            for row in connection.execute(sql, parameters)
+        ]
+    finally:
+        connection.close()
@@ -1,10 +1,12 @@
 # -*- coding: utf-8 -*-
 import logging
+import os
+import sys
 
 import click
 import nefis.cnefis
-import nefis.convert
 import nefis.dataset
+import nefis.trace
 
 msg = r"""
  _______________________________________
@@ -24,7 +26,11 @@ msg = r"""
 
 @click.group()
 @click.option('-v', '--verbose', count=True)
-def cli(verbose):
+@click.option('--trace', type=click.Path(), help='write a Chrome trace (JSON) of the reads and writes')
+@click.pass_context
+def cli(ctx, verbose, trace):
+    import faulthandler
+    faulthandler.enable()
     error, version = nefis.cnefis.getnfv()
     if verbose:
         click.echo(version)
@@ -36,37 +42,351 @@ def cli(verbose):
         3: logging.NOTSET
     }
     logging.basicConfig(level=loglevels[verbose])
+    if trace:
+        tracer = nefis.trace.ChromeTrace()
+        nefis.dataset.add_hook(tracer)
+
+        def save():
+            nefis.dataset.remove_hook(tracer)
+            tracer.save(trace)
+        ctx.call_on_close(save)
+
+
+def split(values):
+    """flatten repeated and comma separated option values"""
+    result = []
+    for value in values:
+        result.extend(item for item in value.split(',') if item)
+    return result
 
 
 @cli.command()
 @click.argument('src', type=click.Path(exists=True))
 @click.argument('dest', type=click.Path(exists=False))
-@click.option('--variable', type=str)
-def convert(src, dest, variable):
-    """Console script for nefis"""
-    nefis.convert.nefis2nc_cf(src, dest, variables=[variable])
+@click.option('--group', multiple=True, help='groups to convert (default all)')
+@click.option('--variable', multiple=True, help='variables to convert (default all elements)')
+@click.option('--chunk-size', type=int, help='timesteps per read (netCDF and parquet, zarr reads per chunk)')
+@click.option('--chunk-time', type=int, help='time length of the netCDF or zarr chunks')
+@click.option('--zlib/--no-zlib', default=True)
+@click.option('--complevel', type=int, default=4)
+@click.option('--shuffle/--no-shuffle', default=True)
+@click.option('--parallel/--no-parallel', default=True, help='read the next block while writing')
+@click.option('--format', type=click.Choice(['netcdf', 'zarr', 'parquet']), help='output format (default from extension)')
+@click.option('--workers', type=int, default=4, help='zarr chunk writers')
+@click.option('--resume/--no-resume', default=True, help='skip zarr chunks that are already written')
+def convert(src, dest, group, variable, chunk_size, chunk_time, zlib, complevel, shuffle, parallel,
+            format, workers, resume):
+    """Convert a nefis file to netCDF, zarr or parquet
+
+    The format follows from the extension of dest (.zarr, .parquet,
+    otherwise netCDF) unless --format is given. Zarr is read in blocks of
+    --chunk-time timesteps, --chunk-size only applies to netCDF and parquet.
+    """
+    import nefis.convert
+    if format is None:
+        extensions = {'.zarr': 'zarr', '.parquet': 'parquet'}
+        format = extensions.get(os.path.splitext(dest.rstrip('/'))[1], 'netcdf')
+    if format == 'parquet':
+        # parquet tables hold the series of one group
+        groups = split(group) or ['his-series']
+        nefis.convert.nefis2parquet(
+            src,
+            dest,
+            group=groups[0],
+            elements=split(variable) or None,
+            chunk_size=chunk_size,
+            parallel=parallel
+        )
+        return
+    if format == 'zarr':
+        if chunk_size is not None:
+            raise click.BadParameter('zarr is read per chunk, use --chunk-time', param_hint='--chunk-size')
+        nefis.convert.nefis2zarr(
+            src,
+            dest,
+            groups=split(group),
+            variables=split(variable),
+            chunks=chunk_time,
+            workers=workers,
+            resume=resume
+        )
+        return
+    nefis.convert.nefis2nc(
+        src,
+        dest,
+        groups=split(group),
+        variables=split(variable),
+        chunk_size=chunk_size,
+        zlib=zlib,
+        complevel=complevel,
+        shuffle=shuffle,
+        chunk_time=chunk_time,
+        parallel=parallel
+    )
 
 
 
+@cli.command()
+@click.argument('src', type=click.Path(exists=True))
+@click.option('--variable', multiple=True, help='variables to rechunk (default all series)')
+@click.option('--format', type=click.Choice(['npy', 'zarr']), default='npy')
+@click.option('--chunk-size', type=int, help='timesteps per read')
+def rechunk(src, variable, format, chunk_size):
+    """Write point-major copies of variables in the sidecar"""
+    import nefis.rechunk
+    nefis.rechunk.rechunk(src, variables=split(variable), format=format, chunk_size=chunk_size)
+
+
+@cli.command()
+@click.argument('src', type=click.Path(exists=True))
+@click.argument('dest', type=click.Path(exists=False))
+@click.option('--groups', multiple=True, help='groups to copy (default all)')
+@click.option('--elements', multiple=True, help='elements to copy (default all)')
+@click.option('--time', type=str, help='timesteps of the series groups, start:stop[:step]')
+@click.option('--chunk-size', type=int, help='timesteps per read')
+@click.option('--overwrite/--no-overwrite', default=False)
+def subset(src, dest, groups, elements, time, chunk_size, overwrite):
+    """Copy a selection of a nefis file to a new nefis file"""
+    import nefis.subset
+    nefis.subset.subset(
+        src,
+        dest,
+        groups=split(groups),
+        elements=split(elements),
+        time=time,
+        chunk_size=chunk_size,
+        overwrite=overwrite
+    )
+
+
+@cli.command()
+@click.argument('sources', nargs=-1, required=True, type=click.Path(exists=True))
+@click.option('-o', '--output', required=True, type=click.Path(exists=False), help='merged def file')
+@click.option('--chunk-size', type=int, help='timesteps per read')
+@click.option('--flush-size', type=int, help='bytes written between flushes (default 1 GiB)')
+@click.option('--overwrite/--no-overwrite', default=False)
+@click.option('--allow-differing-constants', is_flag=True,
+              help='use the constant groups of the first segment if the segments differ')
+def merge(sources, output, chunk_size, flush_size, overwrite, allow_differing_constants):
+    """Merge the segments of a restarted run into one nefis file"""
+    import nefis.merge
+    nefis.merge.merge(
+        sources,
+        output,
+        chunk_size=chunk_size,
+        flush_bytes=flush_size or nefis.merge.FLUSH_BYTES,
+        overwrite=overwrite,
+        allow_differing_constants=allow_differing_constants
+    )
+
+
+@cli.command()
+@click.argument('a', type=click.Path(exists=True))
+@click.argument('b', type=click.Path(exists=True))
+@click.option('--rtol', type=float, default=1e-05, help='relative tolerance')
+@click.option('--atol', type=float, default=1e-08, help='absolute tolerance')
+@click.option('--groups', multiple=True, help='groups to compare (default all)')
+@click.option('--elements', multiple=True, help='elements to compare (default all)')
+@click.option('--chunk-size', type=int, help='timesteps per read')
+@click.option('--report', is_flag=True, help='compare everything instead of stopping at the first failure')
+@click.pass_context
+def diff(ctx, a, b, rtol, atol, groups, elements, chunk_size, report):
+    """Compare two nefis files, exit with status 1 if they differ"""
+    import nefis.diff
+    differences, results = nefis.diff.diff(
+        a,
+        b,
+        rtol=rtol,
+        atol=atol,
+        groups=split(groups),
+        elements=split(elements),
+        chunk_size=chunk_size,
+        fail_fast=not report
+    )
+    for difference in differences:
+        click.echo(difference)
+    failed = bool(differences)
+    for (group, element), result in results.items():
+        if not result['failures'] and not report:
+            continue
+        failed = failed or bool(result['failures'])
+        click.echo(
+            "%s/%s: %s of %s values differ, max abs %g at %s, max rel %g at %s" % (
+                group,
+                element,
+                result['failures'],
+                result['n'],
+                result['max_abs'],
+                result['max_abs_at'],
+                result['max_rel'],
+                result['max_rel_at']
+            )
+        )
+    if failed:
+        ctx.exit(1)
+
+
+@cli.command(name='hash')
+@click.argument('src', type=click.Path(exists=True))
+@click.option('--groups', multiple=True, help='groups to hash (default all)')
+@click.option('--elements', multiple=True, help='elements to hash (default all)')
+@click.option('--chunk-size', type=int, help='timesteps per read')
+@click.option('--timesteps', is_flag=True, help='print the digest of every timestep')
+def hash_(src, groups, elements, chunk_size, timesteps):
+    """Compute and store digests of the timesteps of elements"""
+    import nefis.sidecar
+    import nefis.subset
+    ds = nefis.dataset.Nefis(src)
+    try:
+        selection = nefis.subset.select(ds, groups=split(groups), elements=split(elements))
+        for group, names in selection.items():
+            for name in names:
+                digests = ds.digests(group, name, chunk_size=chunk_size)
+                if timesteps:
+                    for t, digest in enumerate(digests):
+                        click.echo("%s  %s/%s[%d]" % (digest, group, name, t))
+                else:
+                    # one digest of all timesteps
+                    total = nefis.sidecar.digest(''.join(digests).encode())
+                    click.echo("%s  %s/%s" % (total, group, name))
+    finally:
+        ds.close()
+
+
+@cli.command()
+@click.argument('dest', type=click.Path(exists=False))
+@click.option('-n', type=int, default=100, help='number of cells in the n direction (NMAX)')
+@click.option('-m', type=int, default=200, help='number of cells in the m direction (MMAX)')
+@click.option('-k', type=int, default=5, help='number of layers (KMAX)')
+@click.option('--ntimes', type=int, default=10, help='number of timesteps')
+@click.option('--elements', multiple=True, help='map series elements (default S1,U1,V1)')
+@click.option('--stations', type=int, default=10, help='number of history stations')
+@click.option('--overwrite/--no-overwrite', default=False)
+def synthetic(dest, n, m, k, ntimes, elements, stations, overwrite):
+    """Write a synthetic trim-like nefis file"""
+    import nefis.testing
+    nefis.testing.make_synthetic(
+        dest,
+        n=n,
+        m=m,
+        k=k,
+        ntimes=ntimes,
+        elements=split(elements) or nefis.testing.DEFAULT_ELEMENTS,
+        stations=stations,
+        overwrite=overwrite
+    )
+
+
+@cli.command()
+@click.argument('src', required=False, type=click.Path(exists=True))
+@click.option('--repeat', type=int, default=20, help='timed calls per operation')
+@click.option('--write/--no-write', default=True, help='include the write operation')
+@click.option('--size', type=(int, int, int, int), default=(100, 200, 5, 10),
+              help='n m k ntimes of the synthetic file used without SRC')
+@click.option('-o', '--output', type=click.Path(), help='save the results as json')
+@click.option('--compare', type=click.Path(exists=True), help='baseline json to compare with')
+@click.pass_context
+def bench(ctx, src, repeat, write, size, output, compare):
+    """Time a standard read/write workload on a (synthetic) nefis file"""
+    import json
+    import nefis.bench
+    synthetic = None
+    if src is None:
+        synthetic = dict(zip(('n', 'm', 'k', 'ntimes'), size))
+    result = nefis.bench.run(src, repeat=repeat, write=write, synthetic=synthetic)
+    click.echo("%-16s %12s %12s %12s %14s" % ('operation', 'p50 [ms]', 'p90 [ms]', 'p99 [ms]', 'MB/s'))
+    for name, summary in sorted(result['operations'].items()):
+        throughput = summary.get('bytes_per_second')
+        click.echo("%-16s %12.3f %12.3f %12.3f %14s" % (
+            name,
+            summary['p50'] * 1000,
+            summary['p90'] * 1000,
+            summary['p99'] * 1000,
+            '%.1f' % (throughput / 1e6, ) if throughput else '-'
+        ))
+    if output:
+        with open(output, 'w') as f:
+            json.dump(result, f, indent=2)
+    if compare:
+        with open(compare) as f:
+            baseline = json.load(f)
+        slower = False
+        for name, comparison in sorted(nefis.bench.compare(baseline, result).items()):
+            flag = 'SLOWER' if comparison['slower'] else ''
+            slower = slower or comparison['slower']
+            click.echo("%-16s %8.2fx  p=%.4f %s" % (name, comparison['ratio'], comparison['p'], flag))
+        if slower:
+            ctx.exit(1)
+
+
+@cli.group()
+def catalog():
+    """Catalog the metadata of nefis files in a SQLite database"""
+
+
+@catalog.command(name='build')
+@click.argument('root', type=click.Path(exists=True, file_okay=False))
+@click.option('--db', type=click.Path(), required=True, help='catalog database')
+@click.option('--workers', type=int, help='reading processes (default the number of cpus)')
+@click.option('--pattern', default='*.def', help='def files to catalog')
+@click.option('--rebuild', is_flag=True, help='also read files that did not change')
+def catalog_build(root, db, workers, pattern, rebuild):
+    """Add the nefis files below ROOT to the catalog"""
+    import nefis.catalog
+    counts = nefis.catalog.build(root, db, workers=workers, pattern=pattern, rebuild=rebuild)
+    click.echo("scanned %(scanned)s, skipped %(skipped)s, removed %(removed)s, failed %(failed)s" % counts)
+
+
+@catalog.command(name='query')
+@click.option('--db', type=click.Path(exists=True), required=True, help='catalog database')
+@click.option('--element', help='files with this element')
+@click.option('--group', help='files with this group')
+@click.option('--date', help='groups covering this date (2000-01-02T12:00:00)')
+@click.option('--path', help='def files matching this glob pattern')
+@click.option('--json', 'as_json', is_flag=True, help='print JSON lines')
+def catalog_query(db, element, group, date, path, as_json):
+    """Find files in the catalog"""
+    import json
+    import nefis.catalog
+    for row in nefis.catalog.query(db, element=element, group=group, date=date, path=path):
+        if as_json:
+            click.echo(json.dumps(row))
+        else:
+            click.echo("%s\t%s\t%s\t%s\t%s" % (row['path'], row['group'], row['n'], row['start'], row['stop']))
+
+
 @cli.command()
 @click.argument('filename', type=click.Path(exists=True))
 @click.option('-h', type=bool, default=False)
-@click.option('--format', type=str)
+@click.option('--format', type=click.Choice(['json', 'jsonl', 'ncdump']), default='json')
 @click.option('--variable', type=str)
-def dump(filename, h, format, variable):
+@click.option('--data', multiple=True, help='variables to dump the data of (jsonl and ncdump), repeat or comma separate')
+@click.option('--time', help='timesteps of the data as start:stop[:step] (default all)')
+@click.option('--chunk-size', type=int, help='timesteps per read')
+def dump(filename, h, format, variable, data, time, chunk_size):
     """Inspect nefis files"""
+    import nefis.dump
+    import nefis.subset
 
     ds = nefis.dataset.Nefis(filename)
-    if format is None or format == "json":
-        click.echo(ds.dump_json())
-    elif format == "ncdump":
-        click.echo(ds.dump_ncdump())
-    if variable is not None:
-        click.echo("VARIABLE")
-        var = ds.variables[variable]
-        click.echo(var.name)
-        click.echo(var.attributes)
-        click.echo(var[0])
+    try:
+        nefis.dump.dump(
+            ds,
+            sys.stdout,
+            format=format,
+            data=split(data),
+            t=nefis.subset.parse_time(time),
+            chunk_size=chunk_size
+        )
+        if variable is not None:
+            click.echo("VARIABLE")
+            var = ds.variables[variable]
+            click.echo(var.name)
+            click.echo(var.attributes)
+            click.echo(var[0])
+    finally:
+        ds.close()
+
 
 if __name__ == "__main__":
-    main()
+    cli()
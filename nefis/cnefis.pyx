@@ -14,6 +14,10 @@ DEF MAXDIMS = 5
 
 # TODO: free all char* with libc.free
 
+# getelt_into and putelt release the GIL during the library call. The
+# library is not assumed to be thread safe: callers should not call it from
+# several threads at once (nefis.dataset serializes its calls with a lock).
+
 cdef extern:
     int Clsnef (int * )
     int Credat (int * , char * , char * )
@@ -24,7 +28,7 @@ cdef extern:
     int Flsdat (int * )
     int Flsdef (int * )
     int Getels (int * , char * , char * , int * , int * , int * , void *  )
-    int Getelt (int * , char * , char * , int * , int * , int * , void *  )
+    int Getelt (int * , char * , char * , int * , int * , int * , void *  ) nogil
     int Gethdf (int * , char *  )
     int Gethdt (int * , char *  )
     int Getiat (int *, char * , char * , int * )
@@ -52,7 +56,7 @@ cdef extern:
     int Inqnxt (int *, char * , char *  )
     int Neferr (int, char *)
     int Putels (int *, char * , char * , int * , int * , void * )
-    int Putelt (int *, char * , char * , int * , int * , void * )
+    int Putelt (int *, char * , char * , int * , int * , void * ) nogil
     int Putiat (int *, char * , char * , int * )
     int Putrat (int *, char * , char * , float * )
     int Putsat (int *, char * , char * , char * )
@@ -353,6 +357,47 @@ def getelt(fd, gr_name, el_name, np.ndarray[int, ndim=2, mode="c"] user_index, n
 #-------------------------------------------------------------------------
 
 
+def getelt_into(fd, gr_name, el_name, np.ndarray[int, ndim=2, mode="c"] user_index, np.ndarray[int, ndim=1, mode="c"] user_order, np.ndarray buffer):
+    """
+    Get alpha-numeric values from NEFIS file directly into an existing array
+    Keyword arguments:
+        integer -- NEFIS file number
+        string  -- group name
+        string  -- element name
+        integer -- array user index (2d)
+        integer -- array user order (1d)
+        array   -- writable, C contiguous array that receives the raw bytes
+    Return value:
+        integer -- error number
+    """
+    cdef int c_fd = fd
+    cdef bytes b_gr_name = gr_name.encode()
+    cdef bytes b_el_name = el_name.encode()
+    cdef int c_bl
+    cdef int status
+
+    cdef int* c_user_index
+    cdef int* c_user_order
+    cdef char* c_gr_name = b_gr_name
+    cdef char* c_el_name = b_el_name
+    cdef void* c_buffer
+
+    if not buffer.flags['C_CONTIGUOUS'] or not buffer.flags['WRITEABLE']:
+        raise ValueError("buffer should be a writable, C contiguous array")
+
+    c_bl = buffer.nbytes
+    c_user_index = &user_index[0, 0]
+    c_user_order = &user_order[0]
+    c_buffer = <void *> buffer.data
+
+    # no intermediate bytes object, nefis writes in the array memory, without the GIL
+    with nogil:
+        status = Getelt(& c_fd, c_gr_name, c_el_name, c_user_index, c_user_order, & c_bl, c_buffer)
+
+    return status
+#-------------------------------------------------------------------------
+
+
 def gethdf(fd):
     """
     Get header of NEFIS file (definition part)
@@ -1289,6 +1334,8 @@ def putels(fd, gr_name, el_name, np.ndarray[int, ndim=2, mode="c"] user_index, n
         integer -- error number
     """
     cdef int    c_fd = fd
+    cdef bytes b_gr_name = gr_name.encode()
+    cdef bytes b_el_name = el_name.encode()
     cdef int    c_bl
     cdef int    status
     cdef char * c_buffer
@@ -1322,7 +1369,7 @@ def putels(fd, gr_name, el_name, np.ndarray[int, ndim=2, mode="c"] user_index, n
         elm_dimensions[i] = 1
     c_dimensions = <int * > elm_dimensions.data
 
-    status = Inqelm(& c_fd, el_name, c_type, & c_single_bytes, c_quantity, c_unit, c_description, & c_count, c_dimensions)
+    status = Inqelm(& c_fd, b_el_name, c_type, & c_single_bytes, c_quantity, c_unit, c_description, & c_count, c_dimensions)
 
     length = c_single_bytes
     for i in range(c_count):
@@ -1336,10 +1383,13 @@ def putels(fd, gr_name, el_name, np.ndarray[int, ndim=2, mode="c"] user_index, n
     if any(isinstance(el, list) for el in buffer):
         buffer = list(itertools.chain(*buffer))
     for i in range(multiply):
-        strings[length * i:length * (i + 1)] = buffer[i]
+        value = buffer[i]
+        if not isinstance(value, bytes):
+            value = value.encode()
+        strings[length * i:length * (i + 1)] = value.ljust(length)
     c_buffer = strings
 
-    status = Putels(& c_fd, gr_name, el_name, c_user_index, c_user_order, c_buffer)
+    status = Putels(& c_fd, b_gr_name, b_el_name, c_user_index, c_user_order, c_buffer)
 
     return status
 #-------------------------------------------------------------------------
@@ -1354,63 +1404,49 @@ def putelt(fd, gr_name, el_name, np.ndarray[int, ndim=2, mode="c"] user_index, n
         string  -- element name
         integer -- user index array
         integer -- user order array
-        string  -- list of character string
+        buffer  -- array, bytes or any object supporting the buffer protocol
     Return value:
         integer -- error number
     """
     cdef int    c_fd = fd
-    cdef int    c_bl
+    cdef bytes b_gr_name = gr_name.encode()
+    cdef bytes b_el_name = el_name.encode()
     cdef int    status
+    cdef np.ndarray data
 
-    cdef char * c_buffer
     cdef int * c_user_index
     cdef int * c_user_order
-
-    cdef char * c_type
-    cdef int    c_single_bytes
-    cdef char * c_quantity
-    cdef char * c_unit
-    cdef char * c_description
-    cdef int    c_count = MAXDIMS
-    cdef int * c_dimensions
-    cdef np.ndarray[int, ndim = 1, mode = "c"] elm_dimensions
+    cdef char * c_gr_name
+    cdef char * c_el_name
+    cdef void * c_buffer
 
     c_user_index = &user_index[0, 0]
     c_user_order = &user_order[0]
 
-    buffer_length = STRINGLENGTH
-    buf1 = b'\20' * buffer_length
-    c_type = buf1
-    buf2 = b'\20' * buffer_length
-    c_quantity = buf2
-    buf3 = b'\20' * buffer_length
-    c_unit = buf3
-    buf4 = b'\20' * buffer_length
-    c_description = buf4
-
-    elm_dimensions = np.arange(MAXDIMS).reshape(MAXDIMS)
-    for i in range(c_count):
-        elm_dimensions[i] = 1
-    c_dimensions = <int * > elm_dimensions.data
-
-    status = Inqelm(& c_fd, el_name, c_type, & c_single_bytes, c_quantity, c_unit, c_description, & c_count, c_dimensions)
-
-    length = c_single_bytes
-    for i in range(c_count):
-        elm_dimensions[i] = c_dimensions[i]
-
-    multiply = 1
-    for i in range(c_count):
-        multiply = multiply * elm_dimensions[i]
-
-    strings = b'\20' * length * multiply
-    strlist = list(strings)
-    for i in range(length * multiply):
-        strlist[i] = buffer[i]
-    strings = ''.join(strlist)
-    c_buffer = strings
-
-    status = Putelt(& c_fd, gr_name, el_name, c_user_index, c_user_order, c_buffer)
+    # view the values as raw bytes, only copy if the memory is not contiguous
+    if isinstance(buffer, np.ndarray):
+        data = np.ascontiguousarray(buffer).reshape(-1).view(np.uint8)
+    else:
+        data = np.frombuffer(buffer, dtype=np.uint8)
+
+    # the library reads as many bytes as the selected cells hold, check the buffer has them
+    status, _, single_bytes, _, _, _, count, dimensions = inqelm(fd, el_name)
+    if status != 0:
+        return status
+    nbytes = single_bytes * int(np.prod(dimensions))
+    for i in range(MAXDIMS):
+        if user_index[i, 0] > 0:
+            nbytes *= (user_index[i, 1] - user_index[i, 0]) // max(user_index[i, 2], 1) + 1
+    if data.nbytes < nbytes:
+        raise ValueError(
+            "buffer of %d bytes is too small for %d bytes of %s in %s" % (data.nbytes, nbytes, el_name, gr_name)
+        )
+
+    c_gr_name = b_gr_name
+    c_el_name = b_el_name
+    c_buffer = <void *> data.data
+    with nogil:
+        status = Putelt(& c_fd, c_gr_name, c_el_name, c_user_index, c_user_order, c_buffer)
 
     return status
 #-------------------------------------------------------------------------
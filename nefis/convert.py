@@ -1,50 +1,430 @@
-import netCDF4
+import collections
+import concurrent.futures
+import itertools
+import logging
+
+import numpy as np
 
 import nefis.dataset as dataset
+import nefis.his
+
+logger = logging.getLogger(__name__)
+
+# default size of a zarr chunk, the time length is chosen to match
+ZARR_CHUNK_BYTES = 8 * 1024 * 1024
+
+
+def select(ds, groups=None, variables=None):
+    """return an ordered dict of group -> variable names to convert
+
+    By default all elements of all groups. Selected variables can also be
+    derived variables.
+    """
+    selection = collections.OrderedDict()
+    if variables:
+        for name in variables:
+            variable = ds.variables[name]
+            if groups and variable.group not in groups:
+                continue
+            selection.setdefault(variable.group, []).append(name)
+        return selection
+    for name, group in ds.groups.items():
+        if groups and name not in groups and group['name_dat'] not in groups:
+            continue
+        selection[group['name_dat']] = list(ds.cells[group['cell']]['variables'])
+    return selection
+
+
+# elements with the size of the grid dimensions N, M and K
+GRID_ELEMENTS = ('NMAX', 'MMAX', 'KMAX')
+# elements with the size of a dimension and the name of that dimension
+COUNT_DIMENSIONS = [('KMAX', 'K'), ('NOSTAT', 'NOSTAT'), ('NTRUV', 'NTRUV'), ('LSTCI', 'LSTCI'), ('LTUR', 'LTUR')]
+
+
+def dimension_names(ds):
+    """name the nefis (fortran order) dimensions of the elements
+
+    Returns a function that gives the dimension names of an element shape
+    (fortran order). Grid elements, that start with NMAX and MMAX, get N, M
+    and K (or K_interface) by position. Other dimensions get the name of a
+    count element (NOSTAT, LSTCI...) if exactly one has their size, and are
+    named after their size otherwise: in trim files NOSTAT and KMAX are
+    often equal.
+    """
+    counts = {}
+    for element in GRID_ELEMENTS + tuple(element for element, _ in COUNT_DIMENSIONS):
+        if element in ds.raw_variables and element not in counts:
+            counts[element] = int(ds.read(ds.raw_variables[element].group, element, t=0).ravel()[0])
+    sizes = collections.defaultdict(set)
+    for element, name in COUNT_DIMENSIONS:
+        if element in counts:
+            sizes[counts[element]].add(name)
+
+    def generic(n):
+        if len(sizes[n]) == 1:
+            return list(sizes[n])[0]
+        return 'dim_%d' % (n, )
 
-def nefis2nc_cf(src, dest, variables=None):
-    """create a copy from the nefis file that tries to conform to CF conventions"""
+    def names(shape):
+        shape = [int(n) for n in shape]
+        grid = shape[:2] == [counts.get('NMAX'), counts.get('MMAX')]
+        if not grid:
+            return tuple(generic(n) for n in shape)
+        result = ['N', 'M']
+        for i, n in enumerate(shape[2:]):
+            if i == 0 and 'KMAX' in counts and n == counts['KMAX']:
+                result.append('K')
+            elif i == 0 and 'KMAX' in counts and n == counts['KMAX'] + 1:
+                result.append('K_interface')
+            else:
+                result.append(generic(n))
+        return tuple(result)
+    return names
+
+
+def iter_blocks(ds, selection, chunk_size=None):
+    """iterate over (group, name, offset, block) for all selected variables"""
+    for group, names in selection.items():
+        for name in names:
+            for offset, block in ds.variables[name].iter_chunks(chunk_size=chunk_size):
+                yield group, name, offset, block
+
+
+def nefis2nc(src, dest, groups=None, variables=None, chunk_size=None,
+             zlib=True, complevel=4, shuffle=True, chunk_time=None, parallel=True):
+    """convert a nefis file to netCDF4, one netCDF group per nefis group
+
+    Every selected element becomes a variable (time, dims...) in the group
+    of its nefis group, character elements get an extra string length
+    dimension. The data is streamed in blocks of chunk_size timesteps
+    (default CHUNK_BYTES per block). With parallel the next block is read
+    while the current one is written. chunk_time sets the time length of
+    the netCDF chunks.
+    """
+    import netCDF4
     src_ds = dataset.Nefis(src)
     dst_ds = netCDF4.Dataset(dest, 'w')
+    try:
+        selection = select(src_ds, groups=groups, variables=variables)
+        name_dimensions = dimension_names(src_ds)
+
+        def dimension(name, size):
+            if name not in dst_ds.dimensions:
+                dst_ds.createDimension(name, size)
+            return name
 
-    groups = src_ds.groups
+        nc_variables = {}
+        for group, names in selection.items():
+            nc_group = dst_ds.createGroup(group)
+            ntimes = src_ds.groups[src_ds.group_def(group)]['group_size']
+            nc_group.createDimension('time', ntimes)
+            for name in names:
+                variable = src_ds.variables[name]
+                if isinstance(variable, dataset.Variable) and variable.dtype == 'string':
+                    info = src_ds.element_info(name)
+                    dtype = 'S1'
+                    extra = (dimension('strlen%d' % info['single_bytes'], info['single_bytes']), )
+                    shape = tuple(info['dimensions'])
+                else:
+                    dtype = np.dtype(variable.dtype)
+                    extra = ()
+                    shape = tuple(variable.shape)
+                # netCDF order is the reverse of the nefis (fortran) order
+                dimensions = tuple(
+                    dimension(name, n)
+                    for name, n in reversed(list(zip(name_dimensions(shape), shape)))
+                )
+                dimensions = ('time', ) + dimensions + extra
+                chunksizes = None
+                if chunk_time:
+                    sizes = [min(chunk_time, max(ntimes, 1))]
+                    sizes += [len(dst_ds.dimensions[dim]) for dim in dimensions[1:]]
+                    chunksizes = sizes
+                nc_variable = nc_group.createVariable(
+                    name,
+                    dtype,
+                    dimensions,
+                    zlib=zlib,
+                    complevel=complevel,
+                    shuffle=shuffle,
+                    chunksizes=chunksizes
+                )
+                nc_variable.set_auto_mask(False)
+                for attr, value in (variable.attributes or {}).items():
+                    if value:
+                        nc_variable.setncattr(attr, value)
+                nc_variables[(group, name)] = nc_variable
 
+        blocks = iter_blocks(src_ds, selection, chunk_size=chunk_size)
+        if parallel:
+            blocks = dataset.prefetch(blocks)
+        for group, name, offset, block in blocks:
+            nc_variable = nc_variables[(group, name)]
+            n = block.shape[0]
+            with dataset.span('convert_chunk', group=group, element=name, start=offset, n=n, nbytes=block.nbytes):
+                if block.dtype.kind == 'S':
+                    block = block.view('S1').reshape(block.shape + (-1, ))
+            logger.debug("writing %s/%s[%s:%s]", group, name, offset, offset + n)
+            with dataset.span('write_chunk', group=group, element=name, start=offset, n=n, nbytes=block.nbytes):
+                nc_variable[offset:offset + n] = block
+    finally:
+        src_ds.close()
+        dst_ds.close()
 
-    dst_ds.createDimension('time', groups['map-series']['group_size'])
-    dst_ds.createDimension('n', src_ds.variables["NMAX"][:])
-    dst_ds.createDimension('m', src_ds.variables["MMAX"][:])
-    dst_ds.createDimension('k', src_ds.variables["KMAX"][:])
 
-    variables = [
-        {
-            "name": "U1",
-            "dimensions": ["time", "n", "m", "k"],
-            "dtype": "float",
-            "standard_name": "eastward_sea_velocity"
-        }
+def zarr_chunks(shape, nbytes, chunks=None):
+    """chunk shape for an array of shape (time, ...) with nbytes per timestep
+
+    chunks can be a number of timesteps (fields are not split) or a full
+    chunk shape.
+    """
+    if chunks is not None and not isinstance(chunks, int):
+        return tuple(chunks)
+    if chunks is None:
+        chunks = max(1, ZARR_CHUNK_BYTES // max(nbytes, 1))
+    return (min(chunks, max(shape[0], 1)), ) + tuple(shape[1:])
+
+
+def zarr_chunk_written(array, time_chunk):
+    """check if all chunks of array at time chunk index time_chunk are stored"""
+    separator = getattr(array, '_dimension_separator', None) or '.'
+    grid = [
+        range(-(-size // chunk))
+        for size, chunk in zip(array.shape[1:], array.chunks[1:])
     ]
+    for index in itertools.product(*grid):
+        key = separator.join(str(i) for i in (time_chunk, ) + index)
+        if array.path:
+            key = array.path + '/' + key
+        if key not in array.store:
+            return False
+    return True
 
-    for name, var in variables:
-        if name != 'U1':
-            dst_ds.createVariable
 
+def write_chunk(group, name, array, offset, block):
+    """write a block of timesteps at offset in a zarr array"""
+    n = block.shape[0]
+    with dataset.span('write_chunk', group=group, element=name, start=offset, n=n, nbytes=block.nbytes):
+        array[offset:offset + n] = block
 
 
+def nefis2zarr(src, dest, groups=None, variables=None, chunks=None, compressor=None, workers=4, resume=True):
+    """convert a nefis file (or open Nefis dataset) to a zarr directory store
 
-    src_ds.close()
-    dst_ds.close()
+    Every selected element becomes an array (time, ...) in the zarr group
+    of its nefis group. The file is read with range getelt calls that are
+    aligned to the zarr time chunks, and the chunks are compressed and
+    written by a pool of workers. With resume, time chunks that are
+    already in the store (of an interrupted conversion) are not read
+    again, unless the digests of the source (see Nefis.digests) differ
+    from the ones recorded when they were written. Requires zarr (2.x)
+    and numcodecs.
+    """
+    import zarr
+    import numcodecs
 
+    src_ds = src if isinstance(src, dataset.Nefis) else dataset.Nefis(src)
+    try:
+        root = zarr.open_group(dest, mode='a')
+        root.attrs['def_file'] = src_ds.def_file
+        if compressor is None:
+            compressor = numcodecs.Blosc(cname='zstd', clevel=3, shuffle=numcodecs.Blosc.SHUFFLE)
+        selection = select(src_ds, groups=groups, variables=variables)
+        name_dimensions = dimension_names(src_ds)
 
-def nefis2nc_raw(src, dest, variables=None):
-    """create a copy from the nefis file that matches the original file format as close as possible"""
-    src_ds = dataset.Nefis(src)
-    dst_ds = netCDF4.Dataset(dest, 'w')
+        with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+            pending = collections.deque()
+            for group, names in selection.items():
+                record = src_ds.groups[src_ds.group_def(group)]
+                zarr_group = root.require_group(group)
+                zarr_group.attrs.update(
+                    cell=record['cell'],
+                    group_size=int(record['group_size'])
+                )
+                for name in names:
+                    variable = src_ds.variables[name]
+                    if name in src_ds.raw_variables:
+                        info = src_ds.element_info(name)
+                        shape = info['shape']
+                        dtype = info['np_dtype']
+                    else:
+                        shape = variable.numpy_shape
+                        dtype = np.dtype(variable.dtype)
+                    nbytes = dtype.itemsize * int(np.prod(shape))
+                    shape = (int(record['group_size']), ) + tuple(shape)
+                    array = zarr_group.require_dataset(
+                        name,
+                        shape=shape,
+                        chunks=zarr_chunks(shape, nbytes, chunks),
+                        dtype=dtype,
+                        compressor=compressor
+                    )
+                    attributes = dict((key, value) for key, value in (variable.attributes or {}).items() if value)
+                    # dimension names are given in nefis (fortran) order
+                    fortran_shape = shape[1:][::-1]
+                    attributes['_ARRAY_DIMENSIONS'] = ['time'] + list(name_dimensions(fortran_shape))[::-1]
+                    array.attrs.update(attributes)
+
+                    # digests of the source the chunks were written from, to resume safely
+                    digests = None
+                    if name in src_ds.raw_variables:
+                        digests = src_ds.sidecar.digests(group, name)
+                    written_digests = array.attrs.get('nefis_digests')
+
+                    time_chunk = array.chunks[0]
+                    for offset, start, n, step in variable.read_plan(chunk_size=time_chunk):
+                        unchanged = (
+                            digests is None or written_digests is None or
+                            written_digests[offset:offset + n] == digests[offset:offset + n]
+                        )
+                        if resume and unchanged and zarr_chunk_written(array, offset // time_chunk):
+                            logger.debug("skipping %s/%s[%s:%s]", group, name, offset, offset + n)
+                            continue
+                        block = variable.read(slice(start, start + n * step, step))
+                        # keep a bounded number of blocks in memory
+                        while len(pending) >= 2 * workers:
+                            pending.popleft().result()
+                        pending.append(
+                            executor.submit(write_chunk, group, name, array, offset, block)
+                        )
+            while pending:
+                pending.popleft().result()
+        for group, names in selection.items():
+            for name in names:
+                digests = src_ds.sidecar.digests(group, name) if name in src_ds.raw_variables else None
+                if digests is not None:
+                    root[group][name].attrs['nefis_digests'] = digests
+        zarr.consolidate_metadata(dest)
+        return root
+    finally:
+        if src_ds is not src:
+            src_ds.close()
+
+
+def arrow_array(values):
+    """wrap a contiguous 1d numpy array in an arrow array without copying"""
+    import pyarrow as pa
+    values = np.ascontiguousarray(values)
+    return pa.Array.from_buffers(
+        pa.from_numpy_dtype(values.dtype),
+        len(values),
+        [None, pa.py_buffer(values)]
+    )
+
+
+def iter_arrow_batches(ds, group, elements=None, t=slice(None), chunk_size=None, parallel=False):
+    """iterate over arrow record batches with the series of group, one per read block
+
+    Rows are (timestep, location) with a time column (timestep index), a
+    dictionary encoded location column (station or cross-section names of
+    history files, else the location number) and a column per element, or
+    per element and extra index (for example ZCURU_0, ZCURU_1 for the
+    layers). The location is the last axis of the elements. Elements with
+    one value per timestep are repeated for every location. The columns
+    of (time, location) elements share the memory of the read buffers.
+    """
+    import pyarrow as pa
+
+    his = ds.his
+    if elements is None:
+        elements = [
+            name
+            for name in ds.group_cell(group)['variables']
+            if ds.element_info(name)['dtype'] is not bytes and name not in nefis.his.CROSS_SECTION_ELEMENTS
+        ]
+    infos = [ds.element_info(name) for name in elements]
+    sizes = set(info['shape'][-1] for info in infos if info['nbytes'] != info['single_bytes'])
+    if len(sizes) > 1:
+        raise ValueError("elements %s have different numbers of locations %s" % (elements, sizes))
+    n_locations = sizes.pop() if sizes else 1
+    if set(elements).isdisjoint(nefis.his.CROSS_SECTION_ELEMENTS):
+        locations = his.stations
+    else:
+        locations = his.cross_sections
+    if len(locations) == n_locations:
+        names = pa.array(list(locations.keys()))
+    else:
+        names = pa.array([str(i) for i in range(n_locations)])
+    location_index = np.arange(n_locations, dtype=np.int32)
+
+    if chunk_size is None:
+        nbytes = sum(info['nbytes'] for info in infos)
+        chunk_size = max(1, dataset.CHUNK_BYTES // max(nbytes, 1))
+    plan = ds.read_plan(group, elements[0], t=t, chunk_size=chunk_size)
 
-    groups = src_ds.groups
+    def blocks():
+        for offset, start, n, step in plan:
+            yield start, n, step, [ds.read_range(group, name, start, n, step=step) for name in elements]
+    if parallel:
+        blocks = dataset.prefetch(blocks())
+    else:
+        blocks = blocks()
 
-    for name, group in groups.items():
-        grp = dst_ds.createGroup(name)
-        grp.createDimension("n_times", group["group_size"])
+    for start, n, step, values in blocks:
+        with dataset.span('convert_chunk', group=group, start=start, n=n, nbytes=sum(block.nbytes for block in values)):
+            batch = arrow_batch(elements, values, start, n, step, n_locations, location_index, names)
+        yield batch
 
-    src_ds.close()
-    dst_ds.close()
+
+def arrow_batch(elements, values, start, n, step, n_locations, location_index, names):
+    """a record batch of the blocks values of elements, see iter_arrow_batches"""
+    import pyarrow as pa
+
+    timesteps = np.arange(start, start + n * step, step, dtype=np.int32)
+    columns = [
+        arrow_array(np.repeat(timesteps, n_locations)),
+        pa.DictionaryArray.from_arrays(arrow_array(np.tile(location_index, n)), names)
+    ]
+    column_names = ['time', 'location']
+    for name, block in zip(elements, values):
+        if block[0].size == 1:
+            columns.append(arrow_array(np.repeat(block.reshape(n), n_locations)))
+            column_names.append(name)
+            continue
+        extra = block.shape[1:-1]
+        if not extra:
+            # (time, location) is already the row order
+            columns.append(arrow_array(block.reshape(-1)))
+            column_names.append(name)
+            continue
+        flat = block.reshape((n, -1, n_locations))
+        for i in range(flat.shape[1]):
+            columns.append(arrow_array(flat[:, i, :].reshape(-1)))
+            column_names.append('%s_%d' % (name, i))
+    return pa.RecordBatch.from_arrays(columns, column_names)
+
+
+def nefis2arrow(src, group, elements=None, t=slice(None), chunk_size=None):
+    """read the series of group in an arrow table, see iter_arrow_batches"""
+    import pyarrow as pa
+    src_ds = src if isinstance(src, dataset.Nefis) else dataset.Nefis(src)
+    try:
+        batches = list(iter_arrow_batches(src_ds, group, elements=elements, t=t, chunk_size=chunk_size))
+        return pa.Table.from_batches(batches)
+    finally:
+        if src_ds is not src:
+            src_ds.close()
+
+
+def nefis2parquet(src, dest, group='his-series', elements=None, chunk_size=None, compression='snappy', parallel=True):
+    """stream the series of group to a parquet file, one row group per read block"""
+    import pyarrow.parquet as pq
+    src_ds = src if isinstance(src, dataset.Nefis) else dataset.Nefis(src)
+    writer = None
+    try:
+        batches = iter_arrow_batches(src_ds, group, elements=elements, chunk_size=chunk_size, parallel=parallel)
+        for batch in batches:
+            if writer is None:
+                writer = pq.ParquetWriter(dest, batch.schema, compression=compression)
+            with dataset.span('write_chunk', group=group, nbytes=batch.nbytes):
+                writer.write_batch(batch)
+    finally:
+        if writer is not None:
+            writer.close()
+        if src_ds is not src:
+            src_ds.close()
+
+
+def nefis2nc_raw(src, dest, variables=None):
+    """create a copy from the nefis file that matches the original file format as close as possible"""
+    nefis2nc(src, dest, variables=variables)
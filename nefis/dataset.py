@@ -1,24 +1,46 @@
 from __future__ import print_function, unicode_literals, division, absolute_import
 
-import mako.template
-import faulthandler
 import numpy as np
 import os
 import functools
 import logging
 import io
 import json
+import collections
+import concurrent.futures
+import contextlib
+import datetime
+import threading
+import time
 
-import bokeh.core.json_encoder
 import nefis.cnefis
-
-faulthandler.enable()
+import nefis.his
+import nefis.sidecar
+import nefis.stats
 
 logger = logging.getLogger(__name__)
 
 MAXDIMS = 5
 MAXGROUPS = 100
 MAXELEMENTS = 1000
+# read numerical data in blocks of at most this many bytes
+CHUNK_BYTES = 64 * 1024 * 1024
+
+
+def parse_budget(value):
+    """a memory budget in bytes from a string, None for no budget (also for invalid values)"""
+    if not value:
+        return None
+    try:
+        budget = int(value)
+    except ValueError:
+        logger.warning("ignoring memory budget %r, expected a number of bytes", value)
+        return None
+    return budget if budget > 0 else None
+
+
+# global limit (bytes) of the memory a read may allocate, None for no limit
+MEMORY_BUDGET = parse_budget(os.environ.get('NEFIS_MEMORY_BUDGET'))
 DTYPES = {
     'REAL': np.float32,
     'INTEGER': np.int32,
@@ -26,26 +48,6 @@ DTYPES = {
 }
 
 
-dump_tmpl = """
-nefis ${ds.def_file} {
-variables:
-% for group in groups.values():
-    group: ${group['name']}
-%  for variable in variables.values():
-        ${variable.dtype} ${variable.name}${tuple(variable.shape)} ;
-%   for attr, val in variable.attributes.items():
-            ${variable.name}:${attr} = ${repr(val)}
-%   endfor
-%  endfor
-% endfor
-
-"""
-# dimensions:
-# % for dimension in dimensions:
-#   ${dimension['name']} = ${len(dimension)} ;
-# % endfor
-
-
 class NefisException(Exception):
     """A nefis exception"""
     def __init__(self, message, status):
@@ -53,6 +55,14 @@ class NefisException(Exception):
         self.status = status
 
 
+class MemoryBudgetError(MemoryError):
+    """A read would allocate more than the memory budget"""
+    def __init__(self, message, nbytes, budget):
+        super(MemoryBudgetError, self).__init__(message)
+        self.nbytes = nbytes
+        self.budget = budget
+
+
 class Dimension(object):
     def __init__(self, group, name, size):
         self.group = group
@@ -77,6 +87,35 @@ class Variable(object):
         data = self._ds.get_data(self.group, self.name, t=t)
         return data
 
+    def read(self, t=0, compact=False, mask='KCS', **kwargs):
+        """read timestep t (int) or timesteps t (slice) of the variable
+
+        With compact=True map fields are reduced to the active cells of
+        `mask` (see Nefis.active_cells), shape (n_active[, k]) for a single
+        timestep and (time, n_active[, k]) for a slice. The dtype, out,
+        scale, offset, missing_value, fill_value and chunk_size arguments
+        are passed to Nefis.read. Character elements are returned as fixed
+        width bytes arrays.
+        """
+        return self._ds.read(self.group, self.name, t=t, compact=compact, mask=mask, **kwargs)
+
+    def nbytes(self, t=0, compact=False, mask='KCS', dtype=None, chunk_size=None):
+        """the bytes that reading timestep t (int) or timesteps t (slice) allocates, see Nefis.nbytes"""
+        return self._ds.nbytes(self.group, self.name, t=t, compact=compact, mask=mask, dtype=dtype,
+                               chunk_size=chunk_size)
+
+    def timeseries(self, index, t=slice(None)):
+        """the series at index, see Nefis.timeseries"""
+        return self._ds.timeseries(self.group, self.name, index, t=t)
+
+    def read_plan(self, t=slice(None), chunk_size=None):
+        """the blocks (offset, start, n, step) in which timesteps t are read"""
+        return self._ds.read_plan(self.group, self.name, t=t, chunk_size=chunk_size)
+
+    def iter_chunks(self, t=slice(None), chunk_size=None):
+        """iterate over (offset, block) for the timesteps t of the variable"""
+        return self._ds.iter_chunks(self.group, self.name, t=t, chunk_size=chunk_size)
+
     def flat(self):
         """return a flat object that can be used to serialize the metadata of the variable"""
         return dict(
@@ -88,85 +127,476 @@ class Variable(object):
 
 
 
+class ActiveCells(object):
+    """Mapping between a full (M, N) grid and its active cells
+
+    The mask is taken from a mask element (KCS by default) and the flat
+    indices of the active cells are computed once. Map fields can then be
+    compacted to the active cells and scattered back to the full grid.
+    """
+    def __init__(self, mask):
+        mask = np.asarray(mask)
+        self.shape = mask.shape
+        self.mask = mask != 0
+        # flat indices into the trailing (M, N) part of an array
+        self.index = np.flatnonzero(self.mask)
+
+    @property
+    def n_active(self):
+        return self.index.size
+
+    def matches(self, shape):
+        """check if an (element) shape ends with the grid shape"""
+        return tuple(shape[-len(self.shape):]) == self.shape
+
+    def compact_shape(self, shape):
+        """shape of compacted data for data of the given (element) shape"""
+        if not self.matches(shape):
+            raise ValueError(
+                "shape %s does not end with grid shape %s" % (tuple(shape), self.shape)
+            )
+        return (self.n_active, ) + tuple(shape[:-len(self.shape)])
+
+    def compact(self, data, time=False):
+        """compact data of shape ([time,] [extra...,] M, N) to ([time,] n_active[, extra...])"""
+        data = np.asarray(data)
+        if not self.matches(data.shape):
+            raise ValueError(
+                "shape %s does not end with grid shape %s" % (data.shape, self.shape)
+            )
+        lead = data.shape[:1] if time else ()
+        extra = data.shape[len(lead):-len(self.shape)]
+        flat = data.reshape(lead + (int(np.prod(extra)), -1))
+        # fancy indexing the swapped view gives a contiguous (..., n_active, extra) copy
+        values = np.swapaxes(flat, -1, -2)[..., self.index, :]
+        return values.reshape(lead + (self.n_active, ) + extra)
+
+    def expand(self, values, time=False, fill_value=None):
+        """scatter compacted values back to the full grid, the inverse of compact"""
+        values = np.asarray(values)
+        lead = values.shape[:1] if time else ()
+        extra = values.shape[len(lead) + 1:]
+        if fill_value is None:
+            fill_value = np.nan if values.dtype.kind == 'f' else 0
+        size = int(np.prod(self.shape))
+        out = np.full(lead + (int(np.prod(extra)), size), fill_value, dtype=values.dtype)
+        np.swapaxes(out, -1, -2)[..., self.index, :] = values.reshape(
+            lead + (self.n_active, -1)
+        )
+        return out.reshape(lead + extra + self.shape)
+
+
+def convert_block(block, out, scale=None, offset=None, missing_value=None, fill_value=None):
+    """convert a block of native data into out in one pass
+
+    Values are packed as (value - offset) / scale if scale or offset are
+    given (rounded for integer output) and missing values are replaced by
+    fill_value. For integer output nan values are also replaced by
+    fill_value and values are clipped to the range of the dtype, leaving
+    out the fill value if it is the minimum or maximum.
+    """
+    out = np.asarray(out)
+    integer = out.dtype.kind in 'iu'
+    if fill_value is None:
+        fill_value = np.nan if out.dtype.kind in 'fc' else np.iinfo(out.dtype).min
+    invalid = None
+    if missing_value is not None:
+        invalid = block == missing_value
+    if scale is not None or offset is not None:
+        # one block sized temporary for the arithmetic
+        values = block.astype(np.float64)
+        if offset is not None:
+            values -= offset
+        if scale is not None:
+            values /= scale
+        if integer:
+            np.rint(values, out=values)
+    else:
+        values = block
+    if integer and values.dtype.kind == 'f':
+        nan = np.isnan(values)
+        if nan.any():
+            invalid = nan if invalid is None else invalid | nan
+    if integer and values.dtype.kind in 'iuf':
+        info = np.iinfo(out.dtype)
+        low = info.min + 1 if fill_value == info.min else info.min
+        high = info.max - 1 if fill_value == info.max else info.max
+        if values.dtype.kind == 'f' or np.iinfo(values.dtype).min < low or np.iinfo(values.dtype).max > high:
+            with np.errstate(invalid='ignore'):
+                values = np.clip(values, low, high)
+    with np.errstate(invalid='ignore'):
+        np.copyto(out, values, casting='unsafe')
+    if invalid is not None:
+        out[invalid] = fill_value
+    return out
+
+
+# integer IT... elements that are not a time (the reference date)
+NOT_TIME_ELEMENTS = ('ITDATE', )
+# Delft3D groups with a variable dimension that hold one (constant) cell
+CONSTANT_GROUP_SUFFIXES = ('-const', '-version')
+
+
+def time_element(ds, group):
+    """return (group, element) of the time of a series group or None
+
+    The time is an integer element named IT..., in the group itself
+    (ITHISC in his-series) or in its info group (ITMAPC in map-info-series
+    for map-series).
+    """
+    candidates = [group]
+    if group.endswith('-series') and not group.endswith('-info-series'):
+        candidates.append(group[:-len('-series')] + '-info-series')
+    for candidate in candidates:
+        try:
+            cell = ds.group_cell(candidate)
+        except KeyError:
+            continue
+        for name in cell['variables']:
+            if name in NOT_TIME_ELEMENTS:
+                continue
+            info = ds.element_info(name)
+            if name.startswith('IT') and info['dtype'] == np.int32 and info['nbytes'] == 4:
+                return candidate, name
+    return None
+
+
+def is_series(ds, group):
+    """a group with timesteps, as opposed to a constant group
+
+    A group is a series if it has a time element (see time_element), more
+    than one cell, or a variable dimension (0 in its definition). Delft3D
+    also gives its constant groups (map-const, map-version) a variable
+    dimension, groups named ...-const or ...-version with one cell are
+    constant.
+    """
+    if time_element(ds, group) is not None:
+        return True
+    record = ds.groups[ds.group_def(group)]
+    if record['group_size'] > 1:
+        return True
+    shape = [int(size) for size in record['shape'][:record['size']]]
+    if 0 not in shape:
+        return False
+    names = (record['name'], record['name_dat'])
+    return not any(name.endswith(CONSTANT_GROUP_SUFFIXES) for name in names)
+
+
+def prefetch(iterable):
+    """iterate over iterable while the next item is produced in a background thread
+
+    Only the background thread advances the iterable, so reads from a
+    nefis file stay sequential while the caller processes the current item.
+    Reads release the GIL, but nefis calls are serialized (see wrap_error):
+    reading overlaps with conversion and with writing other formats, not
+    with other nefis calls.
+    """
+    iterator = iter(iterable)
+    end = object()
+    with concurrent.futures.ThreadPoolExecutor(1) as executor:
+        future = executor.submit(next, iterator, end)
+        while True:
+            item = future.result()
+            if item is end:
+                break
+            future = executor.submit(next, iterator, end)
+            yield item
+
+
+# tracing hooks, see span
+HOOKS = []
+# the nefis library is not assumed to be thread safe, every call (and its
+# error message) is made under this lock, see wrap_error
+LOCK = threading.RLock()
+
+
+def add_hook(hook):
+    """trace the spans with hook
+
+    A hook has a start(name, attributes) method, called when a span
+    starts, and an end(name, attributes, token) method, called when it
+    ends with the token returned by start. Spans are open, catalog,
+    read_plan, getelt, decode, convert_chunk and write_chunk. The
+    attributes are a dict with for example the group, element, start and
+    n (the timesteps) and nbytes.
+    """
+    HOOKS.append(hook)
+
+
+def remove_hook(hook):
+    if hook in HOOKS:
+        HOOKS.remove(hook)
+
+
+@contextlib.contextmanager
+def span(name, **attributes):
+    """trace a named span with the hooks, yields the attributes so they can be extended"""
+    if not HOOKS:
+        yield attributes
+        return
+    hooks = list(HOOKS)
+    tokens = [hook.start(name, attributes) for hook in hooks]
+    try:
+        yield attributes
+    finally:
+        for hook, token in zip(hooks, tokens):
+            hook.end(name, attributes, token)
+
+
 def wrap_error(func):
-    """wrap a nefis function to raise an error"""
+    """wrap a nefis function to raise an error
+
+    Calls are serialized with LOCK. getelt_into and putelt release the GIL
+    while the library reads or writes, so other threads can convert or
+    write other files meanwhile, but never call nefis concurrently.
+    """
     @functools.wraps(func)
     def wrapped(*args, **kwargs):
-        result = func(*args, **kwargs)
+        with LOCK:
+            if nefis.stats.ENABLED:
+                start = nefis.stats.clock()
+                result = func(*args, **kwargs)
+                nefis.stats.record(func, args, result, nefis.stats.clock() - start)
+            else:
+                result = func(*args, **kwargs)
+            error = result[0] if isinstance(result, tuple) and result else result
+            if error != 0:
+                status, message = nefis.cnefis.neferr()
+                raise NefisException(message, status)
         if isinstance(result, tuple):
             if len(result) == 1:
-                error, result = result[0], None
+                result = None
             elif len(result) == 2:
-                error, result = result[0], result[1]
+                result = result[1]
             elif len(result) > 2:
-                error, result = result[0], result[1:]
-
-        else:
-            error = result
-        if error != 0:
-            status, message = nefis.cnefis.neferr()
-            raise NefisException(message, status)
+                result = result[1:]
         return result
     return wrapped
 
 
-class NefisJSONEncoder(bokeh.core.json_encoder.BokehJSONEncoder):
+class NefisJSONEncoder(json.JSONEncoder):
+    """encode variables, numpy values and arrays, bytes and dates"""
     def default(self, obj):
         if isinstance(obj, Variable):
             return obj.flat()
+        if isinstance(obj, np.ndarray):
+            return obj.tolist()
+        if isinstance(obj, np.generic):
+            return obj.item()
+        if isinstance(obj, bytes):
+            return obj.decode('latin-1')
+        if isinstance(obj, (datetime.date, datetime.datetime)):
+            return obj.isoformat()
         # Let the base class default method raise the TypeError
-        return bokeh.core.json_encoder.BokehJSONEncoder.default(self, obj)
+        return json.JSONEncoder.default(self, obj)
 
 
 class Nefis(object):
     """Nefis file"""
-    def __init__(self, def_file, ac_type=b'r', coding=b' '):
-        """dat file is expected to be named .dat instead of .def"""
+    def __init__(self, def_file, ac_type=b'r', coding=b' ', engine='auto', memory_budget=None):
+        """dat file is expected to be named .dat instead of .def
+
+        With engine 'auto' series at a point (timeseries) are read from the
+        point-major copy in the sidecar if there is one (see nefis.rechunk),
+        with engine 'nefis' always from the file. Reads that would allocate
+        more than memory_budget (or the global MEMORY_BUDGET) bytes raise a
+        MemoryBudgetError before allocating.
+        """
 
         self.def_file = def_file
         self.dat_file = def_file.replace('.def', '.dat')
-        assert os.path.exists(self.def_file)
-        assert os.path.exists(self.dat_file)
+        if ac_type in (b'r', 'r'):
+            assert os.path.exists(self.def_file)
+            assert os.path.exists(self.dat_file)
         logger.debug("Opening files: '%s' as def and '%s' as dat",
                      self.def_file, self.dat_file)
-        filehandle = wrap_error(nefis.cnefis.crenef)(
-            self.dat_file,
-            self.def_file,
-            coding,
-            ac_type
-        )
+        with span('open', file=self.def_file):
+            filehandle = wrap_error(nefis.cnefis.crenef)(
+                self.dat_file,
+                self.def_file,
+                coding,
+                ac_type
+            )
         self.filehandle = filehandle
+        self._stats = nefis.stats.Stats()
+        nefis.stats.register(filehandle, self._stats)
+        self.ac_type = ac_type
+        self.coding = coding
+        self.engine = engine
+        self.memory_budget = memory_budget
+        self.sidecar = nefis.sidecar.Sidecar(self.def_file, self.dat_file)
+        # element definitions and active cell mappings do not change
+        self._element_info = {}
+        self._active_cells = {}
+        self._catalog = {}
+        self._derived = collections.OrderedDict()
 
     def close(self):
         wrap_error(nefis.cnefis.clsnef)(self.filehandle)
+        nefis.stats.unregister(self.filehandle)
+
+    def stats(self):
+        """the counters of the library calls for this file (see nefis.stats), if enabled"""
+        return self._stats.snapshot()
+
+    def allocations(self):
+        """the counters of the buffers allocated for this file per site (see nefis.stats), if enabled"""
+        return self._stats.allocations()
+
+    def reset_stats(self):
+        self._stats.reset()
+
+    @property
+    def budget(self):
+        """the memory budget in bytes of this file or the global one, the smallest, None if unlimited"""
+        budgets = [budget for budget in (self.memory_budget, MEMORY_BUDGET) if budget is not None]
+        return min(budgets) if budgets else None
+
+    def check_memory(self, nbytes, what='read'):
+        """raise a MemoryBudgetError if nbytes is more than the memory budget"""
+        budget = self.budget
+        if budget is not None and nbytes > budget:
+            raise MemoryBudgetError(
+                "%s of %s needs %d bytes, the memory budget is %d bytes" % (what, self.def_file, nbytes, budget),
+                nbytes,
+                budget
+            )
+
+    def allocate(self, site, shape, dtype):
+        """allocate an array for site (getelt, read...) within the memory budget"""
+        dtype = np.dtype(dtype)
+        nbytes = int(np.prod(shape)) * dtype.itemsize
+        self.check_memory(nbytes, site)
+        if nefis.stats.ENABLED:
+            nefis.stats.record_allocation(site, nbytes, self.filehandle)
+        return np.empty(shape, dtype=dtype)
+
+    def refresh(self):
+        """forget the cached catalog (groups, cells and variables)"""
+        self._catalog = {}
+
+    def reopen(self):
+        """close and open the files, to see everything another process wrote"""
+        wrap_error(nefis.cnefis.clsnef)(self.filehandle)
+        nefis.stats.unregister(self.filehandle)
+        self.filehandle = wrap_error(nefis.cnefis.crenef)(
+            self.dat_file,
+            self.def_file,
+            self.coding,
+            self.ac_type
+        )
+        nefis.stats.register(self.filehandle, self._stats)
+
+    def group_size(self, group):
+        """the current number of cells of a data group, also updated in the cached catalog"""
+        size = wrap_error(nefis.cnefis.inqmxi)(self.filehandle, group)
+        for record in self._catalog.get('groups', {}).values():
+            if group in (record["name_dat"], record["name"]):
+                record["group_size"] = size
+        return size
+
+    def follow(self, group, poll=1.0, start=0, timeout=None, structured=False):
+        """yield (t, cell) for the timesteps of group while another process writes them
+
+        The dat and def files are checked with os.stat every poll seconds
+        and only the size of group is queried when they changed. The files
+        are reopened when the open handles report no growth, as the library
+        can keep the old size. A timestep is complete once a later one
+        exists or the files did not change for a poll interval. Cells are
+        read with read_cell. The generator ends after timeout seconds
+        without changes (default never).
+        """
+        t = start
+        state = None
+        known = 0
+        changed = time.time()
+        while True:
+            now = time.time()
+            current = tuple(
+                (stat.st_size, stat.st_mtime)
+                for stat in (os.stat(self.dat_file), os.stat(self.def_file))
+            )
+            if current != state:
+                try:
+                    # first ask the open files
+                    size = self.group_size(group)
+                except NefisException:
+                    # the group is not created yet
+                    size = 0
+                if state is not None and size <= known:
+                    # the library can keep the old group size, look again through fresh handles
+                    self.reopen()
+                    try:
+                        size = self.group_size(group)
+                    except NefisException:
+                        size = 0
+                state = current
+                known = max(known, size)
+                changed = now
+                # the last timestep can still be written
+                complete = known - 1
+            else:
+                complete = known if now - changed >= poll else known - 1
+            stopped = timeout is not None and now - changed >= timeout
+            if stopped:
+                complete = known
+            while t < complete:
+                try:
+                    cell = self.read_cell(group, t=t, structured=structured)
+                except NefisException:
+                    # the open files reported the new size, but do not have the cell yet
+                    self.reopen()
+                    cell = self.read_cell(group, t=t, structured=structured)
+                yield t, cell
+                t += 1
+            if stopped:
+                return
+            time.sleep(poll)
 
     @property
     def groups(self):
+        if 'groups' in self._catalog:
+            return self._catalog['groups']
         groups = {}
         def2dat = {}
-        for group_dat, group_def in self.iter_dat_groups():
-            def2dat[group_def] = group_dat
-        for record in self.iter_def_groups():
-            record["name_dat"] = def2dat[record["name"]]
-            groups[record["name"]] = record
+        with span('catalog', kind='groups'):
+            for group_dat, group_def in self.iter_dat_groups():
+                def2dat[group_def] = group_dat
+            for record in self.iter_def_groups():
+                record["name_dat"] = def2dat[record["name"]]
+                groups[record["name"]] = record
+        self._catalog['groups'] = groups
         return groups
 
     @property
     def cells(self):
+        if 'cells' in self._catalog:
+            return self._catalog['cells']
         cells = {}
-        for record in self.iter_cells():
-            cells[record["name"]] = record
+        with span('catalog', kind='cells'):
+            for record in self.iter_cells():
+                cells[record["name"]] = record
+        self._catalog['cells'] = cells
         return cells
 
     @property
-    def variables(self):
+    def elements(self):
+        if 'elements' in self._catalog:
+            return self._catalog['elements']
         elements = {}
-        cells = self.cells
+        with span('catalog', kind='elements'):
+            for el in self.iter_elements():
+                elements[el["name"]] = el
+        self._catalog['elements'] = elements
+        return elements
 
-        for el in self.iter_elements():
-            elements[el["name"]] = el
-        for cell in self.cells.values():
-            cells[cell["name"]] = cell
+    @property
+    def raw_variables(self):
+        """the variables of the elements in the file"""
+        if 'raw_variables' in self._catalog:
+            return self._catalog['raw_variables']
+        elements = self.elements
+        cells = self.cells
 
         variables = {}
         for cell in cells.values():
@@ -181,8 +611,76 @@ class Nefis(object):
                 )
                 variable._ds = self
                 variables[variable.name] = variable
+        self._catalog['raw_variables'] = variables
         return variables
 
+    @property
+    def derived_definitions(self):
+        """the default derived variables and the ones registered on this file"""
+        import nefis.derived
+        definitions = collections.OrderedDict(nefis.derived.REGISTRY)
+        definitions.update(self._derived)
+        return definitions
+
+    @property
+    def variables(self):
+        """the variables of the elements and the available derived variables"""
+        if 'variables' in self._catalog:
+            return self._catalog['variables']
+        variables = dict(self.raw_variables)
+        self._catalog['variables'] = variables
+        derived = []
+        for name, definition in self.derived_definitions.items():
+            variable = definition.bind(self)
+            if variable is None or name in variables:
+                continue
+            variables[name] = variable
+            derived.append(variable)
+        # after binding, derived variables can depend on each other
+        for variable in derived:
+            try:
+                variable.resolve_group()
+            except KeyError:
+                logger.debug("derived variable %s not available", variable.name, exc_info=True)
+                del variables[variable.name]
+        return variables
+
+    def register_derived(self, name, inputs, kernel, attributes=None, group=None):
+        """register a variable computed by kernel(*inputs), see nefis.derived"""
+        import nefis.derived
+        self._derived[name] = nefis.derived.DerivedVariable(
+            name,
+            inputs,
+            kernel,
+            attributes=attributes,
+            group=group
+        )
+        self._catalog.pop('variables', None)
+        return self.variables.get(name)
+
+    def evaluate(self, names, t=slice(None), chunk_size=None):
+        """iterate over (offset, {name: block}) for the derived variables names"""
+        import nefis.derived
+        return nefis.derived.evaluate(self, names, t=t, chunk_size=chunk_size)
+
+    @property
+    def his(self):
+        """station and cross-section view of a history file"""
+        if 'his' not in self._catalog:
+            self._catalog['his'] = nefis.his.HisFile(self)
+        return self._catalog['his']
+
+    def group_def(self, group):
+        """return the name of the group definition of a (data) group"""
+        for record in self.groups.values():
+            if group in (record["name_dat"], record["name"]):
+                return record["name"]
+        raise KeyError("no group %s in %s" % (group, self.def_file))
+
+    def group_cell(self, group):
+        """return the cell record of a (data) group"""
+        return self.cells[self.groups[self.group_def(group)]["cell"]]
+
     def iter_dat_groups(self):
         """loop over all the groups in the dat file"""
 
@@ -196,7 +694,7 @@ class Nefis(object):
             yield group_dat, group_def
         except NefisException as e:
             logger.debug("no first dat group", exc_info=True)
-            raise StopIteration()
+            return
         # and yield the following groups
         # I don't like while loops so I defined a maximum number of groups
         for i in range(MAXGROUPS):
@@ -206,7 +704,7 @@ class Nefis(object):
                 )
                 yield group_dat, group_def
             except NefisException:
-                raise StopIteration()
+                return
 
     def iter_def_groups(self):
         """loop over all the groups in the def file"""
@@ -232,7 +730,7 @@ class Nefis(object):
             yield record
         except NefisException:
             logger.debug("no first def group", exc_info=True)
-            raise StopIteration()
+            return
 
         # I don't like while loops so I defined a maximum number of groups
         for i in range(MAXGROUPS):
@@ -256,7 +754,7 @@ class Nefis(object):
                 record["group_size"] = result
                 yield record
             except NefisException:
-                raise StopIteration()
+                return
 
         # empty generator
 
@@ -273,7 +771,7 @@ class Nefis(object):
             )
 
         except NefisException:
-            raise StopIteration()
+            return
 
         for i in range(MAXGROUPS):
             try:
@@ -285,7 +783,7 @@ class Nefis(object):
                     variables=variable_names
                 )
             except NefisException:
-                raise StopIteration()
+                return
 
     def iter_elements(self):
         """loop over all the elements in the def file"""
@@ -323,7 +821,7 @@ class Nefis(object):
             result = wrap_error(nefis.cnefis.inqfel)(self.filehandle)
             yield result2record(result)
         except NefisException:
-            raise StopIteration()
+            return
 
         # I don't like while loops so I defined a maximum number of groups
         for i in range(MAXELEMENTS):
@@ -331,79 +829,487 @@ class Nefis(object):
                 result = wrap_error(nefis.cnefis.inqnel)(self.filehandle)
                 yield result2record(result)
             except NefisException:
-                raise StopIteration()
+                return
 
-    def get_data(self, group, element, t=0):
-        """return an array of data"""
-        ntimes = wrap_error(nefis.cnefis.inqmxi)(self.filehandle, group)
-        elm_dimensions = np.zeros(5, dtype='int32')
-        result = wrap_error(nefis.cnefis.inqelm)(self.filehandle, element)
+    def element_info(self, element):
+        """return (cached) definition of an element"""
+        if element in self._element_info:
+            return self._element_info[element]
         (elm_type,
          elm_single_byte,
          elm_quantity,
          elm_unit,
          elm_description,
          elm_count,
-         elm_dimensions) = result
-        logger.info('got info: %s', result)
+         elm_dimensions) = wrap_error(nefis.cnefis.inqelm)(self.filehandle, element)
+        elm_type = elm_type.strip()
+        dimensions = tuple(int(dim) for dim in elm_dimensions)
+        dtype = DTYPES[elm_type]
+        info = dict(
+            type=elm_type,
+            dtype=dtype,
+            np_dtype=np.dtype('S%d' % elm_single_byte if dtype is bytes else dtype),
+            single_bytes=elm_single_byte,
+            dimensions=dimensions,
+            # nefis dimensions are in fortran order
+            shape=dimensions[::-1],
+            nbytes=elm_single_byte * int(np.prod(dimensions))
+        )
+        self._element_info[element] = info
+        return info
+
+    def time_range(self, group, t):
+        """convert a timestep or a slice over the timesteps of group to (start, stop, step, n)"""
+        ntimes = wrap_error(nefis.cnefis.inqmxi)(self.filehandle, group)
+        if not isinstance(t, slice):
+            if t < 0:
+                t += ntimes
+            if not 0 <= t < ntimes:
+                raise IndexError("timestep %s out of range for group %s (%s)" % (t, group, ntimes))
+            return t, t + 1, 1, 1
+        start, stop, step = t.indices(ntimes)
+        if step < 1:
+            raise ValueError("nefis only supports reading with a positive step")
+        n = len(range(start, stop, step))
+        return start, stop, step, n
+
+    def read_plan(self, group, element, t=slice(None), chunk_size=None):
+        """split a selection of timesteps in blocks that are read with one getelt call
+
+        Returns a list of (offset, start, n, step) tuples, offset being the
+        position of the block in the selection. By default blocks are at most
+        CHUNK_BYTES (or the memory budget) large.
+        """
+        with span('read_plan', group=group, element=element):
+            return self.plan_blocks(group, self.element_info(element)['nbytes'], t=t, chunk_size=chunk_size)
+
+    def plan_blocks(self, group, nbytes, t=slice(None), chunk_size=None):
+        """split timesteps t of group in blocks (offset, start, n, step) of chunk_size timesteps
+
+        By default a block holds at most CHUNK_BYTES (or the memory budget)
+        for nbytes per timestep.
+        """
+        start, _, step, n = self.time_range(group, t)
+        if chunk_size is None:
+            chunk_bytes = CHUNK_BYTES if self.budget is None else min(CHUNK_BYTES, self.budget)
+            chunk_size = max(1, chunk_bytes // max(nbytes, 1))
+        return [
+            (offset, start + offset * step, min(chunk_size, n - offset), step)
+            for offset in range(0, n, chunk_size)
+        ]
+
+    def read_range(self, group, element, start, n, step=1, out=None):
+        """read n timesteps of element, starting at start, as one getelt call
+
+        Returns an array with shape (n,) + element shape (character elements
+        as fixed width bytes). The data is read directly into out if given
+        (native dtype, C contiguous).
+        """
+        info = self.element_info(element)
+        shape = (n, ) + info['shape']
+        if out is None:
+            out = self.allocate('getelt', shape, info['np_dtype'])
+        elif out.dtype != info['np_dtype'] or out.size != int(np.prod(shape)):
+            raise ValueError(
+                "out should be a %s array of %s values" % (info['np_dtype'], np.prod(shape))
+            )
+        usr_index = np.zeros((5, 3), dtype=np.int32)
+        # first and last timestep (1 based, inclusive) and step
+        usr_index[0, 0] = start + 1
+        usr_index[0, 1] = start + 1 + (n - 1) * step
+        usr_index[0, 2] = step
+        usr_order = np.arange(1, 6, dtype=np.int32)
+        with span('getelt', group=group, element=element, start=start, n=n, step=step, nbytes=out.nbytes):
+            wrap_error(nefis.cnefis.getelt_into)(
+                self.filehandle,
+                group,
+                element,
+                usr_index,
+                usr_order,
+                out
+            )
+        return out.reshape(shape)
+
+    def iter_chunks(self, group, element, t=slice(None), chunk_size=None):
+        """iterate over (offset, block) for the blocks of the read plan"""
+        for offset, start, n, step in self.read_plan(group, element, t=t, chunk_size=chunk_size):
+            yield offset, self.read_range(group, element, start, n, step=step)
+
+    def active_cells(self, mask='KCS', group='map-const'):
+        """return the (cached) active cell mapping of the mask element"""
+        key = (group, mask)
+        if key not in self._active_cells:
+            cells = ActiveCells(self.get_data(group, mask))
+            if nefis.stats.ENABLED:
+                nefis.stats.record_allocation('cache', cells.mask.nbytes + cells.index.nbytes, self.filehandle)
+            self._active_cells[key] = cells
+        return self._active_cells[key]
+
+    def read(self, group, element, t=0, compact=False, mask='KCS', dtype=None, out=None,
+             scale=None, offset=None, missing_value=None, fill_value=None, chunk_size=None):
+        """read timestep t (int) or timesteps t (slice) of a numerical element
+
+        The data is read in blocks (see read_plan) and each block is
+        converted to dtype (or the dtype of out) straight into the output
+        array. With scale and offset values are packed as
+        (value - offset) / scale, rounded for integer output, and values
+        equal to missing_value are replaced by fill_value (nan for floats,
+        the minimum integer otherwise). With compact=True map fields are
+        reduced to the active cells of mask.
+        """
+        info = self.element_info(element)
+        single = not isinstance(t, slice)
+        _, _, _, n = self.time_range(group, t)
+        cells = self.active_cells(mask) if compact else None
+        shape = info['shape'] if cells is None else cells.compact_shape(info['shape'])
+        if out is None:
+            if dtype is None:
+                dtype = info['np_dtype'] if scale is None and offset is None else np.float64
+            if self.budget is not None:
+                # check the output and the read buffer before allocating either
+                self.check_memory(self.nbytes(group, element, t=t, compact=compact, mask=mask,
+                                              dtype=dtype, chunk_size=chunk_size))
+            out = self.allocate('read', (n, ) + shape, dtype)
+        else:
+            expected = shape if single else (n, ) + shape
+            if out.shape != expected:
+                raise ValueError("out has shape %s, expected %s" % (out.shape, expected))
+            out = out.reshape((n, ) + shape)
+
+        converting = any(
+            x is not None for x in (cells, scale, offset, missing_value)
+        ) or out.dtype != info['np_dtype'] or not out.flags['C_CONTIGUOUS']
+        for i, start, count, step in self.read_plan(group, element, t=t, chunk_size=chunk_size):
+            if not converting:
+                # native data, let nefis write in the output
+                self.read_range(group, element, start, count, step=step, out=out[i:i + count])
+                continue
+            block = self.read_range(group, element, start, count, step=step)
+            with span('decode', group=group, element=element, start=start, n=count, nbytes=block.nbytes):
+                if cells is not None:
+                    block = cells.compact(block, time=True)
+                convert_block(
+                    block,
+                    out[i:i + count],
+                    scale=scale,
+                    offset=offset,
+                    missing_value=missing_value,
+                    fill_value=fill_value
+                )
+        if single:
+            return out[0]
+        return out
+
+    def nbytes(self, group, element, t=0, compact=False, mask='KCS', dtype=None, chunk_size=None):
+        """estimate the bytes that read allocates for timesteps t (int or slice) of element
+
+        That is the output array plus, if the values are converted (to
+        another dtype or to the active cells), the buffer of the largest
+        read block. Nothing is read, except the mask with compact=True.
+        """
+        info = self.element_info(element)
+        _, _, _, n = self.time_range(group, t)
+        shape = info['shape'] if not compact else self.active_cells(mask).compact_shape(info['shape'])
+        dtype = np.dtype(info['np_dtype'] if dtype is None else dtype)
+        nbytes = n * int(np.prod(shape)) * dtype.itemsize
+        if n and (compact or dtype != info['np_dtype']):
+            blocks = self.read_plan(group, element, t=t, chunk_size=chunk_size)
+            nbytes += max(count for _, _, count, _ in blocks) * info['nbytes']
+        return nbytes
+
+    def timeseries(self, group, element, index, t=slice(None)):
+        """return the series of element at index (an index in the element shape or a flat index)
+
+        If engine is 'auto' and the element has a valid point-major copy in
+        the sidecar, the series is one contiguous read from that copy.
+        Otherwise all fields are read from the file.
+        """
+        variable = self.variables[element]
+        entry = None
+        if self.engine == 'auto':
+            entry = self.sidecar.rechunked(group, element)
+        if entry is not None:
+            shape = tuple(entry['shape'])
+        elif element in self.raw_variables:
+            shape = self.element_info(element)['shape']
+        else:
+            shape = variable.numpy_shape
+        if isinstance(index, tuple):
+            point = np.ravel_multi_index(index, shape)
+        else:
+            point = index
+
+        if entry is not None:
+            points = self._catalog.setdefault('rechunked', {}).get((group, element))
+            if points is None:
+                path = self.sidecar.file(entry['file'])
+                if entry['format'] == 'zarr':
+                    import zarr
+                    points = zarr.open_array(path, mode='r')
+                else:
+                    points = np.load(path, mmap_mode='r')
+                self._catalog['rechunked'][(group, element)] = points
+            logger.debug("reading series of %s at %s from sidecar", element, point)
+            return np.array(points[point, t])
 
+        _, _, _, n = self.time_range(group, t)
+        series = None
+        for offset, block in variable.iter_chunks(t=t):
+            if series is None:
+                series = self.allocate('timeseries', n, block.dtype)
+            count = block.shape[0]
+            series[offset:offset + count] = block.reshape(count, -1)[:, point]
+        return series
+
+    def read_cell(self, group, t=0, structured=False):
+        """read all elements of the cell of group for timestep t (int) or timesteps t (slice)
+
+        One buffer of the cell size (times the number of timesteps) is
+        allocated and every element is read in a single getelt call into
+        its part of that buffer. Returns a dict of arrays (character
+        elements as fixed width bytes) or, with structured=True, a numpy
+        structured array with one field per element (for several timesteps
+        a copy, the buffer and the records together are checked against the
+        memory budget).
+        """
+        cell = self.group_cell(group)
+        start, _, step, n = self.time_range(group, t)
+        nbytes = n * cell['size']
+        if self.budget is not None:
+            # the records of several timesteps are a second array of the buffer size
+            self.check_memory(2 * nbytes if structured and n > 1 else nbytes, 'read_cell')
+        buffer = self.allocate('read_cell', nbytes, np.uint8)
+        arrays = collections.OrderedDict()
+        fields = []
+        position = 0
+        for name in cell['variables']:
+            info = self.element_info(name)
+            nbytes = info['nbytes'] * n
+            out = buffer[position:position + nbytes].view(info['np_dtype'])
+            arrays[name] = self.read_range(group, name, start, n, step=step, out=out)
+            fields.append((name, info['np_dtype'], info['shape']))
+            position += nbytes
+
+        single = not isinstance(t, slice)
+        if structured:
+            dtype = np.dtype(fields)
+            if n == 1:
+                # for one timestep the element after element layout is the record layout
+                records = buffer[:position].view(dtype)
+            else:
+                records = self.allocate('read_cell', n, dtype)
+                for name, array in arrays.items():
+                    records[name] = array
+            return records[0] if single else records
+        if single:
+            return collections.OrderedDict(
+                (name, array[0]) for name, array in arrays.items()
+            )
+        return arrays
+
+    def get_data(self, group, element, t=0, compact=False, mask='KCS'):
+        """return an array of data
+
+        t is a timestep or a slice of timesteps. If compact is True map
+        fields are returned for the active cells of mask only. Character
+        elements are returned as bytes, a list of bytes for a slice.
+        """
+        info = self.element_info(element)
+        if info['dtype'] is not bytes:
+            return self.read(group, element, t=t, compact=compact, mask=mask)
+
+        start, _, step, n = self.time_range(group, t)
         usr_index = np.zeros((5, 3), dtype=np.int32)
-        # first timestep:  0 -> 1 based
-        usr_index[0, 0] = t + 1
-        # last timestep:
-        usr_index[0, 1] = t + 1
-        # step
-        usr_index[0, 2] = 1
-
-        logger.info("elm_dimensions: %s", elm_dimensions)
-        logger.info("elm_single_byte: %s", elm_single_byte)
-        # number of bytes
-        length = elm_single_byte
-        # times number of timesteps
-        length *= 1
-        # times dimensions
-        for dim in elm_dimensions:
-            length *= dim
+        # first and last timestep (1 based, inclusive) and step
+        usr_index[0, 0] = start + 1
+        usr_index[0, 1] = start + 1 + max(n - 1, 0) * step
+        usr_index[0, 2] = step
         usr_order = np.arange(1, 6, dtype=np.int32)
+        nbytes = n * info['nbytes']
+        self.check_memory(nbytes, 'get_data')
+        if nefis.stats.ENABLED:
+            nefis.stats.record_allocation('get_data', nbytes, self.filehandle)
+        if n == 0:
+            return []
         # get the data (as buffer)
-        buffer_res = wrap_error(nefis.cnefis.getelt)(
+        with span('getelt', group=group, element=element, start=start, n=n, step=step, nbytes=nbytes):
+            buffer_res = wrap_error(nefis.cnefis.getelt)(
+                self.filehandle,
+                group,
+                element,
+                usr_index,
+                usr_order,
+                nbytes
+            )
+        if not isinstance(t, slice):
+            # return bytes
+            return buffer_res.rstrip()
+        # a list of bytes, one per timestep
+        size = info['nbytes']
+        return [buffer_res[i * size:(i + 1) * size].rstrip() for i in range(n)]
+
+    def digest(self, group, element, t=0):
+        """digest of the raw bytes of timestep t (int) of an element, a list of digests for a slice
+
+        Digests stored in the sidecar (see digests) are used if there are any.
+        """
+        start, stop, step, n = self.time_range(group, t)
+        stored = self.sidecar.digests(group, element)
+        if stored is not None and len(stored) == self.time_range(group, slice(None))[3]:
+            selection = stored[start:stop:step]
+        else:
+            selection = []
+            for offset, block in self.iter_chunks(group, element, t=slice(start, stop, step)):
+                selection.extend(nefis.sidecar.digest(row) for row in block)
+        return selection if isinstance(t, slice) else selection[0]
+
+    def digests(self, group, element, chunk_size=None, save=True):
+        """digests of all timesteps of an element, computed while streaming
+
+        The digests are stored in the sidecar index (unless save is False),
+        so they are only computed again when the dat file changes.
+        """
+        ntimes = self.time_range(group, slice(None))[3]
+        stored = self.sidecar.digests(group, element)
+        if stored is not None and len(stored) == ntimes:
+            return stored
+        digests = []
+        for offset, block in prefetch(self.iter_chunks(group, element, chunk_size=chunk_size)):
+            digests.extend(nefis.sidecar.digest(row) for row in block)
+        if save:
+            try:
+                self.sidecar.save_digests(group, element, digests)
+            except (IOError, OSError):
+                logger.warning("could not store digests in %s", self.sidecar.path, exc_info=True)
+        return digests
+
+    def define_element(self, name, type, single_bytes, dimensions, quantity='', unit='', description=''):
+        """define an element, dimensions in nefis (fortran) order"""
+        dimensions = np.asarray(dimensions, dtype=np.int32)
+        wrap_error(nefis.cnefis.defelm)(
+            self.filehandle,
+            name,
+            type,
+            single_bytes,
+            quantity,
+            unit,
+            description,
+            dimensions.size,
+            dimensions
+        )
+        self.refresh()
+
+    def define_cell(self, name, elements):
+        """define a cell of the elements"""
+        wrap_error(nefis.cnefis.defcel)(self.filehandle, name, len(elements), list(elements))
+        self.refresh()
+
+    def define_group(self, name, cell, dimensions=(0, ), order=None):
+        """define a group of cells, a first dimension of 0 makes it variable (a series)"""
+        dimensions = np.asarray(dimensions, dtype=np.int32)
+        if order is None:
+            order = np.arange(1, dimensions.size + 1, dtype=np.int32)
+        wrap_error(nefis.cnefis.defgrp)(
+            self.filehandle,
+            name,
+            cell,
+            dimensions.size,
+            dimensions,
+            np.asarray(order, dtype=np.int32)
+        )
+        self.refresh()
+
+    def create_group(self, name, definition=None):
+        """create data group name of the group definition (default the same name)"""
+        wrap_error(nefis.cnefis.credat)(self.filehandle, name, definition or name)
+        self.refresh()
+
+    def write_range(self, group, element, start, data, step=1):
+        """write data, shape (n,) + element shape, to n cells starting at start
+
+        The inverse of read_range, the data is written with one putelt call
+        straight from the array memory.
+        """
+        info = self.element_info(element)
+        data = np.asarray(data)
+        if data.dtype != info['np_dtype']:
+            data = data.astype(info['np_dtype'])
+        n = data.size // max(int(np.prod(info['shape'])), 1)
+        if data.size != n * int(np.prod(info['shape'])) or n == 0:
+            raise ValueError(
+                "data of shape %s does not fit element %s %s" % (data.shape, element, info['shape'])
+            )
+        usr_index = np.zeros((5, 3), dtype=np.int32)
+        usr_index[0, 0] = start + 1
+        usr_index[0, 1] = start + 1 + (n - 1) * step
+        usr_index[0, 2] = step
+        usr_order = np.arange(1, 6, dtype=np.int32)
+        wrap_error(nefis.cnefis.putelt)(
             self.filehandle,
             group,
             element,
             usr_index,
             usr_order,
-            length
+            data
         )
-        # lookup data type
-        dtype = DTYPES[elm_type.strip()]
-        if dtype is bytes:
-            # return bytes
-            return buffer_res.rstrip()
-        # convert to typed array
-        data = np.fromstring(buffer_res, dtype=dtype)
-        # return shaped array
-        return data.reshape(elm_dimensions[::-1])
 
-    def dump_json(self):
-        """Create a dump of the file"""
+    def attributes(self, group):
+        """the integer, real and string attributes of a data group"""
+        result = collections.OrderedDict()
+        functions = [
+            (nefis.cnefis.inqfia, nefis.cnefis.inqnia),
+            (nefis.cnefis.inqfra, nefis.cnefis.inqnra),
+            (nefis.cnefis.inqfsa, nefis.cnefis.inqnsa)
+        ]
+        for first, following in functions:
+            func = first
+            for i in range(MAXELEMENTS):
+                try:
+                    name, value = wrap_error(func)(self.filehandle, group)
+                except NefisException:
+                    break
+                func = following
+                if isinstance(name, bytes):
+                    name = name.decode()
+                if isinstance(value, bytes):
+                    value = value.decode()
+                name = name.rstrip()
+                if not name:
+                    break
+                result[name] = value.rstrip() if hasattr(value, 'rstrip') else value
+        return result
 
-        groups = self.groups
-        cells = self.cells
-        variables = self.variables
+    def put_attribute(self, group, name, value):
+        """write an integer, real or string attribute of a data group"""
+        if isinstance(value, (int, np.integer)):
+            func = nefis.cnefis.putiat
+        elif isinstance(value, (float, np.floating)):
+            func = nefis.cnefis.putrat
+        else:
+            func = nefis.cnefis.putsat
+        wrap_error(func)(self.filehandle, group, name, value)
 
-        for group in groups.values():
-            # replace cell name by cell object
-            group["cell"] = cells[group["cell"]]
-            cell = group["cell"]
-            variable_list = []
-            for name in cell["variables"]:
-                variable_list.append(variables[name])
-            cell["variables"] = variable_list
+    def flush(self):
+        """flush the data and definition file"""
+        wrap_error(nefis.cnefis.flsdat)(self.filehandle)
+        wrap_error(nefis.cnefis.flsdef)(self.filehandle)
+
+    def to_zarr(self, path, chunks=None, **kwargs):
+        """write the file to a zarr directory store, see nefis.convert.nefis2zarr"""
+        import nefis.convert
+        return nefis.convert.nefis2zarr(self, path, chunks=chunks, **kwargs)
+
+    def to_arrow(self, group, elements=None, t=slice(None), chunk_size=None):
+        """return the series of group as an arrow table, see nefis.convert.iter_arrow_batches"""
+        import nefis.convert
+        return nefis.convert.nefis2arrow(self, group, elements=elements, t=t, chunk_size=chunk_size)
 
-        return json.dumps({"groups": groups}, cls=NefisJSONEncoder, indent=2)
+    def dump_json(self):
+        """Create a dump of the file"""
+        import nefis.dump
+        return ''.join(nefis.dump.iter_json(self))
 
     def dump_ncdump(self):
         """Dump in a format similar to ncdump"""
-        tmpl = mako.template.Template(dump_tmpl)
-        text = tmpl.render(ds=self, variables=self.variables, groups=self.groups)
-        return text
+        import nefis.dump
+        return ''.join(nefis.dump.iter_dump(self, format='ncdump'))
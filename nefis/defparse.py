@@ -0,0 +1,204 @@
+"""Read the definitions of a nefis definition (.def) file in pure Python
+
+The element, cell and group definitions are parsed from one read of the
+file, without the nefis library and without opening the dat file. The
+records are the same as those of Nefis.elements, Nefis.cells and
+Nefis.groups, except that groups lack the data part (name_dat and
+group_size, stored in the dat file). Group attributes are also stored in
+the dat file and are not available.
+
+A version 4 definition file starts with a 60 character header (the last
+character is the coding, N or B for big endian, L for little endian) and
+the file size, followed by hash tables of 997 record offsets for the
+elements, cells and groups. Every record starts with the offset of the
+next record in its hash chain (-1 at the end), its length and its kind
+('   1' element, '   2' cell, '   3' group).
+"""
+from __future__ import print_function, unicode_literals, division, absolute_import
+
+import collections
+import logging
+import struct
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+HEADER_LENGTH = 60
+HASH_SIZE = 997
+NAME_LENGTH = 16
+TYPE_LENGTH = 8
+DESCRIPTION_LENGTH = 64
+MAXDIMS = 5
+KINDS = ('elements', 'cells', 'groups')
+TYPES = {
+    "INTEGER": "int32",
+    "REAL": "float32",
+    "CHARACTE": "string"
+}
+NP_DTYPES = {
+    'INTEGER': np.int32,
+    'REAL': np.float32,
+    'CHARACTE': bytes
+}
+
+
+def text(data):
+    return data.decode('latin-1').rstrip()
+
+
+class Definitions(object):
+    """The definitions of a nefis definition file"""
+    def __init__(self, def_file):
+        self.def_file = def_file
+        with open(def_file, 'rb') as f:
+            self._data = f.read()
+        header = self._data[:HEADER_LENGTH]
+        if b'NEFIS Definition File' not in header:
+            raise ValueError("%s is not a nefis definition file" % (def_file, ))
+        if b'Version 4' not in header:
+            raise ValueError("%s: only version 4 definition files can be parsed" % (def_file, ))
+        self.coding = header[-1:].decode()
+        self._endian = '<' if self.coding == 'L' else '>'
+        # one bulk read of the three hash tables
+        tables = np.frombuffer(
+            self._data,
+            dtype=self._endian + 'i4',
+            count=3 * HASH_SIZE,
+            offset=HEADER_LENGTH + 4
+        ).reshape(3, HASH_SIZE)
+        self._tables = dict(zip(KINDS, tables))
+        self._catalog = {}
+
+    def _records(self, kind):
+        """iterate over the bodies (after the kind) of the records in a hash table"""
+        for offset in self._tables[kind]:
+            while offset != -1:
+                offset = int(offset)
+                next_offset, length = struct.unpack(self._endian + 'ii', self._data[offset:offset + 8])
+                # the body starts after the 4 character kind
+                yield self._data[offset + 12:offset + 8 + length]
+                offset = next_offset
+
+    def _ints(self, data, count):
+        return np.frombuffer(data, dtype=self._endian + 'i4', count=count).astype(np.int32)
+
+    @property
+    def elements(self):
+        """the element records, as Nefis.elements"""
+        if 'elements' in self._catalog:
+            return self._catalog['elements']
+        elements = collections.OrderedDict()
+        infos = {}
+        for body in self._records('elements'):
+            position = 0
+            fields = []
+            for length in (NAME_LENGTH, TYPE_LENGTH):
+                fields.append(text(body[position:position + length]))
+                position += length
+            name, type = fields
+            nbytes, single_bytes = struct.unpack(self._endian + 'ii', body[position:position + 8])
+            position += 8
+            fields = []
+            for length in (NAME_LENGTH, NAME_LENGTH, DESCRIPTION_LENGTH):
+                fields.append(text(body[position:position + length]))
+                position += length
+            quantity, unit, description = fields
+            count = struct.unpack(self._endian + 'i', body[position:position + 4])[0]
+            dimensions = self._ints(body[position + 4:], MAXDIMS)[:count]
+            elements[name] = dict(
+                name=name,
+                attributes=dict(
+                    units=unit,
+                    description=description,
+                    quantity=quantity
+                ),
+                dtype=TYPES[type],
+                quantity=quantity,
+                shape=dimensions
+            )
+            infos[name] = (type, single_bytes, nbytes, dimensions)
+        self._catalog['elements'] = elements
+        self._catalog['infos'] = infos
+        return elements
+
+    @property
+    def cells(self):
+        """the cell records, as Nefis.cells"""
+        if 'cells' in self._catalog:
+            return self._catalog['cells']
+        cells = collections.OrderedDict()
+        for body in self._records('cells'):
+            name = text(body[:NAME_LENGTH]).rstrip('= ')
+            size, count = struct.unpack(self._endian + 'ii', body[NAME_LENGTH:NAME_LENGTH + 8])
+            position = NAME_LENGTH + 8
+            names = [
+                text(body[position + i * NAME_LENGTH:position + (i + 1) * NAME_LENGTH]).rstrip('= ')
+                for i in range(count)
+            ]
+            cells[name] = dict(
+                name=name,
+                size=size,
+                variables=names
+            )
+        self._catalog['cells'] = cells
+        return cells
+
+    @property
+    def groups(self):
+        """the group definition records, as Nefis.groups without name_dat and group_size"""
+        if 'groups' in self._catalog:
+            return self._catalog['groups']
+        groups = collections.OrderedDict()
+        for body in self._records('groups'):
+            name = text(body[:NAME_LENGTH])
+            cell = text(body[NAME_LENGTH:2 * NAME_LENGTH])
+            values = self._ints(body[2 * NAME_LENGTH:], 1 + 2 * MAXDIMS)
+            count = int(values[0])
+            groups[name] = dict(
+                name=name,
+                cell=cell,
+                size=count,
+                shape=values[1:1 + count],
+                order=values[1 + MAXDIMS:1 + MAXDIMS + count]
+            )
+        self._catalog['groups'] = groups
+        return groups
+
+    @property
+    def variables(self):
+        """the variables of the elements, as Variable.flat() of Nefis.raw_variables with the group"""
+        variables = {}
+        elements = self.elements
+        for cell in self.cells.values():
+            for name in cell["variables"]:
+                el = elements[name]
+                variables[name] = dict(
+                    group=cell["name"],
+                    name=el["name"],
+                    dtype=el["dtype"],
+                    shape=el["shape"],
+                    attributes=el["attributes"]
+                )
+        return variables
+
+    def element_info(self, element):
+        """the definition of an element, as Nefis.element_info"""
+        self.elements
+        type, single_bytes, nbytes, dimensions = self._catalog['infos'][element]
+        dtype = NP_DTYPES[type]
+        dimensions = tuple(int(dim) for dim in dimensions)
+        return dict(
+            type=type,
+            dtype=dtype,
+            np_dtype=np.dtype('S%d' % single_bytes if dtype is bytes else dtype),
+            single_bytes=single_bytes,
+            dimensions=dimensions,
+            shape=dimensions[::-1],
+            nbytes=single_bytes * int(np.prod(dimensions))
+        )
+
+
+def parse(def_file):
+    """return the Definitions of a definition file"""
+    return Definitions(def_file)
@@ -0,0 +1,325 @@
+"""Variables derived from the elements of a nefis file
+
+A derived variable is declared by its inputs and a numpy kernel. It is
+evaluated lazily, block by block over time, through the same read plan as
+the elements. Inputs from constant groups (map-const) are read once and
+passed without time axis, other inputs are passed with a leading time
+axis. Evaluating several derived variables together reads each input
+once per block.
+"""
+from __future__ import print_function, unicode_literals, division, absolute_import
+
+import collections
+import logging
+
+import numpy as np
+
+import nefis.dataset
+
+logger = logging.getLogger(__name__)
+
+# default definitions, available on every file that has the inputs
+REGISTRY = collections.OrderedDict()
+
+
+class DerivedVariable(nefis.dataset.Variable):
+    """A variable computed by kernel(*inputs)
+
+    inputs are element or derived variable names, a tuple of names means
+    the first one that is available in the file.
+    """
+    def __init__(self, name, inputs, kernel, attributes=None, group=None):
+        super(DerivedVariable, self).__init__(
+            group=group,
+            name=name,
+            dtype=None,
+            shape=(),
+            attributes=attributes or {}
+        )
+        self.inputs = inputs
+        self.kernel = kernel
+        self.numpy_shape = None
+
+    def _inferred(self):
+        """bound variables infer their shape and dtype on first use"""
+        if self._numpy_shape is None and self._ds is not None:
+            self.infer()
+
+    @property
+    def numpy_shape(self):
+        self._inferred()
+        return self._numpy_shape
+
+    @numpy_shape.setter
+    def numpy_shape(self, value):
+        self._numpy_shape = value
+
+    @property
+    def shape(self):
+        self._inferred()
+        return self._shape
+
+    @shape.setter
+    def shape(self, value):
+        self._shape = value
+
+    @property
+    def dtype(self):
+        self._inferred()
+        return self._dtype
+
+    @dtype.setter
+    def dtype(self, value):
+        self._dtype = value
+
+    def bind(self, ds):
+        """return a copy bound to ds, or None if the inputs are not available"""
+        variables = ds.raw_variables
+        definitions = ds.derived_definitions
+        inputs = []
+        for alternatives in self.inputs:
+            if not isinstance(alternatives, tuple):
+                alternatives = (alternatives, )
+            for name in alternatives:
+                if name in variables or name in definitions:
+                    inputs.append(name)
+                    break
+            else:
+                return None
+        bound = DerivedVariable(self.name, inputs, self.kernel, dict(self.attributes), self.group)
+        bound._ds = ds
+        return bound
+
+    def resolve_group(self):
+        """the group of the first input that is a series, or of the first input"""
+        if self.group is not None:
+            return self.group
+        ds = self._ds
+        groups = []
+        for name in self.inputs:
+            variable = ds.variables[name]
+            group = variable.resolve_group() if isinstance(variable, DerivedVariable) else variable.group
+            if not is_constant(ds, group):
+                self.group = group
+                return group
+            groups.append(group)
+        self.group = groups[0]
+        return self.group
+
+    def infer(self):
+        """determine dtype and shape by evaluating the kernel on dummy inputs
+
+        The inputs are broadcast views of one value, without the memory of
+        a full field. A kernel that does not fit the inputs raises here, on
+        first use of the shape or dtype.
+        """
+        ds = self._ds
+        group = self.resolve_group()
+        arrays = []
+        for name in self.inputs:
+            variable = ds.variables[name]
+            if isinstance(variable, DerivedVariable):
+                shape = variable.numpy_shape
+                dtype = variable.dtype
+            else:
+                info = ds.element_info(name)
+                shape = info['shape']
+                dtype = info['np_dtype']
+            if not is_constant(ds, variable.group):
+                shape = (1, ) + tuple(shape)
+            arrays.append(np.broadcast_to(np.ones((), dtype=dtype), shape))
+        result = np.asarray(self.kernel(*arrays))
+        if is_constant(ds, group):
+            numpy_shape = result.shape
+        else:
+            numpy_shape = result.shape[1:]
+        self.numpy_shape = tuple(numpy_shape)
+        # like the elements, shape is in nefis (fortran) order
+        self.shape = self.numpy_shape[::-1]
+        self.dtype = str(result.dtype)
+
+    def __getitem__(self, s=None):
+        if s == slice(None):
+            s = 0
+        return self.read(s)
+
+    def read_plan(self, t=slice(None), chunk_size=None):
+        return plan(self._ds, [self.name], t=t, chunk_size=chunk_size)
+
+    def iter_chunks(self, t=slice(None), chunk_size=None):
+        for offset, values in evaluate(self._ds, [self.name], t=t, chunk_size=chunk_size):
+            yield offset, values[self.name]
+
+    def nbytes(self, t=0, compact=False, mask='KCS', dtype=None, chunk_size=None):
+        """estimate the bytes that read allocates: the output and the inputs of the largest block"""
+        ds = self._ds
+        _, _, _, n = ds.time_range(self.group, t)
+        shape = self.numpy_shape if not compact else ds.active_cells(mask).compact_shape(self.numpy_shape)
+        nbytes = n * int(np.prod(shape)) * np.dtype(dtype or self.dtype).itemsize
+        blocks = plan(ds, [self.name], t=t, chunk_size=chunk_size)
+        if blocks:
+            inputs = sum(
+                ds.element_info(name)['nbytes']
+                for name, variable in raw_inputs(ds, [self.name]).items()
+                if not is_constant(ds, variable.group)
+            )
+            nbytes += max(count for _, _, count, _ in blocks) * inputs
+        return nbytes
+
+    def read(self, t=0, compact=False, mask='KCS', dtype=None, out=None,
+             scale=None, offset=None, missing_value=None, fill_value=None, chunk_size=None):
+        """evaluate timestep t (int) or timesteps t (slice), see Nefis.read for the options"""
+        ds = self._ds
+        single = not isinstance(t, slice)
+        _, _, _, n = ds.time_range(self.group, t)
+        cells = ds.active_cells(mask) if compact else None
+        shape = self.numpy_shape if cells is None else cells.compact_shape(self.numpy_shape)
+        if out is None:
+            if dtype is None:
+                dtype = self.dtype if scale is None and offset is None else np.float64
+            if ds.budget is not None:
+                ds.check_memory(self.nbytes(t=t, compact=compact, mask=mask, dtype=dtype, chunk_size=chunk_size))
+            out = ds.allocate('read', (n, ) + shape, dtype)
+        else:
+            expected = shape if single else (n, ) + shape
+            if out.shape != expected:
+                raise ValueError("out has shape %s, expected %s" % (out.shape, expected))
+            out = out.reshape((n, ) + shape)
+        for i, block in self.iter_chunks(t=t, chunk_size=chunk_size):
+            if cells is not None:
+                block = cells.compact(block, time=True)
+            nefis.dataset.convert_block(
+                block,
+                out[i:i + block.shape[0]],
+                scale=scale,
+                offset=offset,
+                missing_value=missing_value,
+                fill_value=fill_value
+            )
+        if single:
+            return out[0]
+        return out
+
+
+def register(name, inputs, attributes=None, group=None):
+    """decorator that registers a kernel as a default derived variable"""
+    def decorator(kernel):
+        REGISTRY[name] = DerivedVariable(name, inputs, kernel, attributes=attributes, group=group)
+        return kernel
+    return decorator
+
+
+def is_constant(ds, group):
+    """groups that are not a series (map-const, see nefis.dataset.is_series) are read once"""
+    return not nefis.dataset.is_series(ds, group)
+
+
+def raw_inputs(ds, names):
+    """the elements needed to evaluate names, in order of first use"""
+    elements = collections.OrderedDict()
+
+    def visit(name):
+        variable = ds.variables[name]
+        if isinstance(variable, DerivedVariable):
+            for input_ in variable.inputs:
+                visit(input_)
+        else:
+            elements[name] = variable
+    for name in names:
+        visit(name)
+    return elements
+
+
+def plan(ds, names, t=slice(None), chunk_size=None):
+    """the read plan (offset, start, n, step) shared by the derived variables names"""
+    group = ds.variables[names[0]].group
+    elements = raw_inputs(ds, names)
+    for name, variable in elements.items():
+        if is_constant(ds, variable.group):
+            continue
+        if ds.groups[ds.group_def(variable.group)]['group_size'] != ds.groups[ds.group_def(group)]['group_size']:
+            raise ValueError(
+                "input %s in group %s does not match the timesteps of %s" % (name, variable.group, group)
+            )
+    nbytes = sum(
+        ds.element_info(name)['nbytes']
+        for name, variable in elements.items()
+        if not is_constant(ds, variable.group)
+    )
+    return ds.plan_blocks(group, nbytes, t=t, chunk_size=chunk_size)
+
+
+def evaluate(ds, names, t=slice(None), chunk_size=None):
+    """iterate over (offset, {name: block}) for the derived variables names
+
+    Every element input is read once per block, also if it is used by
+    several of the (nested) derived variables.
+    """
+    constants = {}
+    for offset, start, count, step in plan(ds, names, t=t, chunk_size=chunk_size):
+        values = dict(constants)
+
+        def value(name):
+            if name in values:
+                return values[name]
+            variable = ds.variables[name]
+            if isinstance(variable, DerivedVariable):
+                result = variable.kernel(*[value(input_) for input_ in variable.inputs])
+            elif is_constant(ds, variable.group):
+                result = ds.read(variable.group, name, t=0)
+                constants[name] = result
+            else:
+                result = ds.read_range(variable.group, name, start, count, step=step)
+            values[name] = result
+            return result
+        yield offset, collections.OrderedDict((name, value(name)) for name in names)
+
+
+def depth_average(values, thick):
+    """average over the layer axis (after time) weighted by the relative layer thickness"""
+    return np.tensordot(values, thick, axes=([1], [0])) / thick.sum()
+
+
+@register(
+    'VELOCITY_MAGNITUDE',
+    ('U1', 'V1'),
+    attributes=dict(units='[  M/S  ]', description='Velocity magnitude per layer', quantity='velocity')
+)
+def velocity_magnitude(u, v):
+    return np.hypot(u, v)
+
+
+@register(
+    'U1_DEPTH_AVERAGED',
+    ('U1', 'THICK'),
+    attributes=dict(units='[  M/S  ]', description='Depth averaged U-velocity', quantity='velocity')
+)
+def u_depth_averaged(u, thick):
+    return depth_average(u, thick)
+
+
+@register(
+    'V1_DEPTH_AVERAGED',
+    ('V1', 'THICK'),
+    attributes=dict(units='[  M/S  ]', description='Depth averaged V-velocity', quantity='velocity')
+)
+def v_depth_averaged(v, thick):
+    return depth_average(v, thick)
+
+
+@register(
+    'VELOCITY_MAGNITUDE_DEPTH_AVERAGED',
+    ('U1_DEPTH_AVERAGED', 'V1_DEPTH_AVERAGED'),
+    attributes=dict(units='[  M/S  ]', description='Depth averaged velocity magnitude', quantity='velocity')
+)
+def velocity_magnitude_depth_averaged(u, v):
+    return np.hypot(u, v)
+
+
+@register(
+    'WATER_DEPTH',
+    ('S1', ('DPS', 'DPS0')),
+    attributes=dict(units='[   M   ]', description='Water depth in zeta point', quantity='depth')
+)
+def water_depth(s1, dps):
+    return s1 + dps
@@ -0,0 +1,163 @@
+"""Compare two nefis files, for regression tests of model runs
+
+The catalogs (definitions and group sizes) are compared first. Then every
+common element is streamed from both files block by block, each file
+read ahead in its own thread (the reads take turns, see
+nefis.dataset.wrap_error, but overlap with the comparison), and compared
+with a tolerance like numpy.isclose: |a - b| <= atol + rtol * |b|. Memory use is bounded by the
+block size. Per element the maximum absolute and relative error and the
+position (timestep, index...) where they occur are reported.
+"""
+from __future__ import print_function, unicode_literals, division, absolute_import
+
+import collections
+import logging
+
+import numpy as np
+
+import nefis.dataset
+import nefis.merge
+import nefis.subset
+
+logger = logging.getLogger(__name__)
+
+
+def compare_catalogs(a, b):
+    """return a list of differences between the definitions and group sizes of two files"""
+    differences = []
+    expected = nefis.merge.definitions(a)
+    found = nefis.merge.definitions(b)
+    for kind in ('elements', 'cells', 'groups'):
+        for name in sorted(set(expected[kind]) | set(found[kind])):
+            if name not in found[kind]:
+                differences.append("%s %s only in %s" % (kind, name, a.def_file))
+            elif name not in expected[kind]:
+                differences.append("%s %s only in %s" % (kind, name, b.def_file))
+            elif expected[kind][name] != found[kind][name]:
+                differences.append("%s %s differs: %s != %s" % (
+                    kind, name, expected[kind][name], found[kind][name]))
+    for name, group in sorted(a.groups.items()):
+        other = b.groups.get(name)
+        if other is not None and group['group_size'] != other['group_size']:
+            differences.append("group %s has %s cells in %s and %s in %s" % (
+                name, group['group_size'], a.def_file, other['group_size'], b.def_file))
+    return differences
+
+
+def compare_block(a, b, rtol=1e-05, atol=1e-08):
+    """return (absolute error, relative error, failed) arrays for two blocks
+
+    Character data only compares equal or not. Two nans are equal, a nan
+    and a number are infinitely different.
+    """
+    if a.dtype.kind == 'S':
+        failed = a != b
+        error = failed.astype(np.float64)
+        return error, error, failed
+    a = a.astype(np.float64)
+    b = b.astype(np.float64)
+    error = np.abs(a - b)
+    error[np.isnan(a) & np.isnan(b)] = 0
+    error[np.isnan(error)] = np.inf
+    reference = np.abs(b)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        relative = error / reference
+    relative[error == 0] = 0
+    failed = error > atol + rtol * reference
+    return error, relative, failed
+
+
+def read_blocks(ds, group, element, plan, skip=()):
+    """iterate over (offset, block) of a read plan, except the blocks at the offsets in skip"""
+    for offset, start, n, step in plan:
+        if offset in skip:
+            continue
+        yield offset, ds.read_range(group, element, start, n, step=step)
+
+
+def compare_element(a, b, group, element, rtol=1e-05, atol=1e-08, chunk_size=None, fail_fast=True):
+    """compare the common timesteps of an element, return a result dict
+
+    The result has the number of compared values (n), the number that
+    are not close (failures) and max_abs, max_abs_at, max_rel, max_rel_at.
+    With fail_fast the comparison stops after the first block with
+    failures. Blocks are not read if both files have the same digests
+    for them in their sidecar (see Nefis.digests).
+    """
+    n = min(a.time_range(group, slice(None))[3], b.time_range(group, slice(None))[3])
+    result = dict(n=0, failures=0, max_abs=0.0, max_abs_at=None, max_rel=0.0, max_rel_at=None)
+    if n == 0:
+        return result
+    plan = a.read_plan(group, element, t=slice(0, n), chunk_size=chunk_size)
+    size = int(np.prod(a.element_info(element)['shape']))
+    # blocks with the same stored digests in both files are identical
+    digests_a = a.sidecar.digests(group, element)
+    digests_b = b.sidecar.digests(group, element)
+    skip = set()
+    if digests_a is not None and digests_b is not None and min(len(digests_a), len(digests_b)) >= n:
+        for offset, start, count, step in plan:
+            if digests_a[start:start + count] == digests_b[start:start + count]:
+                skip.add(offset)
+                result['n'] += count * size
+    blocks_a = nefis.dataset.prefetch(read_blocks(a, group, element, plan, skip))
+    blocks_b = nefis.dataset.prefetch(read_blocks(b, group, element, plan, skip))
+    for (offset, block_a), (_, block_b) in zip(blocks_a, blocks_b):
+        error, relative, failed = compare_block(block_a, block_b, rtol=rtol, atol=atol)
+        result['n'] += block_a.size
+        result['failures'] += int(failed.sum())
+        for key, values in (('max_abs', error), ('max_rel', relative)):
+            i = int(np.argmax(values))
+            if values.flat[i] > result[key]:
+                position = np.unravel_index(i, values.shape)
+                result[key] = float(values.flat[i])
+                result[key + '_at'] = (offset + int(position[0]), ) + tuple(int(p) for p in position[1:])
+        if fail_fast and result['failures']:
+            break
+    return result
+
+
+def diff(a, b, rtol=1e-05, atol=1e-08, groups=None, elements=None, chunk_size=None, fail_fast=True):
+    """compare two nefis files, return (catalog differences, element results)
+
+    Element results are an ordered dict of (group, element) -> result
+    dict (see compare_element) for the elements in both files, with the
+    same definition and in a group of both files. With
+    fail_fast nothing is compared if the catalogs differ and the
+    comparison stops at the first element with failures.
+    """
+    ds_a = a if isinstance(a, nefis.dataset.Nefis) else nefis.dataset.Nefis(a)
+    ds_b = b if isinstance(b, nefis.dataset.Nefis) else nefis.dataset.Nefis(b)
+    results = collections.OrderedDict()
+    try:
+        differences = compare_catalogs(ds_a, ds_b)
+        if differences and fail_fast:
+            return differences, results
+        selection = nefis.subset.select(ds_a, groups=groups, elements=elements)
+        elements_a = nefis.merge.definitions(ds_a)['elements']
+        elements_b = nefis.merge.definitions(ds_b)['elements']
+        groups_b = set(group['name_dat'] for group in ds_b.groups.values())
+        for group, names in selection.items():
+            for name in names:
+                # missing groups and differing definitions are catalog differences
+                if group not in groups_b or elements_a[name] != elements_b.get(name):
+                    continue
+                result = compare_element(
+                    ds_a,
+                    ds_b,
+                    group,
+                    name,
+                    rtol=rtol,
+                    atol=atol,
+                    chunk_size=chunk_size,
+                    fail_fast=fail_fast
+                )
+                results[(group, name)] = result
+                logger.debug("compared %s/%s: %s", group, name, result)
+                if fail_fast and result['failures']:
+                    return differences, results
+    finally:
+        if ds_a is not a:
+            ds_a.close()
+        if ds_b is not b:
+            ds_b.close()
+    return differences, results
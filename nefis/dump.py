@@ -0,0 +1,130 @@
+"""Stream the catalog and data of a nefis file as text
+
+The dumps are generators of text pieces, produced one group (or one read
+block of data) at a time from the cached catalog, so printing a large
+catalog starts immediately and the memory use does not grow with the
+number of groups and elements. Formats:
+
+json
+    one JSON document {"groups": {...}}, the same as Nefis.dump_json
+jsonl
+    JSON lines, one line per group with its cell and variables, and with
+    data one line per read block of a variable
+ncdump
+    text similar to the output of ncdump
+"""
+from __future__ import print_function, unicode_literals, division, absolute_import
+
+import json
+
+import numpy as np
+
+import nefis.dataset
+
+FORMATS = ('json', 'jsonl', 'ncdump')
+
+
+def iter_groups(ds):
+    """iterate over (name, group) with the cell and the variables of the cell filled in"""
+    cells = ds.cells
+    variables = ds.variables
+    for name, group in ds.groups.items():
+        # replace cell name by cell object (on a copy, the catalog is cached)
+        group = dict(group)
+        cell = dict(cells[group["cell"]])
+        cell["variables"] = [variables[variable] for variable in cell["variables"]]
+        group["cell"] = cell
+        yield name, group
+
+
+def encode(obj, indent=None):
+    return json.dumps(obj, cls=nefis.dataset.NefisJSONEncoder, indent=indent)
+
+
+def iter_json(ds):
+    """the catalog as one indented JSON document, group by group"""
+    yield '{\n  "groups": {'
+    separator = '\n'
+    for name, group in iter_groups(ds):
+        text = encode(group, indent=2).replace('\n', '\n    ')
+        yield '%s    %s: %s' % (separator, encode(name), text)
+        separator = ',\n'
+    yield '\n  }\n}\n'
+
+
+def iter_json_lines(ds):
+    """the catalog as JSON lines, one per group"""
+    for name, group in iter_groups(ds):
+        yield encode(group) + '\n'
+
+
+def iter_ncdump(ds):
+    """the catalog as ncdump like text"""
+    yield '\nnefis %s {\nvariables:\n' % (ds.def_file, )
+    for name, group in iter_groups(ds):
+        lines = ['    group: %s' % (name, )]
+        for variable in group['cell']['variables']:
+            shape = tuple(int(size) for size in variable.shape)
+            lines.append('        %s %s%s ;' % (variable.dtype, variable.name, shape))
+            for attr, val in (variable.attributes or {}).items():
+                lines.append('            %s:%s = %r' % (variable.name, attr, val))
+        yield '\n'.join(lines) + '\n'
+
+
+def format_values(values):
+    """comma separated values, character data quoted"""
+    values = np.asarray(values).ravel()
+    if values.dtype.kind == 'S':
+        return ', '.join('"%s"' % (value.decode('latin-1').rstrip(), ) for value in values)
+    # numpy scalars print as short as their precision allows
+    return ', '.join(str(value) for value in values)
+
+
+def iter_data(ds, names, format='jsonl', t=slice(None), chunk_size=None):
+    """the timesteps t of the variables names, one piece of text per read block"""
+    if format == 'ncdump':
+        yield '\ndata:\n'
+    for name in names:
+        variable = ds.variables[name]
+        if format == 'ncdump':
+            yield '\n %s =\n' % (name, )
+        _, _, _, n = ds.time_range(variable.group, t)
+        for offset, block in variable.iter_chunks(t=t, chunk_size=chunk_size):
+            count = block.shape[0]
+            if format == 'ncdump':
+                rows = [format_values(row) for row in block]
+                last = offset + count == n
+                yield '  ' + ',\n  '.join(rows) + (' ;\n' if last else ',\n')
+                continue
+            if block.dtype.kind == 'S':
+                block = np.char.rstrip(block)
+            yield encode(dict(variable=name, group=variable.group, offset=offset, data=block)) + '\n'
+    if format == 'ncdump':
+        yield '}\n'
+
+
+def iter_dump(ds, format='json', data=(), t=slice(None), chunk_size=None):
+    """the catalog in format and, for ncdump and jsonl, the data of the variables data"""
+    if format not in FORMATS:
+        raise ValueError("unknown dump format %s, choose from %s" % (format, FORMATS))
+    if format == 'json':
+        if data:
+            raise ValueError("data can be dumped as jsonl or ncdump, not as json")
+        for text in iter_json(ds):
+            yield text
+        return
+    pieces = iter_json_lines(ds) if format == 'jsonl' else iter_ncdump(ds)
+    for text in pieces:
+        yield text
+    if data:
+        for text in iter_data(ds, data, format=format, t=t, chunk_size=chunk_size):
+            yield text
+    elif format == 'ncdump':
+        yield '}\n'
+
+
+def dump(ds, out, format='json', data=(), t=slice(None), chunk_size=None):
+    """write a dump to the file object out, flushing every piece"""
+    for text in iter_dump(ds, format=format, data=data, t=t, chunk_size=chunk_size):
+        out.write(text)
+        out.flush()
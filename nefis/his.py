@@ -0,0 +1,123 @@
+"""Station and cross-section access for history (trih) files"""
+from __future__ import print_function, unicode_literals, division, absolute_import
+
+import collections
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# elements with the names of the locations
+STATION_NAMES = 'NAMST'
+CROSS_SECTION_NAMES = 'NAMTRA'
+# history elements defined on cross-sections instead of on stations
+CROSS_SECTION_ELEMENTS = ('CTR', 'FLTR', 'ATR', 'DTR', 'SBTR', 'SSTR', 'SBTRC', 'SSTRC')
+
+
+def decode_names(names):
+    """convert an array of fixed width names to a list of stripped strings"""
+    return [name.decode('latin-1').strip() for name in np.asarray(names).ravel()]
+
+
+class HisFile(object):
+    """A view on the stations and cross-sections of a history file
+
+    The station and cross-section names are read and indexed once, so that
+    series can be looked up by name, for example his["ZWL"].station("Hoek
+    van Holland").
+    """
+    def __init__(self, ds, group='his-series'):
+        self.ds = ds
+        self.group = group
+        self.stations = self._index(STATION_NAMES)
+        self.cross_sections = self._index(CROSS_SECTION_NAMES)
+
+    def _index(self, element):
+        """map the names in element to their position"""
+        index = collections.OrderedDict()
+        variable = self.ds.variables.get(element)
+        if variable is None:
+            return index
+        names = self.ds.read(variable.group, element, t=0)
+        for i, name in enumerate(decode_names(names)):
+            # the first of duplicate names wins
+            index.setdefault(name, i)
+        return index
+
+    @property
+    def elements(self):
+        """the elements of the series group"""
+        return list(self.ds.group_cell(self.group)['variables'])
+
+    def __contains__(self, element):
+        return element in self.elements
+
+    def __getitem__(self, element):
+        if element not in self:
+            raise KeyError("no element %s in group %s" % (element, self.group))
+        return HisVariable(self, element)
+
+    def to_columns(self, stations=None, elements=None, t=slice(None), chunk_size=None):
+        """return an ordered dict with the columns (see HisVariable.to_columns) of elements"""
+        if elements is None:
+            elements = [
+                element
+                for element in self.elements
+                if element not in CROSS_SECTION_ELEMENTS
+            ]
+        columns = collections.OrderedDict()
+        for element in elements:
+            columns[element] = self[element].to_columns(
+                stations,
+                t=t,
+                chunk_size=chunk_size
+            )
+        return columns
+
+
+class HisVariable(object):
+    """A history element, with the location (station or cross-section) as last axis"""
+    def __init__(self, his, element):
+        self.his = his
+        self.name = element
+        self.group = his.group
+        if element in CROSS_SECTION_ELEMENTS:
+            self.locations = his.cross_sections
+        else:
+            self.locations = his.stations
+
+    def location_index(self, names=None):
+        """the positions of the named locations (all locations if names is None)"""
+        if names is None:
+            return list(self.locations.values())
+        try:
+            return [self.locations[name] for name in names]
+        except KeyError as e:
+            raise KeyError("no location %s for element %s" % (e, self.name))
+
+    def to_columns(self, names=None, t=slice(None), chunk_size=None):
+        """read the series of the named locations for timesteps t
+
+        The whole selection is read with range getelt calls and gathered in
+        one contiguous array of shape (location, time[, extra...]), so the
+        series of each location is contiguous.
+        """
+        ds = self.his.ds
+        index = self.location_index(names)
+        info = ds.element_info(self.name)
+        _, _, _, n = ds.time_range(self.group, t)
+        extra = info['shape'][:-1]
+        columns = ds.allocate('his', (len(index), n) + extra, info['np_dtype'])
+        for offset, block in ds.iter_chunks(self.group, self.name, t=t, chunk_size=chunk_size):
+            # (time, extra..., location) -> (location, time, extra...)
+            selected = block[..., index]
+            columns[:, offset:offset + block.shape[0]] = np.moveaxis(selected, -1, 0)
+        return columns
+
+    def location(self, name, t=slice(None)):
+        """the series of one location, shape (time[, extra...])"""
+        return self.to_columns([name], t=t)[0]
+
+    station = location
+    cross_section = location
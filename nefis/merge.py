@@ -0,0 +1,167 @@
+"""Concatenate the segments of a restarted run into one nefis file
+
+All segments should have the same element, cell and group definitions.
+The series groups (see nefis.dataset.is_series) are appended segment
+after segment. A restarted run writes the restart time again, timesteps
+that are not later than the last merged time are dropped. For series
+without a time element a first timestep with the same digests as the
+last merged one is dropped. The constant groups (map-const...) are taken
+from the first segment, they should be the same in all segments. Data is
+written in large range putelt calls and the files are only flushed every
+flush_bytes.
+"""
+from __future__ import print_function, unicode_literals, division, absolute_import
+
+import logging
+
+import numpy as np
+
+import nefis.dataset
+import nefis.subset
+
+logger = logging.getLogger(__name__)
+
+# flush the output after this many bytes are written
+FLUSH_BYTES = 1024 * 1024 * 1024
+
+
+def definitions(ds):
+    """the element, cell and group definitions that should match between segments"""
+    elements = {}
+    for name in ds.elements:
+        info = ds.element_info(name)
+        elements[name] = (info['type'], info['single_bytes'], info['dimensions'])
+    cells = dict(
+        (name, tuple(cell['variables']))
+        for name, cell in ds.cells.items()
+    )
+    groups = {}
+    for name, group in ds.groups.items():
+        shape = tuple(int(dim) for dim in group['shape'])
+        groups[name] = (group['name_dat'], group['cell'], shape, tuple(int(i) for i in group['order']))
+    return dict(elements=elements, cells=cells, groups=groups)
+
+
+def check_definitions(first, other):
+    """raise a ValueError if the definitions of two files differ"""
+    expected = definitions(first)
+    found = definitions(other)
+    for kind in ('elements', 'cells', 'groups'):
+        differences = sorted(
+            name
+            for name in set(expected[kind]) | set(found[kind])
+            if expected[kind].get(name) != found[kind].get(name)
+        )
+        if differences:
+            raise ValueError(
+                "%s of %s differ from %s: %s" % (kind, other.def_file, first.def_file, ', '.join(differences))
+            )
+
+
+def times(ds, group):
+    """the time values of a series group, None if it has no time element"""
+    found = nefis.dataset.time_element(ds, group)
+    if found is None:
+        return None
+    return ds.read(found[0], found[1], t=slice(None)).ravel()
+
+
+def repeats(previous, ds, group, names):
+    """the first timestep of ds has the same content as the last one of previous
+
+    Used for series without a time element, the contents are compared by
+    their digests (see Nefis.digest).
+    """
+    return all(
+        ds.digest(group, name, 0) == previous.digest(group, name, -1)
+        for name in names
+    )
+
+
+def check_constant(first, ds, group, names, allow_differing=False):
+    """raise a ValueError if a constant group differs between first and ds
+
+    Only the first segment is copied. With allow_differing, differing
+    contents (a simulation date in map-version) are only a warning.
+    """
+    expected = first.time_range(group, slice(None))[3]
+    found = ds.time_range(group, slice(None))[3]
+    if found != expected:
+        raise ValueError(
+            "group %s has %s cells in %s and %s in %s" % (group, found, ds.def_file, expected, first.def_file)
+        )
+    for name in names:
+        if expected and ds.digest(group, name, t=slice(None)) != first.digest(group, name, t=slice(None)):
+            message = "constant %s/%s of %s differs from %s" % (group, name, ds.def_file, first.def_file)
+            if not allow_differing:
+                raise ValueError(message)
+            logger.warning("%s, using the first", message)
+
+
+def merge(sources, dst, chunk_size=None, flush_bytes=FLUSH_BYTES, overwrite=False,
+          allow_differing_constants=False):
+    """merge the nefis files sources (in time order) into the new file dst
+
+    Constant groups that differ between the segments raise a ValueError,
+    unless allow_differing_constants is set (the first is used).
+    """
+    datasets = [nefis.dataset.Nefis(src) for src in sources]
+    try:
+        first = datasets[0]
+        for ds in datasets[1:]:
+            check_definitions(first, ds)
+        selection = nefis.subset.select(first)
+        series = dict((group, nefis.dataset.is_series(first, group)) for group in selection)
+        # check before anything is written
+        for group, names in selection.items():
+            if not series[group]:
+                for ds in datasets[1:]:
+                    check_constant(first, ds, group, names, allow_differing=allow_differing_constants)
+        out = nefis.subset.create(dst, overwrite=overwrite)
+        try:
+            nefis.subset.copy_definitions(first, out, selection)
+            pending = 0
+            for group, names in selection.items():
+                nefis.subset.copy_attributes(first, out, group)
+                if not series[group]:
+                    for name in names:
+                        nefis.subset.copy_element(first, out, group, name)
+                    continue
+                start = 0
+                last = None
+                previous = None
+                for ds in datasets:
+                    t = slice(None)
+                    values = times(ds, group)
+                    total = ds.time_range(group, slice(None))[3]
+                    if values is not None:
+                        if last is not None:
+                            # drop the restart timesteps that are already merged
+                            t = slice(int(np.searchsorted(values, last, side='right')), None)
+                        if values[t].size:
+                            last = values[t][-1]
+                    elif previous is not None and total and repeats(previous, ds, group, names):
+                        t = slice(1, None)
+                    n = ds.time_range(group, t)[3]
+                    if n:
+                        previous = ds
+                    if n < total:
+                        logger.info("dropping %s overlapping timesteps of %s in %s",
+                                    total - n, group, ds.def_file)
+                    for name in names:
+                        blocks = ds.iter_chunks(group, name, t=t, chunk_size=chunk_size)
+                        for offset, block in nefis.dataset.prefetch(blocks):
+                            out.write_range(group, name, start + offset, block)
+                            pending += block.nbytes
+                            if flush_bytes and pending >= flush_bytes:
+                                out.flush()
+                                pending = 0
+                    start += n
+                logger.debug("merged %s timesteps of %s", start, group)
+            out.flush()
+        finally:
+            out.close()
+    finally:
+        for ds in datasets:
+            ds.close()
+    return selection
@@ -0,0 +1,101 @@
+"""Out-of-core transposition of nefis variables to a point-major layout
+
+Nefis stores a full field per timestep. For series at one location that
+means reading everything. rechunk reads a variable once, block by block,
+and writes a (point, time) copy in the sidecar of the file, so that the
+series of a point is one contiguous read (see Nefis.timeseries).
+"""
+from __future__ import print_function, unicode_literals, division, absolute_import
+
+import logging
+import os
+
+import numpy as np
+
+import nefis.dataset
+
+logger = logging.getLogger(__name__)
+
+# number of points copied at once from the npy to the zarr layout
+POINT_BLOCK = 4096
+
+
+def rechunk_variable(ds, name, format='npy', chunk_size=None):
+    """write the (point, time) copy of variable name in the sidecar, return the index entry"""
+    variable = ds.variables[name]
+    group = variable.group
+    ntimes = ds.time_range(group, slice(None))[3]
+    if name in ds.raw_variables:
+        info = ds.element_info(name)
+        if info['dtype'] is bytes:
+            raise ValueError("character element %s can not be rechunked" % (name, ))
+        shape, dtype = info['shape'], info['np_dtype']
+    else:
+        shape, dtype = variable.numpy_shape, np.dtype(variable.dtype)
+    n_points = int(np.prod(shape))
+
+    sidecar = ds.sidecar
+    if not os.path.isdir(sidecar.path):
+        os.makedirs(sidecar.path)
+    filename = '%s.%s.npy' % (group, name)
+    # pass 1: one sequential read of the file, transposed into a memory map
+    points = np.lib.format.open_memmap(
+        sidecar.file(filename),
+        mode='w+',
+        dtype=dtype,
+        shape=(n_points, ntimes)
+    )
+    for offset, block in nefis.dataset.prefetch(variable.iter_chunks(chunk_size=chunk_size)):
+        points[:, offset:offset + block.shape[0]] = block.reshape(block.shape[0], n_points).T
+    points.flush()
+    logger.debug("rechunked %s/%s", group, name)
+
+    if format == 'zarr':
+        import zarr
+        # pass 2: copy blocks of points, each zarr chunk holds whole series
+        zarr_name = '%s.%s.zarr' % (group, name)
+        array = zarr.open_array(
+            sidecar.file(zarr_name),
+            mode='w',
+            shape=(n_points, ntimes),
+            chunks=(min(POINT_BLOCK, max(n_points, 1)), max(ntimes, 1)),
+            dtype=dtype
+        )
+        for start in range(0, n_points, POINT_BLOCK):
+            array[start:start + POINT_BLOCK] = points[start:start + POINT_BLOCK]
+        del points
+        os.remove(sidecar.file(filename))
+        filename = zarr_name
+    else:
+        del points
+
+    return dict(
+        file=filename,
+        format=format,
+        shape=list(shape),
+        ntimes=ntimes,
+        dtype=str(dtype)
+    )
+
+
+def rechunk(src, variables=None, format='npy', chunk_size=None):
+    """rechunk variables (default all numerical elements of groups with more than one cell)"""
+    ds = src if isinstance(src, nefis.dataset.Nefis) else nefis.dataset.Nefis(src)
+    try:
+        if not variables:
+            variables = [
+                name
+                for name, variable in ds.raw_variables.items()
+                if variable.dtype != 'string' and ds.time_range(variable.group, slice(None))[3] > 1
+            ]
+        sidecar = ds.sidecar
+        for name in variables:
+            variable = ds.variables[name]
+            entry = rechunk_variable(ds, name, format=format, chunk_size=chunk_size)
+            # load after writing, the index could be updated in the mean time
+            index = sidecar.load()
+            index.setdefault('rechunked', {})['%s/%s' % (variable.group, name)] = entry
+            sidecar.save(index)
+    finally:
+        if ds is not src:
+            ds.close()
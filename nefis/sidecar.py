@@ -0,0 +1,107 @@
+"""Sidecar directory with derived layouts and an index next to a nefis file
+
+The sidecar of trim-f34.def is the directory trim-f34.sidecar. Its
+index.json records the size and modification time of the dat file, the
+index is discarded when the dat file changes. Besides the rechunked
+copies the index holds per timestep digests of elements (see digest).
+"""
+from __future__ import print_function, unicode_literals, division, absolute_import
+
+import io
+import json
+import logging
+import os
+import zlib
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+logger = logging.getLogger(__name__)
+
+INDEX = 'index.json'
+# digests are only compared if they are made with the same algorithm
+if xxhash is None:
+    ALGORITHM = 'crc32'
+elif hasattr(xxhash, 'xxh3_64_hexdigest'):
+    ALGORITHM = 'xxh3_64'
+else:
+    ALGORITHM = 'xxh64'
+
+
+def digest(data):
+    """fast non-cryptographic hex digest of a bytes-like object (a contiguous array)
+
+    xxhash is used if it is installed, zlib.crc32 otherwise.
+    """
+    if ALGORITHM == 'crc32':
+        return '%08x' % (zlib.crc32(data) & 0xffffffff, )
+    return getattr(xxhash, ALGORITHM + '_hexdigest')(data)
+
+
+def sidecar_path(def_file):
+    """the sidecar directory of a def file"""
+    return os.path.splitext(def_file)[0] + '.sidecar'
+
+
+class Sidecar(object):
+    """The sidecar directory of a nefis file"""
+    def __init__(self, def_file, dat_file=None):
+        self.def_file = def_file
+        self.dat_file = dat_file or def_file.replace('.def', '.dat')
+        self.path = sidecar_path(def_file)
+
+    def source(self):
+        """the state of the dat file the sidecar is valid for"""
+        stat = os.stat(self.dat_file)
+        return dict(size=stat.st_size, mtime=stat.st_mtime)
+
+    def file(self, name):
+        """path of a file in the sidecar"""
+        return os.path.join(self.path, name)
+
+    def load(self):
+        """return the index, an empty one if it is missing or stale"""
+        source = self.source()
+        try:
+            with io.open(self.file(INDEX), encoding='utf-8') as f:
+                index = json.load(f)
+        except (IOError, OSError, ValueError):
+            return dict(source=source)
+        if index.get('source') != source:
+            logger.info("sidecar %s is stale, ignoring it", self.path)
+            return dict(source=source)
+        return index
+
+    def save(self, index):
+        """write the index (atomically)"""
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        tmp = self.file(INDEX + '.tmp')
+        with io.open(tmp, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(index, indent=2, sort_keys=True))
+        getattr(os, 'replace', os.rename)(tmp, self.file(INDEX))
+
+    def rechunked(self, group, element):
+        """the index entry of the point-major copy of element, None if there is none"""
+        entry = self.load().get('rechunked', {}).get('%s/%s' % (group, element))
+        if entry is None or not os.path.exists(self.file(entry['file'])):
+            return None
+        return entry
+
+    def digests(self, group, element):
+        """the stored per timestep digests of element, None if there are none"""
+        entry = self.load().get('hashes', {}).get('%s/%s' % (group, element))
+        if entry is None or entry['algorithm'] != ALGORITHM:
+            return None
+        return entry['digests']
+
+    def save_digests(self, group, element, digests):
+        """store the per timestep digests of element"""
+        index = self.load()
+        index.setdefault('hashes', {})['%s/%s' % (group, element)] = dict(
+            algorithm=ALGORITHM,
+            digests=list(digests)
+        )
+        self.save(index)
@@ -0,0 +1,149 @@
+"""Counters for the calls to the nefis library
+
+With instrumentation enabled (enable() or the environment variable
+NEFIS_STATS=1) every cnefis call made through wrap_error is counted, per
+function: calls, errors, bytes transferred, cumulative time and a
+latency histogram. The buffers allocated for reads and caches are
+counted per site (see record_allocation): number, bytes and the largest
+buffer. The counts are kept in a global registry and per open file (see
+Nefis.stats and Nefis.allocations). When disabled, the only overhead is
+the check of ENABLED.
+"""
+from __future__ import print_function, unicode_literals, division, absolute_import
+
+import copy
+import os
+import threading
+import time
+
+# upper bounds (seconds) of the latency histogram buckets, the last one is open
+BUCKETS = (1e-6, 1e-5, 1e-4, 1e-3, 1e-2, 1e-1, 1.0, float('inf'))
+
+ENABLED = os.environ.get('NEFIS_STATS', '') not in ('', '0')
+
+clock = getattr(time, 'perf_counter', time.time)
+
+
+def transferred(name, args):
+    """the number of bytes a call of cnefis function name moves"""
+    if name in ('getelt_into', 'putelt'):
+        buffer = args[-1]
+        return getattr(buffer, 'nbytes', None) or len(buffer)
+    if name in ('getelt', 'getels'):
+        # the buffer length
+        return args[-1]
+    return 0
+
+
+class Stats(object):
+    """call counters per function"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._functions = {}
+        self._allocations = {}
+
+    def record(self, name, seconds, nbytes=0, error=False):
+        with self._lock:
+            counters = self._functions.get(name)
+            if counters is None:
+                counters = dict(calls=0, errors=0, bytes=0, seconds=0.0, histogram=[0] * len(BUCKETS))
+                self._functions[name] = counters
+            counters['calls'] += 1
+            counters['errors'] += int(bool(error))
+            counters['bytes'] += nbytes
+            counters['seconds'] += seconds
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    counters['histogram'][i] += 1
+                    break
+
+    def record_allocation(self, site, nbytes):
+        with self._lock:
+            counters = self._allocations.get(site)
+            if counters is None:
+                counters = dict(count=0, bytes=0, peak=0)
+                self._allocations[site] = counters
+            counters['count'] += 1
+            counters['bytes'] += nbytes
+            counters['peak'] = max(counters['peak'], nbytes)
+
+    def snapshot(self):
+        """a copy of the counters, a dict of function name -> counters"""
+        with self._lock:
+            return copy.deepcopy(self._functions)
+
+    def allocations(self):
+        """a copy of the allocation counters, a dict of site -> counters"""
+        with self._lock:
+            return copy.deepcopy(self._allocations)
+
+    def reset(self):
+        with self._lock:
+            self._functions = {}
+            self._allocations = {}
+
+
+# all calls, and the calls per nefis file handle
+GLOBAL = Stats()
+HANDLES = {}
+
+
+def enable():
+    global ENABLED
+    ENABLED = True
+
+
+def disable():
+    global ENABLED
+    ENABLED = False
+
+
+def register(filehandle, stats):
+    """count the calls for filehandle (also) in stats"""
+    HANDLES[filehandle] = stats
+
+
+def unregister(filehandle):
+    HANDLES.pop(filehandle, None)
+
+
+def record(func, args, result, seconds):
+    """record a call of a cnefis function with its arguments and result"""
+    name = func.__name__
+    status = result[0] if isinstance(result, tuple) else result
+    try:
+        nbytes = transferred(name, args)
+    except (TypeError, IndexError):
+        nbytes = 0
+    error = status != 0
+    GLOBAL.record(name, seconds, nbytes, error)
+    # the first argument is the file handle, except for crenef and friends
+    if args and not isinstance(args[0], (str, bytes)):
+        stats = HANDLES.get(args[0])
+        if stats is not None:
+            stats.record(name, seconds, nbytes, error)
+
+
+def record_allocation(site, nbytes, filehandle=None):
+    """record a buffer of nbytes allocated at site (getelt, get_data, cache...) for filehandle"""
+    GLOBAL.record_allocation(site, nbytes)
+    stats = HANDLES.get(filehandle)
+    if stats is not None:
+        stats.record_allocation(site, nbytes)
+
+
+def snapshot():
+    """the global counters"""
+    return GLOBAL.snapshot()
+
+
+def allocations():
+    """the global allocation counters"""
+    return GLOBAL.allocations()
+
+
+def reset():
+    """reset the global and all per file counters"""
+    GLOBAL.reset()
+    for stats in list(HANDLES.values()):
+        stats.reset()
@@ -0,0 +1,138 @@
+"""Copy a selection of groups, elements and timesteps to a new nefis file
+
+The definitions of the selected elements, cells and groups are copied to
+the new file and the data is streamed in blocks: every block is read with
+one range getelt (steps are supported by nefis itself) and written with
+one range putelt, so the whole selection is never in memory.
+"""
+from __future__ import print_function, unicode_literals, division, absolute_import
+
+import collections
+import logging
+import os
+
+import nefis.dataset
+
+logger = logging.getLogger(__name__)
+
+
+def parse_time(value):
+    """parse a time selection like 100:200:2, 100: or 5 into a slice"""
+    if value is None or isinstance(value, slice):
+        return value if value is not None else slice(None)
+    if isinstance(value, int):
+        return slice(value, value + 1)
+    parts = [int(part) if part.strip() else None for part in value.split(':')]
+    if len(parts) == 1:
+        return slice(parts[0], parts[0] + 1)
+    if len(parts) > 3:
+        raise ValueError("time selection %s should be start:stop[:step]" % (value, ))
+    return slice(*parts)
+
+
+def select(ds, groups=None, elements=None):
+    """return an ordered dict of data group -> element names
+
+    By default all elements of all groups, groups can be given by their data
+    or definition name. Groups without any of the elements are left out.
+    """
+    if elements:
+        missing = set(elements) - set(ds.elements)
+        if missing:
+            raise KeyError("elements %s not in %s" % (sorted(missing), ds.def_file))
+    selection = collections.OrderedDict()
+    for name, group in sorted(ds.groups.items()):
+        if groups and name not in groups and group['name_dat'] not in groups:
+            continue
+        names = [
+            element
+            for element in ds.cells[group['cell']]['variables']
+            if not elements or element in elements
+        ]
+        if names:
+            selection[group['name_dat']] = names
+    return selection
+
+
+def copy_definitions(src, dst, selection):
+    """define the selected elements, cells and groups of src in dst and create the data groups"""
+    defined = set()
+    for group, names in selection.items():
+        for name in names:
+            if name in defined:
+                continue
+            info = src.element_info(name)
+            attributes = src.elements[name]['attributes']
+            dst.define_element(
+                name,
+                info['type'],
+                info['single_bytes'],
+                info['dimensions'],
+                quantity=attributes['quantity'],
+                unit=attributes['units'],
+                description=attributes['description']
+            )
+            defined.add(name)
+    cells = {}
+    for group, names in selection.items():
+        record = src.groups[src.group_def(group)]
+        if record['cell'] not in cells:
+            dst.define_cell(record['cell'], names)
+            cells[record['cell']] = names
+        if record['name'] not in defined:
+            dst.define_group(record['name'], record['cell'], record['shape'], record['order'])
+            defined.add(record['name'])
+        dst.create_group(group, record['name'])
+
+
+def copy_attributes(src, dst, group):
+    """copy the attributes of a data group"""
+    for name, value in src.attributes(group).items():
+        dst.put_attribute(group, name, value)
+
+
+def copy_element(src, dst, group, element, t=slice(None), chunk_size=None):
+    """stream timesteps t of an element to dst, return the number of timesteps written"""
+    n = 0
+    blocks = src.iter_chunks(group, element, t=t, chunk_size=chunk_size)
+    for offset, block in nefis.dataset.prefetch(blocks):
+        dst.write_range(group, element, offset, block)
+        n += block.shape[0]
+    return n
+
+
+def create(dst, overwrite=False):
+    """create a new (empty) nefis file dst"""
+    for filename in (dst, dst.replace('.def', '.dat')):
+        if os.path.exists(filename):
+            if not overwrite:
+                raise IOError("%s already exists" % (filename, ))
+            os.remove(filename)
+    return nefis.dataset.Nefis(dst, ac_type=b'c')
+
+
+def subset(src, dst, groups=None, elements=None, time=None, chunk_size=None, overwrite=False):
+    """write the selected groups, elements and timesteps of src to the new file dst
+
+    time (a slice or a string like 100:200:2) selects the timesteps of the
+    series groups (see nefis.dataset.is_series), the other groups are
+    copied whole.
+    """
+    time = parse_time(time)
+    dst_ds = create(dst, overwrite=overwrite)
+    src_ds = src if isinstance(src, nefis.dataset.Nefis) else nefis.dataset.Nefis(src)
+    try:
+        selection = select(src_ds, groups=groups, elements=elements)
+        copy_definitions(src_ds, dst_ds, selection)
+        for group, names in selection.items():
+            t = time if nefis.dataset.is_series(src_ds, group) else slice(None)
+            copy_attributes(src_ds, dst_ds, group)
+            for name in names:
+                n = copy_element(src_ds, dst_ds, group, name, t=t, chunk_size=chunk_size)
+                logger.debug("copied %s timesteps of %s/%s", n, group, name)
+        dst_ds.flush()
+    finally:
+        dst_ds.close()
+        if src_ds is not src:
+            src_ds.close()
+    return selection
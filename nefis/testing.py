@@ -0,0 +1,117 @@
+"""Synthetic trim-like nefis files for tests and benchmarks
+
+make_synthetic writes a file with the map-const, map-info-series,
+map-series, his-const, his-info-series and his-series groups of a
+Delft3D-FLOW trim/trih file, of any size. The data is deterministic: the
+fields are travelling waves, computed per timestep from two precomputed
+fields, and written in blocks with NefisWriter.
+"""
+from __future__ import print_function, unicode_literals, division, absolute_import
+
+import collections
+import logging
+
+import numpy as np
+
+import nefis.writer
+
+logger = logging.getLogger(__name__)
+
+# series elements of the map-series group, with their number of layers
+MAP_ELEMENTS = collections.OrderedDict([
+    ('S1', None),
+    ('U1', 'k'),
+    ('V1', 'k'),
+    ('W', 'k+1')
+])
+DEFAULT_ELEMENTS = ('S1', 'U1', 'V1')
+# the time unit (TUNIT) and timestep (DT) of the output
+TUNIT = 60.0
+DT = 1.0
+
+
+def layers(kind, k):
+    if kind is None:
+        return ()
+    return (k + 1, ) if kind == 'k+1' else (k, )
+
+
+def schema(n, m, k, elements=DEFAULT_ELEMENTS, stations=10):
+    """the NefisWriter schema of a synthetic file"""
+    unknown = set(elements) - set(MAP_ELEMENTS)
+    if unknown:
+        raise ValueError("no synthetic elements %s, choose from %s" % (sorted(unknown), list(MAP_ELEMENTS)))
+    spec = collections.OrderedDict()
+    for name in ('NMAX', 'MMAX', 'KMAX', 'ITDATE', 'NOSTAT'):
+        spec[name] = dict(dtype='int32', shape=(1, ), unit='[ - ]')
+    for name in ('TUNIT', 'DT'):
+        spec[name] = dict(dtype='float32', shape=(1, ), unit='[ - ]')
+    spec['KCS'] = dict(dtype='int32', shape=(m, n), description='Non-active/active water-level point')
+    spec['THICK'] = dict(dtype='float32', shape=(k, ), description='Fraction part of layer thickness')
+    spec['DPS0'] = dict(dtype='float32', shape=(m, n), unit='[ M ]', description='Initial bottom depth')
+    spec['NAMST'] = dict(dtype='S20', shape=(stations, ), description='Name of monitoring station')
+    spec['ITMAPC'] = dict(dtype='int32', shape=(1, ), description='timestep number (ITMAPC*DT*TUNIT := time in sec from ITDATE)')
+    spec['ITHISC'] = dict(dtype='int32', shape=(1, ), description='timestep number (ITHISC*DT*TUNIT := time in sec from ITDATE)')
+    for name in elements:
+        unit = '[ M ]' if name == 'S1' else '[ M/S ]'
+        spec[name] = dict(dtype='float32', shape=layers(MAP_ELEMENTS[name], k) + (m, n), unit=unit)
+    spec['ZWL'] = dict(dtype='float32', shape=(stations, ), unit='[ M ]', description='Water-level in station')
+    spec['ZCURU'] = dict(dtype='float32', shape=(k, stations), unit='[ M/S ]', description='U-velocity in station')
+    spec['ZCURV'] = dict(dtype='float32', shape=(k, stations), unit='[ M/S ]', description='V-velocity in station')
+    groups = collections.OrderedDict([
+        ('map-const', dict(
+            elements=['NMAX', 'MMAX', 'KMAX', 'ITDATE', 'TUNIT', 'DT', 'KCS', 'THICK', 'DPS0'],
+            series=False
+        )),
+        ('map-info-series', ['ITMAPC']),
+        ('map-series', list(elements)),
+        ('his-const', dict(elements=['NOSTAT', 'NAMST'], series=False)),
+        ('his-info-series', ['ITHISC']),
+        ('his-series', ['ZWL', 'ZCURU', 'ZCURV'])
+    ])
+    return dict(elements=spec, groups=groups)
+
+
+def make_synthetic(path, n=100, m=200, k=5, ntimes=10, elements=DEFAULT_ELEMENTS, stations=10,
+                   overwrite=False):
+    """write a synthetic trim-like file of n x m cells, k layers and ntimes timesteps, return path"""
+    stations = min(stations, n * m)
+    with nefis.writer.NefisWriter(path, schema(n, m, k, elements, stations), overwrite=overwrite) as writer:
+        kcs = np.ones((m, n), dtype='int32')
+        kcs[[0, -1], :] = 0
+        kcs[:, [0, -1]] = 0
+        y, x = np.meshgrid(np.linspace(0, 1, m), np.linspace(0, 1, n), indexing='ij')
+        writer.append(0, {
+            'NMAX': [n], 'MMAX': [m], 'KMAX': [k], 'ITDATE': [20000101],
+            'TUNIT': [TUNIT], 'DT': [DT],
+            'KCS': kcs,
+            'THICK': np.full(k, 1.0 / k, dtype='float32'),
+            'DPS0': (10 + 5 * x).astype('float32'),
+            'NOSTAT': [stations],
+            'NAMST': np.array(['Station %d' % i for i in range(stations)], dtype='S20')
+        })
+        # a wave travelling in x: cos(x - wt) = cos(x) cos(wt) + sin(x) sin(wt)
+        phase = 2 * np.pi * (x + 0.5 * y)
+        cos, sin = np.cos(phase).astype('float32'), np.sin(phase).astype('float32')
+        profile = np.linspace(0.5, 1, k + 1).astype('float32')
+        points = np.arange(stations)
+        station_index = (points % m, (points * 7) % n)
+        for t in range(ntimes):
+            wt = 2 * np.pi * t / 12.0
+            s1 = cos * np.float32(np.cos(wt)) + sin * np.float32(np.sin(wt))
+            values = {'ITMAPC': [t], 'ITHISC': [t]}
+            for name in elements:
+                kind = MAP_ELEMENTS[name]
+                if kind is None:
+                    values[name] = s1
+                else:
+                    scale = {'U1': 1.0, 'V1': 0.5, 'W': 0.01}[name]
+                    weights = profile[:layers(kind, k)[0]] * np.float32(scale)
+                    values[name] = weights[:, np.newaxis, np.newaxis] * s1
+            values['ZWL'] = s1[station_index]
+            velocity = profile[:k, np.newaxis] * s1[station_index]
+            values['ZCURU'] = velocity
+            values['ZCURV'] = 0.5 * velocity
+            writer.append(t, values)
+    logger.debug("wrote synthetic file %s (%s x %s x %s, %s timesteps)", path, n, m, k, ntimes)
+    return path
@@ -0,0 +1,60 @@
+"""Export the traced spans of nefis operations as Chrome trace events
+
+The trace can be loaded in chrome://tracing or https://ui.perfetto.dev::
+
+    tracer = ChromeTrace()
+    nefis.dataset.add_hook(tracer)
+    ds = nefis.dataset.Nefis('trim-f34.def')
+    ds.read('map-series', 'S1', t=slice(None))
+    nefis.dataset.remove_hook(tracer)
+    tracer.save('trace.json')
+
+Every span (see nefis.dataset.span) becomes a complete event with its
+attributes as arguments, on the thread it ran in.
+"""
+from __future__ import print_function, unicode_literals, division, absolute_import
+
+import json
+import os
+import threading
+
+import nefis.stats
+
+
+class ChromeTrace(object):
+    """a tracing hook that collects Chrome trace events"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._start = nefis.stats.clock()
+        self.pid = os.getpid()
+        self.events = []
+
+    def _now(self):
+        """microseconds since the trace started"""
+        return (nefis.stats.clock() - self._start) * 1e6
+
+    def start(self, name, attributes):
+        return self._now()
+
+    def end(self, name, attributes, token):
+        event = dict(
+            name=name,
+            cat='nefis',
+            ph='X',
+            ts=token,
+            dur=self._now() - token,
+            pid=self.pid,
+            tid=threading.current_thread().ident,
+            args=dict((key, value) for key, value in attributes.items() if value is not None)
+        )
+        with self._lock:
+            self.events.append(event)
+
+    def trace(self):
+        """the trace as a JSON serializable dict"""
+        with self._lock:
+            return dict(traceEvents=list(self.events), displayTimeUnit='ms')
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.trace(), f, default=str)
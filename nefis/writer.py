@@ -0,0 +1,201 @@
+"""Buffered writing of nefis files from numpy arrays
+
+The writer defines the elements, cells and groups of a schema and
+collects appended timesteps in memory. Buffered timesteps are written
+with one range putelt per element::
+
+    schema = dict(
+        elements=dict(
+            KCS=dict(dtype='int32', shape=(m, n)),
+            S1=dict(dtype='float32', shape=(m, n), unit='[ M ]')
+        ),
+        groups={
+            'map-const': dict(elements=['KCS'], series=False),
+            'map-series': ['S1']
+        }
+    )
+    with NefisWriter('out.def', schema) as writer:
+        writer.append(0, {'KCS': kcs})
+        for t, s1 in enumerate(fields):
+            writer.append(t, {'S1': s1})
+
+Shapes are in numpy (C) order, the reverse of the nefis dimensions.
+Groups are series (a variable time dimension) unless series=False, a
+fixed group has size cells (default 1).
+"""
+from __future__ import print_function, unicode_literals, division, absolute_import
+
+import collections
+import logging
+import time
+
+import numpy as np
+
+import nefis.dataset
+import nefis.subset
+
+logger = logging.getLogger(__name__)
+
+# default memory for the buffered timesteps of a group
+BUFFER_BYTES = 16 * 1024 * 1024
+
+
+def element_type(dtype):
+    """return the nefis (type, single bytes) of a numpy dtype"""
+    dtype = np.dtype(dtype)
+    if dtype == np.float32:
+        return 'REAL', 4
+    if dtype == np.int32:
+        return 'INTEGER', 4
+    if dtype.kind == 'S':
+        return 'CHARACTE', dtype.itemsize
+    raise ValueError("nefis elements can not be of type %s" % (dtype, ))
+
+
+class GroupBuffer(object):
+    """consecutive timesteps of the elements of a group, waiting to be written"""
+    def __init__(self, group, elements, size):
+        self.group = group
+        self.size = size
+        self.arrays = collections.OrderedDict(
+            (name, np.zeros((size, ) + tuple(spec['shape']), dtype=spec['dtype']))
+            for name, spec in elements.items()
+        )
+        self.start = 0
+        self.count = 0
+        # only the elements that got values are written
+        self.names = set()
+
+    def accepts(self, t):
+        """t is the last buffered timestep or the next one that fits"""
+        slot = t - self.start
+        return self.count == 0 or 0 <= slot <= self.count and slot < self.size
+
+    def put(self, t, values):
+        if self.count == 0:
+            self.start = t
+        slot = t - self.start
+        for name, value in values.items():
+            self.arrays[name][slot] = value
+            self.names.add(name)
+        self.count = max(self.count, slot + 1)
+
+    def clear(self):
+        for array in self.arrays.values():
+            array.fill(0)
+        self.count = 0
+        self.names = set()
+
+
+class NefisWriter(object):
+    """Write a new nefis file from numpy arrays, see the module documentation"""
+    def __init__(self, def_file, schema, buffer_size=None, flush_interval=None, overwrite=False):
+        """buffer_size is the number of timesteps buffered per group (default
+        BUFFER_BYTES worth), the files are flushed after writing if
+        flush_interval seconds have passed (default only on close)"""
+        self.ds = nefis.subset.create(def_file, overwrite=overwrite)
+        self.flush_interval = flush_interval
+        self._flushed = time.time()
+        elements = collections.OrderedDict()
+        for name, spec in schema['elements'].items():
+            spec = dict(spec)
+            spec['dtype'] = np.dtype(spec.get('dtype', 'float32'))
+            spec['shape'] = tuple(spec.get('shape', (1, )))
+            elements[name] = spec
+        self.elements = elements
+        self.groups = collections.OrderedDict()
+        for group, spec in schema['groups'].items():
+            if not isinstance(spec, dict):
+                spec = dict(elements=spec)
+            self.groups[group] = dict(
+                elements=list(spec['elements']),
+                series=spec.get('series', True),
+                size=spec.get('size', 1)
+            )
+        # every element is written to one group
+        self._group_of = {}
+        for group, spec in self.groups.items():
+            for name in spec['elements']:
+                self._group_of[name] = group
+        self._define()
+        self._buffers = {}
+        for group, spec in self.groups.items():
+            group_elements = collections.OrderedDict(
+                (name, elements[name]) for name in spec['elements']
+            )
+            size = buffer_size
+            if size is None:
+                nbytes = sum(
+                    element['dtype'].itemsize * int(np.prod(element['shape']))
+                    for element in group_elements.values()
+                )
+                size = max(1, BUFFER_BYTES // max(nbytes, 1))
+            if not spec['series']:
+                size = min(size, spec['size'])
+            self._buffers[group] = GroupBuffer(group, group_elements, size)
+
+    def _define(self):
+        for name, spec in self.elements.items():
+            type, single_bytes = element_type(spec['dtype'])
+            self.ds.define_element(
+                name,
+                type,
+                single_bytes,
+                spec['shape'][::-1],
+                quantity=spec.get('quantity', name.lower()),
+                unit=spec.get('unit', '[ - ]'),
+                description=spec.get('description', name)
+            )
+        for group, spec in self.groups.items():
+            self.ds.define_cell(group, spec['elements'])
+            size = 0 if spec['series'] else spec['size']
+            self.ds.define_group(group, group, dimensions=(size, ))
+            self.ds.create_group(group)
+
+    def append(self, t, values):
+        """buffer the arrays in values (element name -> array) as timestep t
+
+        Timesteps of a group are written in blocks of consecutive timesteps,
+        appending a timestep that does not follow the buffered ones writes
+        the buffer first.
+        """
+        by_group = collections.defaultdict(dict)
+        for name, value in values.items():
+            if name not in self._group_of:
+                raise KeyError("element %s is not in the schema" % (name, ))
+            by_group[self._group_of[name]][name] = value
+        for group, group_values in by_group.items():
+            buffer = self._buffers[group]
+            if not buffer.accepts(t):
+                self._write(buffer)
+            buffer.put(t, group_values)
+        if self.flush_interval is not None and time.time() - self._flushed >= self.flush_interval:
+            self.flush()
+
+    def _write(self, buffer):
+        """write the buffered timesteps, one putelt per element"""
+        if buffer.count == 0:
+            return
+        for name, array in buffer.arrays.items():
+            if name not in buffer.names:
+                continue
+            self.ds.write_range(buffer.group, name, buffer.start, array[:buffer.count])
+        logger.debug("wrote %s timesteps of %s from %s", buffer.count, buffer.group, buffer.start)
+        buffer.clear()
+
+    def flush(self):
+        """write all buffers and flush the files"""
+        for buffer in self._buffers.values():
+            self._write(buffer)
+        self.ds.flush()
+        self._flushed = time.time()
+
+    def close(self):
+        self.flush()
+        self.ds.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
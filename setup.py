@@ -19,6 +19,8 @@ with open('requirements.txt') as requirements_file:
     requirements = requirements_file.readlines()
     if sys.version_info < (3, 3):
         requirements.append('faulthandler')
+    if sys.version_info < (3, 2):
+        requirements.append('futures')
 
 with open('requirements_dev.txt') as requirements_dev_file:
     test_requirements = requirements_dev_file.readlines()
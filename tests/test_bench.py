@@ -0,0 +1,39 @@
+import logging
+
+import numpy as np
+
+import nefis.bench
+
+logger = logging.getLogger(__name__)
+
+
+def test_summarize():
+    summary = nefis.bench.summarize(np.arange(1, 101) / 1000.0, nbytes=1000)
+    assert summary['n'] == 100
+    assert abs(summary['p50'] - 0.0505) < 1e-9
+    assert summary['p99'] > summary['p90'] > summary['p50']
+    assert summary['bytes_per_second'] == 1000 / summary['p50']
+
+
+def test_mann_whitney():
+    rng = np.random.RandomState(0)
+    baseline = rng.normal(1.0, 0.01, size=30)
+    assert nefis.bench.mann_whitney(baseline, baseline + 0.1) < 0.001
+    assert nefis.bench.mann_whitney(baseline, baseline - 0.1) > 0.99
+    # ties
+    assert 0.3 < nefis.bench.mann_whitney([1.0] * 10, [1.0] * 10) <= 1
+
+
+def test_compare():
+    rng = np.random.RandomState(1)
+
+    def result(durations):
+        summary = nefis.bench.summarize(durations)
+        summary['durations'] = list(durations)
+        return dict(operations=dict(read=summary))
+    baseline = result(rng.normal(1.0, 0.01, size=20))
+    assert not nefis.bench.compare(baseline, baseline)['read']['slower']
+    slower = result(rng.normal(1.2, 0.01, size=20))
+    comparison = nefis.bench.compare(baseline, slower)['read']
+    assert comparison['slower']
+    assert comparison['ratio'] > 1.1
@@ -0,0 +1,45 @@
+import logging
+import os
+import shutil
+
+import nefis.catalog
+import nefis.testing
+from .utils import TESTDIR
+
+logger = logging.getLogger(__name__)
+
+
+def test_catalog(tmpdir):
+    root = tmpdir.mkdir('archive')
+    for run in ('a', 'b'):
+        directory = root.mkdir(run)
+        for extension in ('.def', '.dat'):
+            shutil.copy(os.path.join(TESTDIR, 'data/trim-f34' + extension), str(directory))
+    db = str(tmpdir.join('catalog.sqlite'))
+    counts = nefis.catalog.build(str(root), db, workers=1)
+    assert counts['scanned'] == 2
+    assert counts['failed'] == 0
+    rows = nefis.catalog.query(db, element='S1')
+    assert [row['group'] for row in rows] == ['map-series', 'map-series']
+    assert rows[0]['n'] > 0
+    assert nefis.catalog.query(db, element='S1', date='1800-01-01') == []
+    assert len(nefis.catalog.query(db, element='S1', date=rows[0]['start'])) == 2
+
+    # unchanged files are skipped, removed files deleted
+    root.join('b').remove()
+    counts = nefis.catalog.build(str(root), db, workers=1)
+    assert counts == dict(scanned=0, skipped=1, removed=1, failed=0)
+    assert len(nefis.catalog.query(db, element='S1')) == 1
+
+
+def test_scan_series(tmpdir):
+    def_file = nefis.testing.make_synthetic(str(tmpdir.join('trim-synthetic.def')), n=6, m=8, k=2, ntimes=3)
+    rows = nefis.catalog.scan(def_file)
+    series = dict((row[0], row[4]) for row in rows['groups'])
+    # the constant groups have a fixed size of one cell (series=False in the writer) and no time element
+    assert series['map-const'] == 0
+    assert series['his-const'] == 0
+    assert series['map-series'] == 1
+    assert series['his-series'] == 1
+    assert sorted(row[0] for row in rows['times']) == ['his-info-series', 'his-series', 'map-info-series', 'map-series']
+    assert all(row[1] == 3 for row in rows['times'])
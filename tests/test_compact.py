@@ -0,0 +1,39 @@
+import logging
+
+import numpy as np
+
+import nefis.dataset
+from .utils import f34_dataset
+
+f34_dataset = f34_dataset
+
+logger = logging.getLogger(__name__)
+
+
+def test_active_cells_roundtrip():
+    mask = np.array([[1, 0, 1], [0, 1, 1]])
+    cells = nefis.dataset.ActiveCells(mask)
+    assert cells.n_active == 4
+    data = np.arange(2 * 5 * 2 * 3, dtype='float32').reshape(2, 5, 2, 3)
+    compacted = cells.compact(data, time=True)
+    assert compacted.shape == (2, 4, 5), "expected (time, n_active, k)"
+    expanded = cells.expand(compacted, time=True)
+    assert np.all(expanded[..., mask != 0] == data[..., mask != 0])
+    assert np.all(np.isnan(expanded[..., mask == 0]))
+
+
+def test_get_data_compact(f34_dataset):
+    kcs = f34_dataset.get_data('map-const', 'KCS')
+    full = f34_dataset.get_data('map-series', 'S1', t=slice(None))
+    compacted = f34_dataset.get_data('map-series', 'S1', t=slice(None), compact=True)
+    assert compacted.shape == (full.shape[0], np.sum(kcs != 0))
+    assert np.all(compacted == full[:, kcs != 0])
+
+
+def test_variable_read_compact(f34_dataset):
+    u1 = f34_dataset.variables['U1']
+    compacted = u1.read(0, compact=True)
+    cells = f34_dataset.active_cells()
+    assert compacted.shape[0] == cells.n_active
+    full = cells.expand(compacted)
+    assert full.shape == f34_dataset.get_data('map-series', 'U1').shape
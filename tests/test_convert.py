@@ -0,0 +1,87 @@
+import logging
+import os
+
+import netCDF4
+import numpy as np
+import pytest
+
+import nefis.convert
+import nefis.dataset
+import nefis.testing
+from .utils import f34_dataset, TESTDIR
+
+f34_dataset = f34_dataset
+
+logger = logging.getLogger(__name__)
+
+
+def test_nefis2nc(f34_dataset, tmpdir):
+    dest = str(tmpdir.join('trim-f34.nc'))
+    src = os.path.join(TESTDIR, 'data/trim-f34.def')
+    nefis.convert.nefis2nc(src, dest, groups=['map-series', 'map-const'], chunk_size=1, chunk_time=2)
+    s1 = f34_dataset.get_data('map-series', 'S1', t=slice(None))
+    with netCDF4.Dataset(dest) as ds:
+        assert ds['map-series']['S1'].dimensions == ('time', 'M', 'N')
+        assert np.all(ds['map-series']['S1'][:] == s1)
+        assert 'SIMDAT' in ds['map-const'].variables
+
+
+def test_nefis2nc_variables(tmpdir):
+    dest = str(tmpdir.join('trim-f34.nc'))
+    src = os.path.join(TESTDIR, 'data/trim-f34.def')
+    nefis.convert.nefis2nc(src, dest, variables=['U1', 'VELOCITY_MAGNITUDE'], parallel=False)
+    with netCDF4.Dataset(dest) as ds:
+        assert set(ds['map-series'].variables) == {'U1', 'VELOCITY_MAGNITUDE'}
+
+
+def test_to_zarr(f34_dataset, tmpdir):
+    zarr = pytest.importorskip('zarr')
+    dest = str(tmpdir.join('trim-f34.zarr'))
+    f34_dataset.to_zarr(dest, chunks=1, groups=['map-series'])
+    s1 = f34_dataset.get_data('map-series', 'S1', t=slice(None))
+    root = zarr.open_group(dest, mode='r')
+    assert root['map-series/S1'].chunks[0] == 1
+    assert np.all(root['map-series/S1'][:] == s1)
+
+
+def test_to_zarr_resume(f34_dataset, tmpdir):
+    zarr = pytest.importorskip('zarr')
+    dest = str(tmpdir.join('trim-f34.zarr'))
+    f34_dataset.to_zarr(dest, chunks=1, variables=['S1'])
+    array = zarr.open_group(dest, mode='r')['map-series/S1']
+    assert nefis.convert.zarr_chunk_written(array, 0)
+    # a second run only checks the store
+    f34_dataset.to_zarr(dest, chunks=1, variables=['S1'])
+
+
+def test_to_arrow(f34_dataset):
+    pytest.importorskip('pyarrow')
+    table = f34_dataset.to_arrow('map-info-series')
+    ntimes = f34_dataset.groups['map-info-series']['group_size']
+    assert table.num_rows == ntimes
+    assert table.column_names == ['time', 'location', 'ITMAPC']
+
+
+def test_nefis2parquet(tmpdir):
+    pq = pytest.importorskip('pyarrow.parquet')
+    dest = str(tmpdir.join('trim-f34.parquet'))
+    src = os.path.join(TESTDIR, 'data/trim-f34.def')
+    nefis.convert.nefis2parquet(src, dest, group='map-info-series', chunk_size=1)
+    parquet_file = pq.ParquetFile(dest)
+    assert parquet_file.metadata.num_row_groups == parquet_file.metadata.num_rows
+
+
+def test_dimension_names(tmpdir):
+    # 5 stations and 5 layers, the station dimension should not be named K
+    def_file = nefis.testing.make_synthetic(str(tmpdir.join('names.def')), n=6, m=8, k=5, ntimes=1, stations=5)
+    ds = nefis.dataset.Nefis(def_file)
+    try:
+        names = nefis.convert.dimension_names(ds)
+        # fortran order
+        assert names(ds.element_info('U1')['dimensions']) == ('N', 'M', 'K')
+        assert names(ds.element_info('S1')['dimensions']) == ('N', 'M')
+        assert names(ds.element_info('NAMST')['dimensions']) == ('dim_5', )
+        assert names(ds.element_info('ZCURU')['dimensions']) == ('dim_5', 'dim_5')
+        assert names((7, )) == ('dim_7', )
+    finally:
+        ds.close()
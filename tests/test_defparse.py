@@ -0,0 +1,40 @@
+import logging
+import os
+
+import numpy as np
+
+import nefis.defparse
+from .utils import TESTDIR, f34_dataset
+
+f34_dataset = f34_dataset
+
+logger = logging.getLogger(__name__)
+
+
+def plain(record):
+    """a record with lists instead of arrays"""
+    return dict(
+        (key, value.tolist() if isinstance(value, np.ndarray) else value)
+        for key, value in record.items()
+    )
+
+
+def test_defparse(f34_dataset):
+    ds = f34_dataset
+    definitions = nefis.defparse.parse(os.path.join(TESTDIR, 'data/trim-f34.def'))
+    assert definitions.coding == 'N'
+    for kind in ('elements', 'cells'):
+        expected = getattr(ds, kind)
+        found = getattr(definitions, kind)
+        assert set(found) == set(expected)
+        for name in expected:
+            assert plain(found[name]) == plain(expected[name])
+    for name, group in ds.groups.items():
+        group = dict((key, value) for key, value in group.items() if key not in ('name_dat', 'group_size'))
+        assert plain(definitions.groups[name]) == plain(group)
+    variables = definitions.variables
+    for name, variable in ds.raw_variables.items():
+        flat = variable.flat()
+        flat['group'] = variable.group
+        assert plain(variables[name]) == plain(flat)
+        assert definitions.element_info(name) == ds.element_info(name)
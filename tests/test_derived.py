@@ -0,0 +1,121 @@
+import logging
+
+import numpy as np
+
+import nefis.dataset
+import nefis.derived
+import nefis.testing
+import nefis.writer
+from .utils import f34_dataset
+
+f34_dataset = f34_dataset
+
+logger = logging.getLogger(__name__)
+
+
+def test_derived_in_variables(f34_dataset):
+    variables = f34_dataset.variables
+    assert 'VELOCITY_MAGNITUDE' in variables
+    assert isinstance(variables['VELOCITY_MAGNITUDE'], nefis.derived.DerivedVariable)
+    assert variables['VELOCITY_MAGNITUDE'].shape == variables['U1'].shape
+
+
+def test_velocity_magnitude(f34_dataset):
+    u = f34_dataset.read('map-series', 'U1', t=slice(None))
+    v = f34_dataset.read('map-series', 'V1', t=slice(None))
+    magnitude = f34_dataset.variables['VELOCITY_MAGNITUDE'].read(slice(None), chunk_size=1)
+    assert np.allclose(magnitude, np.hypot(u, v))
+
+
+def test_depth_averaged(f34_dataset):
+    u = f34_dataset.read('map-series', 'U1', t=0)
+    thick = f34_dataset.read('map-const', 'THICK', t=0)
+    averaged = f34_dataset.variables['U1_DEPTH_AVERAGED'].read(0)
+    assert np.allclose(averaged, np.tensordot(u, thick, axes=([0], [0])) / thick.sum())
+
+
+def test_evaluate_shared_inputs(f34_dataset):
+    names = ['VELOCITY_MAGNITUDE', 'VELOCITY_MAGNITUDE_DEPTH_AVERAGED']
+    for offset, values in f34_dataset.evaluate(names, chunk_size=2):
+        assert list(values.keys()) == names
+        assert values['VELOCITY_MAGNITUDE'].shape[0] == values['VELOCITY_MAGNITUDE_DEPTH_AVERAGED'].shape[0]
+
+
+def test_register_derived(f34_dataset):
+    variable = f34_dataset.register_derived('S1_SQUARED', ['S1'], lambda s1: s1 ** 2)
+    s1 = f34_dataset.read('map-series', 'S1', t=0)
+    assert np.allclose(variable.read(0), s1 ** 2)
+
+
+def test_single_timestep(tmpdir):
+    # a series with one timestep is not constant
+    def_file = nefis.testing.make_synthetic(str(tmpdir.join('single.def')), n=6, m=8, k=2, ntimes=1)
+    ds = nefis.dataset.Nefis(def_file)
+    try:
+        assert not nefis.derived.is_constant(ds, 'map-series')
+        assert nefis.derived.is_constant(ds, 'map-const')
+        variable = ds.variables['U1_DEPTH_AVERAGED']
+        assert variable.numpy_shape == (8, 6)
+        u = ds.read('map-series', 'U1', t=slice(None))
+        thick = ds.read('map-const', 'THICK')
+        expected = np.tensordot(u, thick, axes=([1], [0])) / thick.sum()
+        assert np.allclose(variable.read(slice(None)), expected)
+        # the read options of Nefis.read
+        compact = variable.read(0, compact=True)
+        assert np.allclose(compact, ds.active_cells().compact(expected[0]))
+        packed = variable.read(0, dtype='int16', scale=0.001)
+        assert np.all(packed == np.rint(expected[0] / 0.001).astype('int16'))
+    finally:
+        ds.close()
+
+
+def test_series_without_time_element(tmpdir):
+    def_file = str(tmpdir.join('written.def'))
+    schema = dict(
+        elements=dict(
+            DPS0=dict(dtype='float32', shape=(3, 4)),
+            S1=dict(dtype='float32', shape=(3, 4))
+        ),
+        # as in Delft3D files map-const also has a variable dimension
+        groups={'map-const': ['DPS0'], 'map-series': ['S1']}
+    )
+    dps = np.full((3, 4), 10, dtype='float32')
+    fields = np.arange(3 * 3 * 4, dtype='float32').reshape(3, 3, 4)
+    with nefis.writer.NefisWriter(def_file, schema) as writer:
+        writer.append(0, {'DPS0': dps})
+        for t, field in enumerate(fields):
+            writer.append(t, {'S1': field})
+    ds = nefis.dataset.Nefis(def_file)
+    try:
+        assert nefis.dataset.time_element(ds, 'map-series') is None
+        assert nefis.dataset.is_series(ds, 'map-series')
+        assert not nefis.dataset.is_series(ds, 'map-const')
+        depth = ds.variables['WATER_DEPTH'].read(slice(None))
+        assert np.all(depth == fields + dps)
+    finally:
+        ds.close()
+
+
+def test_lazy_infer_and_budget(tmpdir):
+    def_file = nefis.testing.make_synthetic(str(tmpdir.join('lazy.def')), n=6, m=8, k=2, ntimes=4)
+    ds = nefis.dataset.Nefis(def_file)
+    try:
+        calls = []
+
+        def kernel(s1):
+            calls.append(s1.shape)
+            return 2 * s1
+        ds.register_derived('S1_TWICE', ['S1'], kernel)
+        # listing the variables does not evaluate any kernel
+        assert 'S1_TWICE' in ds.variables
+        assert calls == []
+        variable = ds.variables['S1_TWICE']
+        assert variable.group == 'map-series'
+        assert variable.numpy_shape == (8, 6)
+        assert calls == [(1, 8, 6)]
+        # the plan follows the memory budget, one S1 field per block
+        ds.memory_budget = 8 * 6 * 4
+        assert [count for _, _, count, _ in variable.read_plan()] == [1, 1, 1, 1]
+    finally:
+        ds.memory_budget = None
+        ds.close()
@@ -0,0 +1,53 @@
+import logging
+
+import numpy as np
+
+import nefis.dataset
+import nefis.diff
+import nefis.subset
+import nefis.testing
+from .utils import f34_copy
+
+f34_copy = f34_copy
+
+logger = logging.getLogger(__name__)
+
+
+def test_compare_block():
+    a = np.array([[1.0, 2.0], [np.nan, 4.0]], dtype='float32')
+    b = np.array([[1.0, 2.5], [np.nan, 4.0]], dtype='float32')
+    error, relative, failed = nefis.diff.compare_block(a, b, atol=0.1)
+    assert failed.sum() == 1
+    assert error[0, 1] == 0.5
+    assert relative[0, 1] == 0.2
+
+
+def test_diff_identical(f34_copy):
+    differences, results = nefis.diff.diff(f34_copy, f34_copy)
+    assert differences == []
+    assert results
+    assert all(result['failures'] == 0 for result in results.values())
+
+
+def test_diff_catalog(f34_copy, tmpdir):
+    part = str(tmpdir.join('part.def'))
+    nefis.subset.subset(f34_copy, part, elements=['S1'], time='0:2')
+    differences, results = nefis.diff.diff(f34_copy, part)
+    assert differences
+    assert not results
+    differences, results = nefis.diff.diff(f34_copy, part, fail_fast=False)
+    assert results[('map-series', 'S1')]['failures'] == 0
+
+
+def test_diff_report_differing_definitions(tmpdir):
+    a = nefis.testing.make_synthetic(str(tmpdir.join('a.def')), n=6, m=8, k=2, ntimes=2)
+    # other grid and no his groups
+    b = str(tmpdir.join('b.def'))
+    nefis.testing.make_synthetic(str(tmpdir.join('other.def')), n=5, m=8, k=2, ntimes=2)
+    nefis.subset.subset(str(tmpdir.join('other.def')), b, groups=['map-const', 'map-info-series', 'map-series'])
+    differences, results = nefis.diff.diff(a, b, fail_fast=False)
+    assert any('S1' in difference for difference in differences)
+    # the report goes on, only the comparable elements are compared
+    assert ('map-info-series', 'ITMAPC') in results
+    assert ('map-series', 'S1') not in results
+    assert not any(group.startswith('his') for group, name in results)
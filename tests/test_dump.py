@@ -0,0 +1,39 @@
+import io
+import json
+import logging
+
+import nefis.dump
+from .utils import f34_dataset
+
+f34_dataset = f34_dataset
+
+logger = logging.getLogger(__name__)
+
+
+def test_dump_json(f34_dataset):
+    ds = f34_dataset
+    dump = json.loads(ds.dump_json())
+    assert set(dump['groups']) == set(ds.groups)
+    variables = dump['groups']['map-series']['cell']['variables']
+    assert 'S1' in [variable['name'] for variable in variables]
+
+
+def test_dump_json_lines(f34_dataset):
+    ds = f34_dataset
+    out = io.StringIO()
+    nefis.dump.dump(ds, out, format='jsonl', data=['S1'], chunk_size=2)
+    records = [json.loads(line) for line in out.getvalue().splitlines()]
+    groups = [record for record in records if 'cell' in record]
+    assert len(groups) == len(ds.groups)
+    blocks = [record for record in records if record.get('variable') == 'S1']
+    assert [block['offset'] for block in blocks][:2] == [0, 2]
+    s1 = ds.read('map-series', 'S1', t=slice(0, 2))
+    assert blocks[0]['data'] == s1.tolist()
+
+
+def test_dump_ncdump(f34_dataset):
+    ds = f34_dataset
+    text = ''.join(nefis.dump.iter_dump(ds, format='ncdump', data=['S1'], t=slice(0, 1)))
+    assert 'group: map-series' in text
+    assert '\n S1 =\n' in text
+    assert text.rstrip().endswith('}')
@@ -0,0 +1,62 @@
+import logging
+import multiprocessing
+import time
+
+import numpy as np
+
+import nefis.dataset
+import nefis.writer
+from .utils import f34_dataset
+
+f34_dataset = f34_dataset
+
+logger = logging.getLogger(__name__)
+
+
+def test_follow_finished_file(f34_dataset):
+    ds = f34_dataset
+    ntimes = ds.time_range('map-series', slice(None))[3]
+    steps = list(ds.follow('map-series', poll=0.01, timeout=0))
+    assert [t for t, cell in steps] == list(range(ntimes))
+    t, cell = steps[-1]
+    assert np.all(cell['S1'] == ds.read('map-series', 'S1', t=t))
+
+
+SCHEMA = dict(
+    elements=dict(S1=dict(dtype='float32', shape=(3, 4))),
+    groups={'map-series': ['S1']}
+)
+FIELDS = np.arange(6 * 3 * 4, dtype='float32').reshape(6, 3, 4)
+
+
+def write_fields(def_file, started):
+    """write FIELDS timestep by timestep, flushing every one, from another process"""
+    writer = nefis.writer.NefisWriter(def_file, SCHEMA, buffer_size=1)
+    for t, field in enumerate(FIELDS):
+        writer.append(t, {'S1': field})
+        writer.flush()
+        if t == 0:
+            started.set()
+        time.sleep(0.05)
+    writer.close()
+
+
+def test_follow_growing_file(tmpdir):
+    def_file = str(tmpdir.join('growing.def'))
+    started = multiprocessing.Event()
+    process = multiprocessing.Process(target=write_fields, args=(def_file, started))
+    process.start()
+    try:
+        assert started.wait(10)
+        ds = nefis.dataset.Nefis(def_file)
+        try:
+            steps = list(ds.follow('map-series', poll=0.01, timeout=1))
+        finally:
+            ds.close()
+    finally:
+        process.join(10)
+    assert process.exitcode == 0
+    # every cell once, in order
+    assert [t for t, cell in steps] == list(range(len(FIELDS)))
+    for t, cell in steps:
+        assert np.all(cell['S1'] == FIELDS[t])
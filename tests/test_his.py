@@ -0,0 +1,54 @@
+import logging
+
+import numpy as np
+
+import nefis.dataset
+import nefis.his
+import nefis.testing
+from .utils import f34_dataset
+
+f34_dataset = f34_dataset
+
+logger = logging.getLogger(__name__)
+
+
+def test_decode_names():
+    names = np.array([b'Hoek van Holland    ', b'IJmuiden            '])
+    assert nefis.his.decode_names(names) == ['Hoek van Holland', 'IJmuiden']
+
+
+def test_station_index(f34_dataset):
+    nostat = f34_dataset.get_data('map-const', 'NOSTAT')
+    stations = f34_dataset.his.stations
+    assert len(stations) <= int(nostat[0])
+    for name, i in stations.items():
+        assert 0 <= i < int(nostat[0])
+
+
+def test_his_columns(tmpdir):
+    def_file = nefis.testing.make_synthetic(str(tmpdir.join('his.def')), n=6, m=8, k=2, ntimes=5, stations=4)
+    ds = nefis.dataset.Nefis(def_file)
+    try:
+        zwl = ds.read('his-series', 'ZWL', t=slice(None))
+        zcuru = ds.read('his-series', 'ZCURU', t=slice(None))
+        assert zwl.shape == (5, 4)
+        assert zcuru.shape == (5, 2, 4)
+        his = ds.his
+        assert list(his.stations) == ['Station %d' % i for i in range(4)]
+        # (location, time[, extra...])
+        columns = his['ZWL'].to_columns(['Station 2', 'Station 0'])
+        assert columns.shape == (2, 5)
+        assert np.all(columns[0] == zwl[:, 2])
+        assert np.all(columns[1] == zwl[:, 0])
+        columns = his['ZCURU'].to_columns(t=slice(1, None, 2), chunk_size=1)
+        assert columns.shape == (4, 2, 2)
+        assert np.all(columns == np.moveaxis(zcuru[1::2], -1, 0))
+        station = his['ZCURU'].station('Station 3')
+        assert station.shape == (5, 2)
+        assert np.all(station == zcuru[..., 3])
+        all_columns = his.to_columns(['Station 1'])
+        assert list(all_columns) == ['ZWL', 'ZCURU', 'ZCURV']
+        assert np.all(all_columns['ZWL'][0] == zwl[:, 1])
+        assert np.allclose(all_columns['ZCURV'][0], 0.5 * zcuru[..., 1])
+    finally:
+        ds.close()
@@ -0,0 +1,37 @@
+import logging
+import os
+import subprocess
+import sys
+import timeit
+
+logger = logging.getLogger(__name__)
+
+# seconds, the best of a few runs, including the start of the interpreter
+BUDGET = float(os.environ.get('NEFIS_IMPORT_BUDGET', 2.0))
+HEAVY_MODULES = ('bokeh', 'mako', 'netCDF4', 'zarr', 'pyarrow')
+
+
+def run(args):
+    return subprocess.check_output([sys.executable] + args, cwd=os.path.dirname(os.path.dirname(__file__)))
+
+
+def best(args, repeat=3):
+    return min(timeit.repeat(lambda: run(args), number=1, repeat=repeat))
+
+
+def test_import_lazy():
+    code = 'import sys, nefis.dataset, nefis.cli; print(" ".join(sorted(sys.modules)))'
+    modules = set(run(['-c', code]).decode().split())
+    assert modules.isdisjoint(HEAVY_MODULES)
+
+
+def test_import_time():
+    seconds = best(['-c', 'import nefis.dataset'])
+    logger.info("import nefis.dataset: %.3fs", seconds)
+    assert seconds < BUDGET
+
+
+def test_help_time():
+    seconds = best(['-m', 'nefis.cli', '--help'])
+    logger.info("nefis --help: %.3fs", seconds)
+    assert seconds < BUDGET
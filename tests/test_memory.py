@@ -0,0 +1,93 @@
+import logging
+
+import pytest
+
+import nefis.dataset
+import nefis.stats
+import nefis.testing
+from .utils import f34_dataset
+
+f34_dataset = f34_dataset
+
+logger = logging.getLogger(__name__)
+
+
+def test_nbytes(f34_dataset):
+    ds = f34_dataset
+    s1 = ds.read('map-series', 'S1', t=slice(None))
+    assert ds.variables['S1'].nbytes(t=slice(None)) == s1.nbytes
+    assert ds.variables['S1'].nbytes(t=0) == s1[0].nbytes
+    # the output in float64 and a float32 read block
+    assert ds.nbytes('map-series', 'S1', t=slice(None), dtype='float64', chunk_size=1) == 2 * s1.nbytes + s1[0].nbytes
+
+
+def test_memory_budget(f34_dataset):
+    ds = f34_dataset
+    nbytes = ds.nbytes('map-series', 'S1', t=slice(None))
+    ds.memory_budget = nbytes - 1
+    try:
+        with pytest.raises(nefis.dataset.MemoryBudgetError) as excinfo:
+            ds.read('map-series', 'S1', t=slice(None))
+        assert excinfo.value.nbytes == nbytes
+        # single timesteps fit
+        ds.read('map-series', 'S1', t=0)
+    finally:
+        ds.memory_budget = None
+
+
+def test_allocations(f34_dataset):
+    ds = f34_dataset
+    nefis.stats.enable()
+    try:
+        ds.reset_stats()
+        s1 = ds.read('map-series', 'S1', t=slice(None), dtype='float64')
+        allocations = ds.allocations()
+        assert allocations['read']['bytes'] == s1.nbytes
+        assert allocations['getelt']['peak'] <= s1.nbytes // 2
+        assert 'getelt' in nefis.stats.allocations()
+    finally:
+        nefis.stats.disable()
+
+
+def test_parse_budget():
+    assert nefis.dataset.parse_budget('1048576') == 1048576
+    assert nefis.dataset.parse_budget(None) is None
+    assert nefis.dataset.parse_budget('0') is None
+    # invalid values are ignored with a warning instead of failing the import
+    assert nefis.dataset.parse_budget('1GB') is None
+
+
+def test_allocation_sites(tmpdir):
+    def_file = nefis.testing.make_synthetic(str(tmpdir.join('sites.def')), n=6, m=8, k=2, ntimes=4)
+    ds = nefis.dataset.Nefis(def_file)
+    nefis.stats.enable()
+    try:
+        ds.reset_stats()
+        series = ds.timeseries('map-series', 'S1', (2, 3))
+        records = ds.read_cell('map-series', t=slice(None), structured=True)
+        columns = ds.his['ZCURU'].to_columns()
+        allocations = ds.allocations()
+        # the outputs are allocated through the budget
+        assert allocations['timeseries']['bytes'] == series.nbytes
+        assert allocations['read_cell']['bytes'] == 2 * records.nbytes
+        assert allocations['his']['bytes'] == columns.nbytes
+    finally:
+        nefis.stats.disable()
+        ds.close()
+
+
+def test_read_cell_budget(tmpdir):
+    def_file = nefis.testing.make_synthetic(str(tmpdir.join('cells.def')), n=6, m=8, k=2, ntimes=4)
+    ds = nefis.dataset.Nefis(def_file)
+    try:
+        nbytes = 4 * ds.group_cell('map-series')['size']
+        # the buffer fits, the buffer and the records do not
+        ds.memory_budget = nbytes
+        ds.read_cell('map-series', t=slice(None))
+        with pytest.raises(nefis.dataset.MemoryBudgetError) as excinfo:
+            ds.read_cell('map-series', t=slice(None), structured=True)
+        assert excinfo.value.nbytes == 2 * nbytes
+        ds.memory_budget = 2 * nbytes
+        assert ds.read_cell('map-series', t=slice(None), structured=True).shape == (4, )
+    finally:
+        ds.close()
@@ -0,0 +1,113 @@
+import logging
+
+import numpy as np
+import pytest
+
+import nefis.dataset
+import nefis.merge
+import nefis.subset
+import nefis.testing
+import nefis.writer
+from .utils import f34_copy
+
+f34_copy = f34_copy
+
+logger = logging.getLogger(__name__)
+
+
+def test_merge_restart(f34_copy, tmpdir):
+    first = str(tmpdir.join('first.def'))
+    second = str(tmpdir.join('second.def'))
+    merged = str(tmpdir.join('merged.def'))
+    # the restarted segment repeats the last timestep of the first
+    nefis.subset.subset(f34_copy, first, time='0:2')
+    nefis.subset.subset(f34_copy, second, time='1:')
+    nefis.merge.merge([first, second], merged, flush_bytes=1024)
+    src = nefis.dataset.Nefis(f34_copy)
+    ds = nefis.dataset.Nefis(merged)
+    try:
+        for group, element in [('map-info-series', 'ITMAPC'), ('map-series', 'S1')]:
+            expected = src.read(group, element, t=slice(None))
+            assert np.all(ds.read(group, element, t=slice(None)) == expected)
+    finally:
+        ds.close()
+        src.close()
+
+
+def test_merge_definitions_differ(f34_copy, tmpdir):
+    part = str(tmpdir.join('part.def'))
+    nefis.subset.subset(f34_copy, part, elements=['S1'])
+    with pytest.raises(ValueError):
+        nefis.merge.merge([f34_copy, part], str(tmpdir.join('merged.def')))
+
+
+def test_merge_constant_groups(tmpdir):
+    first = nefis.testing.make_synthetic(str(tmpdir.join('first.def')), n=6, m=8, k=2, ntimes=3)
+    second = nefis.testing.make_synthetic(str(tmpdir.join('second.def')), n=6, m=8, k=2, ntimes=4)
+    merged = str(tmpdir.join('merged.def'))
+    nefis.merge.merge([first, second], merged)
+    src = nefis.dataset.Nefis(second)
+    ds = nefis.dataset.Nefis(merged)
+    try:
+        assert nefis.dataset.time_element(ds, 'map-const') is None
+        assert nefis.dataset.time_element(ds, 'map-series') == ('map-info-series', 'ITMAPC')
+        # the constant groups are copied once
+        for group in ('map-const', 'his-const'):
+            assert ds.time_range(group, slice(None))[3] == 1
+        assert np.all(ds.read('map-const', 'KCS') == src.read('map-const', 'KCS'))
+        # the timesteps of the second segment up to the last of the first are dropped
+        assert ds.read('map-info-series', 'ITMAPC', t=slice(None)).ravel().tolist() == [0, 1, 2, 3]
+        assert np.all(ds.read('map-series', 'S1', t=slice(None)) == src.read('map-series', 'S1', t=slice(None)))
+        assert np.all(ds.read('his-series', 'ZWL', t=slice(None)) == src.read('his-series', 'ZWL', t=slice(None)))
+    finally:
+        ds.close()
+        src.close()
+
+
+def write_segment(def_file, dps, fields):
+    schema = dict(
+        elements=dict(
+            DPS0=dict(dtype='float32', shape=(2, 3)),
+            S1=dict(dtype='float32', shape=(2, 3))
+        ),
+        groups={
+            'map-const': dict(elements=['DPS0'], series=False),
+            'map-series': ['S1']
+        }
+    )
+    with nefis.writer.NefisWriter(def_file, schema) as writer:
+        writer.append(0, {'DPS0': dps})
+        for t, field in enumerate(fields):
+            writer.append(t, {'S1': field})
+    return def_file
+
+
+def test_merge_series_without_time(tmpdir):
+    dps = np.ones((2, 3), dtype='float32')
+    fields = np.arange(5 * 2 * 3, dtype='float32').reshape(5, 2, 3)
+    # the second segment starts with the last timestep of the first
+    first = write_segment(str(tmpdir.join('first.def')), dps, fields[:3])
+    second = write_segment(str(tmpdir.join('second.def')), dps, fields[2:])
+    merged = str(tmpdir.join('merged.def'))
+    nefis.merge.merge([first, second], merged)
+    ds = nefis.dataset.Nefis(merged)
+    try:
+        assert np.all(ds.read('map-series', 'S1', t=slice(None)) == fields)
+        assert ds.time_range('map-const', slice(None))[3] == 1
+    finally:
+        ds.close()
+
+
+def test_merge_differing_constants(tmpdir):
+    fields = np.zeros((2, 2, 3), dtype='float32')
+    first = write_segment(str(tmpdir.join('first.def')), np.ones((2, 3), dtype='float32'), fields)
+    second = write_segment(str(tmpdir.join('second.def')), np.zeros((2, 3), dtype='float32'), fields)
+    merged = str(tmpdir.join('merged.def'))
+    with pytest.raises(ValueError):
+        nefis.merge.merge([first, second], merged)
+    nefis.merge.merge([first, second], merged, allow_differing_constants=True)
+    ds = nefis.dataset.Nefis(merged)
+    try:
+        assert np.all(ds.read('map-const', 'DPS0') == 1)
+    finally:
+        ds.close()
@@ -0,0 +1,59 @@
+import logging
+
+import numpy as np
+
+import nefis.dataset
+from .utils import f34_dataset
+
+f34_dataset = f34_dataset
+
+logger = logging.getLogger(__name__)
+
+
+def test_convert_block_packing():
+    block = np.array([[0.5, 1.0], [-999.0, 2.25]], dtype='float32')
+    out = np.empty(block.shape, dtype='int16')
+    nefis.dataset.convert_block(block, out, scale=0.25, offset=0.5, missing_value=-999, fill_value=-1)
+    assert np.all(out == [[0, 2], [-1, 7]])
+
+
+def test_read_dtype(f34_dataset):
+    native = f34_dataset.read('map-series', 'S1', t=slice(None))
+    assert native.dtype == np.float32
+    converted = f34_dataset.read('map-series', 'S1', t=slice(None), dtype=np.float64, chunk_size=1)
+    assert converted.dtype == np.float64
+    assert np.all(converted == native)
+
+
+def test_read_out(f34_dataset):
+    s1 = f34_dataset.variables['S1']
+    native = s1.read(slice(None))
+    out = np.zeros(native.shape, dtype='float32')
+    s1.read(slice(None), out=out, chunk_size=1)
+    assert np.all(out == native)
+    out = np.zeros(native.shape[1:], dtype='float16')
+    s1.read(0, out=out)
+    assert np.allclose(out, native[0], atol=1e-2)
+
+
+def test_read_plan(f34_dataset):
+    s1 = f34_dataset.variables['S1']
+    ntimes = f34_dataset.groups['map-series']['group_size']
+    plan = s1.read_plan(chunk_size=1)
+    assert len(plan) == ntimes
+    assert sum(n for _, _, n, _ in plan) == ntimes
+
+
+def test_get_data_strings(f34_dataset):
+    simdat = f34_dataset.get_data('map-const', 'SIMDAT', t=0)
+    assert isinstance(simdat, bytes)
+    assert f34_dataset.get_data('map-const', 'SIMDAT', t=slice(None)) == [simdat]
+    assert f34_dataset.get_data('map-const', 'SIMDAT', t=slice(1, None)) == []
+
+
+def test_convert_block_range():
+    block = np.array([100.0, -100.0, np.nan, 0.001], dtype='float32')
+    out = np.empty(block.shape, dtype='int16')
+    nefis.dataset.convert_block(block, out, scale=0.001, fill_value=-32768)
+    # out of range values are clipped, nan is the fill value, which stays reserved
+    assert out.tolist() == [32767, -32767, -32768, 1]
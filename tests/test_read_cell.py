@@ -0,0 +1,29 @@
+import logging
+
+import numpy as np
+
+from .utils import f34_dataset
+
+f34_dataset = f34_dataset
+
+logger = logging.getLogger(__name__)
+
+
+def test_read_cell(f34_dataset):
+    cell = f34_dataset.read_cell('map-series', 0)
+    assert list(cell.keys()) == list(f34_dataset.cells['map-series']['variables'])
+    assert np.all(cell['S1'] == f34_dataset.get_data('map-series', 'S1', t=0))
+
+
+def test_read_cell_structured(f34_dataset):
+    records = f34_dataset.read_cell('map-series', slice(None), structured=True)
+    ntimes = f34_dataset.groups['map-series']['group_size']
+    assert records.shape == (ntimes, )
+    assert records.dtype.itemsize == f34_dataset.cells['map-series']['size']
+    s1 = f34_dataset.get_data('map-series', 'S1', t=slice(None))
+    assert np.all(records['S1'] == s1)
+
+
+def test_read_cell_strings(f34_dataset):
+    cell = f34_dataset.read_cell('map-const', 0)
+    assert cell['SIMDAT'].dtype.kind == 'S'
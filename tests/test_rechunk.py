@@ -0,0 +1,45 @@
+import logging
+
+import numpy as np
+
+import nefis.dataset
+import nefis.rechunk
+from .utils import f34_copy
+
+f34_copy = f34_copy
+
+logger = logging.getLogger(__name__)
+
+
+def test_rechunk_npy(f34_copy):
+    ds = nefis.dataset.Nefis(f34_copy)
+    try:
+        s1 = ds.read('map-series', 'S1', t=slice(None))
+        nefis.rechunk.rechunk(ds, variables=['S1'], chunk_size=1)
+        assert ds.sidecar.rechunked('map-series', 'S1') is not None
+        series = ds.timeseries('map-series', 'S1', (2, 3))
+        assert np.all(series == s1[:, 2, 3])
+    finally:
+        ds.close()
+
+
+def test_timeseries_without_sidecar(f34_copy):
+    ds = nefis.dataset.Nefis(f34_copy, engine='nefis')
+    try:
+        u1 = ds.read('map-series', 'U1', t=slice(None))
+        series = ds.variables['U1'].timeseries((0, 2, 3), t=slice(1, None))
+        assert np.all(series == u1[1:, 0, 2, 3])
+    finally:
+        ds.close()
+
+
+def test_digests(f34_copy):
+    ds = nefis.dataset.Nefis(f34_copy)
+    try:
+        digests = ds.digests('map-series', 'S1', chunk_size=1)
+        assert len(digests) == ds.time_range('map-series', slice(None))[3]
+        assert ds.sidecar.digests('map-series', 'S1') == digests
+        assert ds.digest('map-series', 'S1', t=1) == digests[1]
+        assert ds.digest('map-series', 'U1', t=slice(0, 2)) == ds.digests('map-series', 'U1', save=False)[:2]
+    finally:
+        ds.close()
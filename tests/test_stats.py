@@ -0,0 +1,27 @@
+import logging
+
+import nefis.stats
+from .utils import f34_dataset
+
+f34_dataset = f34_dataset
+
+logger = logging.getLogger(__name__)
+
+
+def test_stats(f34_dataset):
+    ds = f34_dataset
+    nefis.stats.enable()
+    try:
+        nefis.stats.reset()
+        s1 = ds.read('map-series', 'S1', t=slice(None))
+        stats = ds.stats()
+        assert stats['getelt_into']['calls'] >= 1
+        assert stats['getelt_into']['bytes'] == s1.nbytes
+        assert sum(stats['getelt_into']['histogram']) == stats['getelt_into']['calls']
+        assert nefis.stats.snapshot()['getelt_into']['calls'] >= stats['getelt_into']['calls']
+        ds.reset_stats()
+        assert ds.stats() == {}
+    finally:
+        nefis.stats.disable()
+    ds.read('map-series', 'S1', t=0)
+    assert ds.stats() == {}
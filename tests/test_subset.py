@@ -0,0 +1,61 @@
+import logging
+
+import numpy as np
+
+import nefis.dataset
+import nefis.subset
+import nefis.testing
+from .utils import f34_copy
+
+f34_copy = f34_copy
+
+logger = logging.getLogger(__name__)
+
+
+def test_parse_time():
+    assert nefis.subset.parse_time('100:200:2') == slice(100, 200, 2)
+    assert nefis.subset.parse_time('5:') == slice(5, None)
+    assert nefis.subset.parse_time('3') == slice(3, 4)
+    assert nefis.subset.parse_time(None) == slice(None)
+
+
+def test_subset(f34_copy, tmpdir):
+    dst = str(tmpdir.join('subset.def'))
+    nefis.subset.subset(
+        f34_copy,
+        dst,
+        groups=['map-const', 'map-series'],
+        elements=['KCS', 'S1', 'U1'],
+        time='1::2'
+    )
+    src = nefis.dataset.Nefis(f34_copy)
+    ds = nefis.dataset.Nefis(dst)
+    try:
+        assert sorted(ds.elements) == ['KCS', 'S1', 'U1']
+        # map-const is not a series, time does not apply to it
+        assert not nefis.dataset.is_series(src, 'map-const')
+        assert ds.time_range('map-const', slice(None))[3] == src.time_range('map-const', slice(None))[3]
+        assert np.all(ds.read('map-const', 'KCS') == src.read('map-const', 'KCS'))
+        s1 = src.read('map-series', 'S1', t=slice(1, None, 2))
+        assert np.all(ds.read('map-series', 'S1', t=slice(None)) == s1)
+        u1 = src.read('map-series', 'U1', t=slice(1, None, 2))
+        assert np.all(ds.read('map-series', 'U1', t=slice(None)) == u1)
+    finally:
+        ds.close()
+        src.close()
+
+
+def test_subset_synthetic(tmpdir):
+    src = nefis.testing.make_synthetic(str(tmpdir.join('src.def')), n=6, m=8, k=2, ntimes=4)
+    dst = str(tmpdir.join('subset.def'))
+    nefis.subset.subset(src, dst, time='1::2')
+    src_ds = nefis.dataset.Nefis(src)
+    ds = nefis.dataset.Nefis(dst)
+    try:
+        assert ds.time_range('map-const', slice(None))[3] == 1
+        assert np.all(ds.read('map-const', 'KCS') == src_ds.read('map-const', 'KCS'))
+        assert ds.read('map-info-series', 'ITMAPC', t=slice(None)).ravel().tolist() == [1, 3]
+        assert np.all(ds.read('his-series', 'ZWL', t=slice(None)) == src_ds.read('his-series', 'ZWL', t=slice(1, None, 2)))
+    finally:
+        ds.close()
+        src_ds.close()
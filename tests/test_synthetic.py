@@ -0,0 +1,35 @@
+import logging
+
+import numpy as np
+
+import nefis.dataset
+import nefis.testing
+
+logger = logging.getLogger(__name__)
+
+
+def test_make_synthetic(tmpdir):
+    def_file = nefis.testing.make_synthetic(
+        str(tmpdir.join('synthetic.def')),
+        n=6,
+        m=8,
+        k=2,
+        ntimes=4,
+        elements=['S1', 'U1', 'W']
+    )
+    ds = nefis.dataset.Nefis(def_file)
+    try:
+        assert ds.time_range('map-series', slice(None))[3] == 4
+        assert ds.element_info('W')['shape'] == (3, 8, 6)
+        s1 = ds.read('map-series', 'S1', t=slice(None))
+        assert s1.shape == (4, 8, 6)
+        # deterministic, a second file has the same contents
+        again = nefis.testing.make_synthetic(str(tmpdir.join('again.def')), n=6, m=8, k=2, ntimes=4)
+        other = nefis.dataset.Nefis(again)
+        try:
+            assert np.all(other.read('map-series', 'S1', t=slice(None)) == s1)
+        finally:
+            other.close()
+        assert list(ds.his.stations)[0] == 'Station 0'
+    finally:
+        ds.close()
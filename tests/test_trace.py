@@ -0,0 +1,34 @@
+import json
+import logging
+
+import nefis.dataset
+import nefis.trace
+from .utils import f34_dataset
+
+f34_dataset = f34_dataset
+
+logger = logging.getLogger(__name__)
+
+
+def test_trace(f34_dataset, tmpdir):
+    ds = f34_dataset
+    tracer = nefis.trace.ChromeTrace()
+    nefis.dataset.add_hook(tracer)
+    try:
+        s1 = ds.read('map-series', 'S1', t=slice(None), dtype='float64')
+    finally:
+        nefis.dataset.remove_hook(tracer)
+    names = [event['name'] for event in tracer.events]
+    assert 'read_plan' in names
+    assert 'decode' in names
+    getelt = [event for event in tracer.events if event['name'] == 'getelt']
+    assert sum(event['args']['nbytes'] for event in getelt) == s1.size * 4
+    assert all(event['args']['element'] == 'S1' for event in getelt)
+    path = str(tmpdir.join('trace.json'))
+    tracer.save(path)
+    with open(path) as f:
+        trace = json.load(f)
+    assert len(trace['traceEvents']) == len(tracer.events)
+    # nothing is traced without hooks
+    ds.read('map-series', 'S1', t=0)
+    assert len(tracer.events) == len(trace['traceEvents'])
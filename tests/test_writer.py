@@ -0,0 +1,36 @@
+import logging
+
+import numpy as np
+
+import nefis.dataset
+import nefis.writer
+
+logger = logging.getLogger(__name__)
+
+
+def test_writer(tmpdir):
+    def_file = str(tmpdir.join('written.def'))
+    schema = dict(
+        elements=dict(
+            KCS=dict(dtype='int32', shape=(3, 4)),
+            NAMES=dict(dtype='S20', shape=(2, )),
+            S1=dict(dtype='float32', shape=(3, 4), unit='[ M ]')
+        ),
+        groups={
+            'map-const': dict(elements=['KCS', 'NAMES'], series=False),
+            'map-series': ['S1']
+        }
+    )
+    fields = np.random.rand(7, 3, 4).astype('float32')
+    with nefis.writer.NefisWriter(def_file, schema, buffer_size=3) as writer:
+        writer.append(0, {'KCS': np.ones((3, 4), 'int32'), 'NAMES': [b'a', b'b']})
+        for t, field in enumerate(fields):
+            writer.append(t, {'S1': field})
+    ds = nefis.dataset.Nefis(def_file)
+    try:
+        assert ds.element_info('S1')['dimensions'] == (4, 3)
+        assert np.all(ds.read('map-const', 'KCS') == 1)
+        assert np.all(ds.read('map-series', 'S1', t=slice(None)) == fields)
+        assert ds.time_range('map-series', slice(None))[3] == 7
+    finally:
+        ds.close()
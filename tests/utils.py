@@ -48,3 +48,21 @@ def f34_file():
     yield fp  # provide the fixture value
     error = nefis.cnefis.clsnef(fp)
     logger.debug("tearing down %s", dat_file)
+
+
+@pytest.fixture()
+def f34_dataset():
+    import nefis.dataset
+    def_file = os.path.join(TESTDIR, 'data/trim-f34.def')
+    ds = nefis.dataset.Nefis(def_file)
+    yield ds
+    ds.close()
+
+
+@pytest.fixture()
+def f34_copy(tmpdir):
+    """a copy of trim-f34 for tests that write next to the file"""
+    import shutil
+    for ext in ('.dat', '.def'):
+        shutil.copy(os.path.join(TESTDIR, 'data/trim-f34' + ext), str(tmpdir))
+    return str(tmpdir.join('trim-f34.def'))